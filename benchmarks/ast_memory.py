@@ -0,0 +1,82 @@
+"""
+Measure memory taken by the AST of a large program.
+
+Usage: python -m benchmarks.ast_memory [-t TARGET] [--functions N] [-o results.json]
+
+The program is a single file of benchmarks.generators with N functions, 2000 give about 100k lines.
+Macros are expanded and the tree is built as in cocas.api.assemble_text, with tracemalloc tracing.
+Memory of the tree is what stays allocated while it is alive, peak is the maximum during the build.
+"""
+import argparse
+import gc
+import json
+import sys
+import tracemalloc
+
+from benchmarks.generators import GENERATORS
+from cocas.api import get_library_macros
+from cocas.ast_builder import build_ast
+from cocas.location import CodeLocation, LineMarkTable
+from cocas.macro_processor import process_macros
+from cocas.stats import count_ast_nodes
+
+
+def _count_locations(node, seen: set) -> int:
+    """Count distinct CodeLocation objects of the tree"""
+    if isinstance(node, CodeLocation):
+        if id(node) in seen:
+            return 0
+        seen.add(id(node))
+        return 1
+    if isinstance(node, list):
+        return sum(_count_locations(item, seen) for item in node)
+    if hasattr(node, '__dataclass_fields__'):
+        # location of a node is not a dataclass field in older trees
+        names = set(node.__dataclass_fields__) | ({'location'} if hasattr(node, 'location') else set())
+        return sum(_count_locations(getattr(node, name), seen) for name in names)
+    return 0
+
+
+def measure(target: str, functions: int) -> dict:
+    name, text = next(iter(GENERATORS[target](files=1, functions=functions).items()))
+    library_macros = get_library_macros(target)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        start = tracemalloc.get_traced_memory()[0]
+        line_marks = LineMarkTable()
+        tree = build_ast(process_macros(text, library_macros, name, line_marks), name, line_marks)
+        gc.collect()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        'lines': text.count('\n'),
+        'nodes': count_ast_nodes(tree),
+        'locations': _count_locations(tree, set()),
+        'tree_bytes': current - start,
+        'peak_bytes': peak - start,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser('benchmarks.ast_memory')
+    parser.add_argument('-t', '--target', type=str, default='cdm16', choices=sorted(GENERATORS))
+    parser.add_argument('--functions', type=int, default=2000, help='number of functions in the program')
+    parser.add_argument('-o', '--output', type=str, help='write results to JSON file')
+    args = parser.parse_args()
+
+    result = measure(args.target, args.functions)
+    print(f'{args.target}: {result["lines"]} lines, {result["nodes"]} AST nodes, '
+          f'{result["locations"]} code locations')
+    print(f'  tree  {result["tree_bytes"] / 2 ** 20:8.1f} MiB, {result["tree_bytes"] / result["nodes"]:6.1f} bytes '
+          f'per node')
+    print(f'  peak  {result["peak_bytes"] / 2 ** 20:8.1f} MiB')
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=4)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,293 @@
+"""
+Generators of synthetic programs that stress every stage of the assembler.
+
+Every generator returns a mapping from file names to source code. Files contain
+relocatable sections that call functions of the next file through ext/entry labels,
+deeply nested if/while blocks, user-defined and library macros, and forward branches
+placed right around the short branch range, so that relaxation takes several passes.
+corpus collects them together with the examples, for checks that compare two implementations.
+"""
+import random
+from pathlib import Path
+
+EXAMPLES = Path(__file__).parent.parent / 'examples'
+
+
+class _Writer:
+    def __init__(self):
+        self.lines: list[str] = []
+        self.indent = 0
+
+    def __call__(self, line: str = ''):
+        self.lines.append('    ' * self.indent + line if line else '')
+
+    def text(self) -> str:
+        return '\n'.join(self.lines) + '\n'
+
+
+class _Target:
+    registers: list[str]
+    conditions: list[str]
+    # registers that are pushed and popped around blocks
+    saved: list[str]
+    # forward branch or goto to the label
+    near_branch: str
+    # short branch reaches label if distance from branch address plus offset is less than reach
+    reach: int
+    offset: int
+    # how much the branch grows when expanded
+    growth: int
+    # user macros defined in every file
+    macros: str
+
+    def leaf(self, w: _Writer, rng: random.Random, length: int):
+        raise NotImplementedError
+
+
+class _Cdm16(_Target):
+    registers = ['r0', 'r1', 'r2', 'r3', 'r4', 'r5']
+    conditions = ['eq', 'ne', 'lt', 'gt', 'le', 'ge', 'z', 'nz', 'cs', 'cc']
+    saved = ['r4', 'r5']
+    near_branch = 'bnz {label}'
+    reach = 1024
+    offset = 2
+    growth = 2
+    macros = """\
+macro swap/3
+    move $1, $3
+    move $2, $1
+    move $3, $2
+mend
+
+macro addc2/2
+    add $1, $2
+    if
+        tst $1
+    is mi
+        neg $1
+    fi
+mend
+"""
+
+    def leaf(self, w: _Writer, rng: random.Random, length: int):
+        r = self.registers
+        for _ in range(length):
+            kind = rng.randrange(9)
+            a, b, c = rng.sample(r, 3)
+            if kind == 0:
+                # short and long forms of ldi
+                w(f'ldi {a}, {rng.choice([rng.randrange(-64, 64), rng.randrange(64, 30000)])}')
+            elif kind == 1:
+                w(f'add {a}, {b}, {c}')
+            elif kind == 2:
+                w(f'sub {a}, {rng.randrange(1, 60)}')
+            elif kind == 3:
+                w(f'swap {a}, {b}, {c}')
+            elif kind == 4:
+                w(f'addc2 {a}, {b}')
+            elif kind == 5:
+                w(f'inc {a}')
+            elif kind == 6:
+                w(f'clr {a}')
+            elif kind == 7:
+                w(f'xor {a}, {b}, {c}')
+            else:
+                w(f'shl {a}')
+
+
+class _Cdm8e(_Target):
+    registers = ['r0', 'r1', 'r2', 'r3']
+    conditions = ['eq', 'ne', 'lt', 'gt', 'le', 'ge', 'z', 'nz', 'cs', 'cc']
+    saved = ['r2', 'r3']
+    near_branch = 'goto nz, {label}'
+    reach = 128
+    offset = 1
+    growth = 3
+    macros = """\
+macro swap/3
+    move $1, $3
+    move $2, $1
+    move $3, $2
+mend
+
+macro addc2/2
+    add $2, $1
+    if
+        tst $1
+    is mi
+        neg $1
+    fi
+mend
+"""
+
+    def leaf(self, w: _Writer, rng: random.Random, length: int):
+        r = self.registers
+        for _ in range(length):
+            kind = rng.randrange(8)
+            a, b, c = rng.sample(r, 3)
+            if kind == 0:
+                w(f'ldi {a}, {rng.randrange(256)}')
+            elif kind == 1:
+                w(f'add {a}, {b}')
+            elif kind == 2:
+                w(f'swap {a}, {b}, {c}')
+            elif kind == 3:
+                w(f'addc2 {a}, {b}')
+            elif kind == 4:
+                w(f'inc {a}')
+            elif kind == 5:
+                w(f'clr {a}')
+            elif kind == 6:
+                w(f'xor {a}, {b}')
+            else:
+                w(f'shl {a}')
+
+
+def _block(t: _Target, w: _Writer, rng: random.Random, depth: int, leaf_length: int):
+    if depth == 0:
+        t.leaf(w, rng, leaf_length)
+        return
+    kind = rng.randrange(3)
+    a, b = rng.sample(t.registers, 2)
+    if kind == 0:
+        w('if')
+        w.indent += 1
+        w(f'cmp {a}, {b}')
+        w.indent -= 1
+        w(f'is {rng.choice(t.conditions)}')
+        w.indent += 1
+        _block(t, w, rng, depth - 1, leaf_length)
+        w.indent -= 1
+        w('else')
+        w.indent += 1
+        _block(t, w, rng, depth - 1, leaf_length)
+        w.indent -= 1
+        w('fi')
+    elif kind == 1:
+        counter = t.saved[depth % len(t.saved)]
+        w(f'push {counter}')
+        w('while')
+        w.indent += 1
+        w(f'dec {counter}')
+        w.indent -= 1
+        w('stays nz')
+        w.indent += 1
+        _block(t, w, rng, depth - 1, leaf_length)
+        w.indent -= 1
+        w('wend')
+        w(f'pop {counter}')
+    else:
+        w('do')
+        w.indent += 1
+        _block(t, w, rng, depth - 1, leaf_length)
+        w(f'tst {a}')
+        w.indent -= 1
+        w(f'until {rng.choice(["z", "nz"])}')
+
+
+def _generate(t: _Target, files: int, functions: int, depth: int, leaf_length: int, seed: int) -> dict[str, str]:
+    rng = random.Random(seed)
+    sources = dict()
+    for k in range(files):
+        w = _Writer()
+        w(f'# generated file {k} of {files}')
+        w()
+        w(t.macros)
+        w(f'rsect module{k}')
+        # functions of the next file are called through external labels
+        callee = (k + 1) % files
+        if callee != k:
+            for j in range(functions):
+                w(f'f{callee}_{j}: ext')
+        w()
+        for j in range(functions):
+            w(f'f{k}_{j}>')
+            w.indent += 1
+            _block(t, w, rng, depth, leaf_length)
+            w(f'jsr f{callee}_{j}')
+            w('rts')
+            w.indent -= 1
+            w()
+
+        # chain of short forward branches, each one reaches its label only until
+        # the next one is expanded, so relaxation takes a pass per branch
+        chain = 4
+        w(f'relax{k}:')
+        w.indent += 1
+        for i in range(chain):
+            w(t.near_branch.format(label=f'relax{k}_{i}'))
+        w(f'ds {t.reach + t.offset - (chain - 1) * t.growth - 2 * chain}')
+        for i in range(chain):
+            w.indent -= 1
+            w(f'relax{k}_{i}:')
+            w.indent += 1
+            w(f'ds {2 + t.growth}')
+        w('rts')
+        w.indent -= 1
+        w('end')
+
+        # absolute section calls the first function of every file
+        if k == 0:
+            w()
+            w('asect 0')
+            for i in range(1, files):
+                if i != callee:
+                    w(f'f{i}_0: ext')
+            w('start:')
+            w.indent += 1
+            for i in range(files):
+                w(f'jsr f{i}_0')
+            w('halt')
+            w.indent -= 1
+            w('end')
+        sources[f'module{k}.asm'] = w.text()
+    return sources
+
+
+def cdm16_program(files: int = 6, functions: int = 16, depth: int = 4, leaf_length: int = 4,
+                  seed: int = 0) -> dict[str, str]:
+    """
+    Generate a synthetic cdm16 program
+
+    :param files: Number of source files
+    :param functions: Number of functions in every file
+    :param depth: Nesting depth of if/while/do blocks in every function
+    :param leaf_length: Number of plain instructions in innermost blocks
+    :param seed: Seed of random generator, same arguments always give the same program
+    :return: Mapping from file names to source code
+    """
+    return _generate(_Cdm16(), files, functions, depth, leaf_length, seed)
+
+
+def cdm8e_program(files: int = 6, functions: int = 16, depth: int = 4, leaf_length: int = 4,
+                  seed: int = 0) -> dict[str, str]:
+    """
+    Generate a synthetic cdm8e program, arguments are the same as of cdm16_program
+    """
+    return _generate(_Cdm8e(), files, functions, depth, leaf_length, seed)
+
+
+GENERATORS = {
+    'cdm16': cdm16_program,
+    'cdm8e': cdm8e_program,
+}
+
+
+def corpus(files: list[str] = (), functions: int = 16) -> dict[str, tuple[str, str]]:
+    """
+    Collect sources that the assembler is checked on: examples of every target, synthetic programs and more files
+
+    :param files: Paths of more cdm16 sources
+    :param functions: Number of functions in every file of synthetic programs
+    :return: Mapping from file names to targets and source code
+    """
+    sources = dict()
+    for target_dir in sorted(EXAMPLES.iterdir()):
+        for path in sorted(target_dir.glob('*.asm')):
+            sources[str(path)] = (target_dir.name, path.read_text())
+    for target, generator in GENERATORS.items():
+        for name, text in generator(functions=functions).items():
+            sources[f'{target}/{name}'] = (target, text)
+    for filepath in files:
+        sources[filepath] = ('cdm16', Path(filepath).read_text())
+    return sources
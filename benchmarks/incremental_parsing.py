@@ -0,0 +1,143 @@
+"""
+Check that sources edited with IncrementalParser have the same trees as sources parsed as a whole,
+and measure the time of an edit in a large source.
+
+Usage: python -m benchmarks.incremental_parsing [--edits N] [--seed S] [--measure] [--functions N] [files...]
+
+The corpus is the examples of every target, small synthetic programs from benchmarks.generators and files
+given on the command line. Every source gets N random edits, that insert and remove characters, lines
+and section headers, and half of them are undone by the next edit. After every edit the tree must be
+the same as the tree that build_ast builds from the whole edited source, with locations of its nodes,
+and an error must be reported if and only if the whole source has an error. Exit code is 1 if any tree differs.
+With --measure, edits of a single generated file with N functions are timed, 2000 give about 100k lines
+that take a while to parse as a whole.
+"""
+import argparse
+import random
+import sys
+import time
+
+from benchmarks.generators import GENERATORS, corpus
+from benchmarks.parser_corpus import tree
+from cocas.api import get_library_macros
+from cocas.ast_builder import build_ast
+from cocas.error import CdmException
+from cocas.incremental import IncrementalParser
+from cocas.location import LineMarkTable
+from cocas.macro_processor import process_macros
+
+_EDIT_LINES = ['    nop\n', '    ldi r0, 1\n', '\n', '# comment\n', 'rsect edited\n', 'asect 0x100\n', 'tplate t\n',
+               'lbl: ext\n', 'entry>\n', '    if\n', '    fi\n', '    is eq\n', 'end\n', '    ei\n', '    push r0\n',
+               '    ldi r0, 07\n', 'macro m/0\nnop\nmend\n', 'asect:\n', 'rsect> ext\n']
+_EDIT_CHARACTERS = ['\n', ' ', 'a', 'r', '0', ',', ':', '#', '"']
+
+
+def whole(text: str, filepath: str, library_macros):
+    """Tree of the source parsed as a whole, or None if it has an error"""
+    if not text.endswith('\n'):
+        text += '\n'
+    line_marks = LineMarkTable()
+    try:
+        return build_ast(process_macros(text, library_macros, filepath, line_marks), filepath, line_marks)
+    except (CdmException, ValueError, IndexError):
+        return None
+
+
+def _incremental(parse):
+    try:
+        return parse()
+    except (CdmException, ValueError, IndexError):
+        return None
+
+
+def _random_edit(rng: random.Random, text: str) -> tuple[int, int, str]:
+    kind = rng.randrange(5)
+    starts = [0] + [i + 1 for i, c in enumerate(text) if c == '\n' and i + 1 < len(text)]
+    if kind == 0:
+        return rng.choice(starts), 0, rng.choice(_EDIT_LINES)
+    if kind == 1:
+        line = rng.randrange(len(starts))
+        start = starts[line]
+        return start, starts[line + 1] if line + 1 < len(starts) else len(text), ''
+    position = rng.randrange(len(text) + 1)
+    if kind == 2:
+        return position, position, rng.choice(_EDIT_CHARACTERS)
+    if kind == 3:
+        return position, min(len(text), position + 1), ''
+    return position, min(len(text), position + rng.randrange(1, 80)), ''
+
+
+def check(name: str, text: str, target: str, edits: int, rng: random.Random) -> int:
+    """Edit the source, print every difference and return the number of edits with a different result"""
+    library_macros = get_library_macros(target)
+    parser = IncrementalParser(name, library_macros)
+    failed = 0
+    actual = _incremental(lambda: parser.parse(text))
+    for i in range(edits + 1):
+        expected = whole(text, name, library_macros)
+        if (actual is None) != (expected is None) or (actual is not None and tree(actual) != tree(expected)):
+            print(f'{name}: differs after {i} edits')
+            failed += 1
+            actual = _incremental(lambda: parser.parse(text))
+        if i == edits:
+            break
+        start, stop, replacement = _random_edit(rng, text)
+        undo = (start, start + len(replacement), text[start:stop])
+        text = text[:start] + replacement + text[stop:]
+        actual = _incremental(lambda: parser.edit(start, stop, replacement))
+        if rng.random() < 0.5:
+            start, stop, replacement = undo
+            text = text[:start] + replacement + text[stop:]
+            actual = _incremental(lambda: parser.edit(start, stop, replacement))
+    return failed
+
+
+def measure(target: str, functions: int):
+    """Parse a large source as a whole and after single-line edits, print the time of every one"""
+    name, text = next(iter(GENERATORS[target](files=1, functions=functions).items()))
+    parser = IncrementalParser(name, get_library_macros(target))
+    start = time.perf_counter()
+    parser.parse(text)
+    print(f'{target}: {text.count(chr(10))} lines, parsed in {(time.perf_counter() - start) * 1000:.0f} ms')
+    middle = text.index('\n', len(text) // 2) + 1
+    for description, edit in [('character typed', (middle, middle, ' ')),
+                              ('line inserted', (middle, middle, '    nop\n')),
+                              ('line removed', (middle, middle + len('    nop\n'), ''))]:
+        start = time.perf_counter()
+        parser.edit(*edit)
+        print(f'  {description}: {(time.perf_counter() - start) * 1000:.1f} ms')
+
+
+def check_corpus(sources: dict[str, tuple[str, str]], edits: int, seed: int) -> int:
+    """
+    Edit every source and compare its trees, see check
+
+    :param sources: Sources by file names, with their targets, see benchmarks.generators.corpus
+    :param edits: Number of edits of every source
+    :param seed: Seed of random edits
+    :return: Number of edits with a different result
+    """
+    rng = random.Random(seed)
+    return sum(check(filepath, text, target, edits, rng) for filepath, (target, text) in sources.items())
+
+
+def main():
+    parser = argparse.ArgumentParser('benchmarks.incremental_parsing')
+    parser.add_argument('--edits', type=int, default=10, help='number of edits of every source')
+    parser.add_argument('--seed', type=int, default=0, help='seed of random edits')
+    parser.add_argument('--measure', action='store_true', help='measure the time of edits in a large source')
+    parser.add_argument('--functions', type=int, default=2000, help='number of functions in the large source')
+    parser.add_argument('files', type=str, nargs='*', help='more cdm16 sources to check')
+    args = parser.parse_args()
+
+    sources = corpus(args.files, functions=4)
+    failed = check_corpus(sources, args.edits, args.seed)
+    print(f'{len(sources)} sources, {args.edits} edits of every one, {failed} differ')
+    if args.measure:
+        for target in GENERATORS:
+            measure(target, args.functions)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,129 @@
+"""
+Check that FastAsmLexer gives the same tokens and errors as the generated AsmLexer.
+
+Usage: python -m benchmarks.lexer_corpus [--fuzz N] [--seed S] [files...]
+
+The corpus is the examples of every target, synthetic programs from benchmarks.generators,
+files given on the command line and N random texts made of pieces of tokens, valid and broken ones.
+Sources are checked after macro expansion, the text is given to FastAsmLexer in chunks split
+at random places, so that tokens cross chunk boundaries. Exit code is 1 if any token stream differs.
+"""
+import argparse
+import random
+import sys
+import time
+
+from antlr4 import CommonTokenStream, InputStream
+from antlr4.error.ErrorListener import ErrorListener
+
+from benchmarks.generators import corpus
+from cocas.api import get_library_macros
+from cocas.chunked_stream import ChunkedInputStream, CopyTextTokenFactory
+from cocas.error import CdmException
+from cocas.fast_lexer import FastAsmLexer
+from cocas.generated.AsmLexer import AsmLexer
+from cocas.location import LineMarkTable
+from cocas.macro_processor import process_macros
+
+# pieces of valid and broken tokens that random texts are made of
+FUZZ_PIECES = [
+    'asect', 'rsect', 'tplate', 'if', 'ifs', 'is', 'macro', 'end', 'ends', 'r0', 'r12', 'r1a', 'r', 'rr1', 'fp',
+    'fp-', 'fp-0', 'fp-aZ9/+=', 'fpx-1', '_x', 'Word_1', '0', '007', '0b', '0b101', '0b102', '0x', '0xfF', '0xg',
+    '12ab', '"', '"abc"', '"a\\"b"', '"a\\\nb"', '"\\', '"unterminated', "'", "'a'", "'\\''", "'\\\n'", "'ab'",
+    "''", '-|', '-', '|', '.', ',', '+', ':', '*', '>', '(', ')', '#', '# comment', ' ', '\t', '\n', '\r\n', '\r',
+    '\\', '$', '@', 'é', '\x00', '￾', '￿', '\U0001f600',
+]
+
+
+class _RecordErrors(ErrorListener):
+    def __init__(self):
+        self.errors = []
+
+    def syntaxError(self, recognizer, offending_symbol, line, column, msg, e):
+        self.errors.append((line, column, msg))
+
+
+def tokens(lexer) -> tuple[list[tuple], list[tuple]]:
+    """Tokens of the lexer with their locations and channels, and syntax errors that it reports"""
+    errors = _RecordErrors()
+    lexer.removeErrorListeners()
+    lexer.addErrorListener(errors)
+    stream = CommonTokenStream(lexer)
+    stream.fill()
+    return [(t.type, t.text, t.start, t.stop, t.line, t.column, t.channel) for t in stream.tokens], errors.errors
+
+
+def split(text: str, rng: random.Random) -> list[str]:
+    """Split the text at random places, so that tokens cross chunk boundaries"""
+    cuts = sorted(rng.sample(range(1, len(text)), min(len(text) - 1, len(text) // 40 + 3))) if len(text) > 1 else []
+    return [text[i:j] for i, j in zip([0] + cuts, cuts + [len(text)])]
+
+
+def fuzz_text(rng: random.Random) -> str:
+    """A random text made of pieces of tokens"""
+    return ''.join(rng.choice(FUZZ_PIECES) for _ in range(rng.randrange(1, 60)))
+
+
+def compare(name: str, text: str, rng: random.Random, times: dict[str, float]) -> bool:
+    """Lex the text with both lexers, print the first difference and return True if there is none"""
+    start = time.perf_counter()
+    reference = AsmLexer(InputStream(text))
+    reference._factory = CopyTextTokenFactory.DEFAULT
+    expected = tokens(reference)
+    times['antlr'] += time.perf_counter() - start
+    start = time.perf_counter()
+    actual = tokens(FastAsmLexer(ChunkedInputStream(split(text, rng), name)))
+    times['fast'] += time.perf_counter() - start
+    if actual == expected:
+        return True
+    for kind, a, e in (('token', actual[0], expected[0]), ('error', actual[1], expected[1])):
+        for i, (x, y) in enumerate(zip(a + [None] * len(e), e + [None] * len(a))):
+            if x != y:
+                print(f'{name}: {kind} {i} differs, expected {y}, got {x}')
+                return False
+    return False
+
+
+def check(sources: dict[str, tuple[str, str]], fuzz: int, seed: int) -> tuple[int, int, dict[str, float]]:
+    """
+    Lex expanded sources and random texts with both lexers
+
+    :param sources: Sources by file names, with their targets, see benchmarks.generators.corpus
+    :param fuzz: Number of random texts
+    :param seed: Seed of random texts and chunk boundaries
+    :return: Number of checked texts, number of texts with different tokens and time of each lexer
+    """
+    rng = random.Random(seed)
+    times = {'antlr': 0.0, 'fast': 0.0}
+    checked = failed = 0
+    for filepath, (target, text) in sources.items():
+        if not text.endswith('\n'):
+            text += '\n'
+        try:
+            expanded = ''.join(process_macros(text, get_library_macros(target), filepath, LineMarkTable()).chunks())
+        except CdmException as e:
+            print(f'{filepath}: skipped, {e.description}')
+            continue
+        checked += 1
+        failed += not compare(filepath, expanded, rng, times)
+    for i in range(fuzz):
+        checked += 1
+        failed += not compare(f'fuzz {i}', fuzz_text(rng), rng, times)
+    return checked, failed, times
+
+
+def main():
+    parser = argparse.ArgumentParser('benchmarks.lexer_corpus')
+    parser.add_argument('--fuzz', type=int, default=2000, help='number of random texts')
+    parser.add_argument('--seed', type=int, default=0, help='seed of random texts and chunk boundaries')
+    parser.add_argument('files', type=str, nargs='*', help='more cdm16 sources to check')
+    args = parser.parse_args()
+
+    checked, failed, times = check(corpus(args.files), args.fuzz, args.seed)
+    print(f'{checked} texts, {failed} differ, AsmLexer {times["antlr"] * 1000:.0f} ms, '
+          f'FastAsmLexer {times["fast"] * 1000:.0f} ms')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,234 @@
+"""
+Check that FastAsmParser builds the same trees as AsmParser with BuildAstVisitor, and measure both.
+
+Usage: python -m benchmarks.parser_corpus [--fuzz N] [--seed S] [files...]
+
+The corpus is the examples of every target, synthetic programs from benchmarks.generators,
+files given on the command line and N random programs, that are then broken by replacing,
+removing and inserting tokens. Trees are compared with locations of their nodes.
+FastAsmParser must parse a program if and only if AsmParser and BuildAstVisitor accept it,
+as errors are reported by them. Exit code is 1 if any tree differs.
+"""
+import argparse
+import dataclasses
+import random
+import sys
+import time
+import tracemalloc
+from typing import Optional
+
+from antlr4 import CommonTokenStream, InputStream
+
+from benchmarks.generators import corpus
+from cocas.api import get_library_macros
+from cocas.ast_builder import BuildAstVisitor
+from cocas.error import AntlrErrorListener, CdmException, CdmExceptionTag
+from cocas.fast_lexer import FastAsmLexer
+from cocas.fast_parser import FastAsmParser
+from cocas.generated.AsmParser import AsmParser
+from cocas.location import LineMarkTable
+from cocas.macro_processor import process_macros
+
+# lines of code blocks, with names that are keywords and line marks of every kind
+FUZZ_LINES = [
+    'ldi r0, 5', 'add r1, r2', 'st r0, label', 'ldi r1, -x + 3 - y.z', 'ldi r1, high(x + 1)', 'dc "abc", \'a\'',
+    "dc '\\n'", 'ldi r0, 0x10 + 0b11 - 7', 'lbl:', 'lbl: ext', 'lbl> ext', 'entry>', 'lbl: nop', 'end:', 'if:',
+    'asect: jmp asect', 'is> halt', 'then: ext', 'fi: ldi r0, fi', 'break', 'continue', '-| 7 fp-0', '-| 3 fp-1',
+    '-| 4 fp-2', '-| 5 fp-1 info',
+]
+# lines that BuildAstVisitor cannot convert, with a number in wrong format and a line mark of unknown file
+FUZZ_BAD_LINES = ['ldi r0, 07', '-| 2 fp-9']
+FUZZ_TOKENS = ['ldi', 'r0', ',', ':', '>', '(', ')', '.', '+', '-', '5', 'if', 'is', 'end', 'ext', '\n', '"s"']
+
+
+def tree(node):
+    """Nodes as nested tuples, so that trees with their locations are compared and the first difference is printed"""
+    if isinstance(node, list):
+        return [tree(item) for item in node]
+    if dataclasses.is_dataclass(node):
+        return type(node).__name__, {f.name: tree(getattr(node, f.name)) for f in dataclasses.fields(node)}
+    return node
+
+
+def _tokens(text: str, filepath: str) -> CommonTokenStream:
+    lexer = FastAsmLexer(InputStream(text))
+    lexer.removeErrorListeners()
+    lexer.addErrorListener(AntlrErrorListener(CdmExceptionTag.ASM, filepath))
+    token_stream = CommonTokenStream(lexer)
+    token_stream.fill()
+    return token_stream
+
+
+def antlr_tree(token_stream: CommonTokenStream, filepath: str, line_marks: LineMarkTable):
+    parser = AsmParser(token_stream)
+    parser.mark_files = line_marks.files
+    parser.removeErrorListeners()
+    parser.addErrorListener(AntlrErrorListener(CdmExceptionTag.ASM, filepath))
+    return BuildAstVisitor(filepath, line_marks).visit(parser.program())
+
+
+def compare(name: str, text: str, filepath: str, line_marks: LineMarkTable, totals: dict[str, float]) -> bool:
+    """Parse the text with both parsers, print the difference and return True if there is none"""
+    try:
+        token_stream = _tokens(text, filepath)
+    except CdmException:
+        return True
+    start = time.perf_counter()
+    try:
+        expected = tree(antlr_tree(token_stream, filepath, line_marks))
+    except (CdmException, ValueError, IndexError) as e:
+        expected = f'error: {e}'
+    totals['antlr'] += time.perf_counter() - start
+    start = time.perf_counter()
+    actual = FastAsmParser(token_stream.tokens, filepath, line_marks).program()
+    totals['fast'] += time.perf_counter() - start
+    if actual is None:
+        if not isinstance(expected, str):
+            # correct, but slower, as the program is parsed twice
+            totals['fallbacks'] += 1
+        return True
+    if tree(actual) != expected:
+        print(f'{name}: expected {expected}\n  got {tree(actual)}')
+        return False
+    return True
+
+
+def fuzz_block(rng: random.Random, lines: list[str], depth: int):
+    """Add random lines and nested blocks of a code block to lines"""
+    for _ in range(rng.randrange(0, 6)):
+        kind = rng.randrange(8) if depth < 3 else 0
+        if kind == 1:
+            lines.append('if')
+            for _ in range(rng.randrange(1, 3)):
+                fuzz_block(rng, lines, depth + 1)
+                lines.append(f'is {rng.choice(["eq", "z"])}, {rng.choice(["and", "or", "xor"])}')
+            fuzz_block(rng, lines, depth + 1)
+            lines.append('is ne')
+            if rng.random() < 0.5:
+                lines.append('then')
+            fuzz_block(rng, lines, depth + 1)
+            if rng.random() < 0.5:
+                lines.append('else')
+                fuzz_block(rng, lines, depth + 1)
+            lines.append('fi')
+        elif kind == 2:
+            lines.append('while')
+            fuzz_block(rng, lines, depth + 1)
+            lines.append('stays nz')
+            fuzz_block(rng, lines, depth + 1)
+            lines.append('wend')
+        elif kind == 3:
+            lines.append('do')
+            fuzz_block(rng, lines, depth + 1)
+            lines.append('until z')
+        else:
+            lines.append(rng.choice(FUZZ_LINES if rng.random() < 0.99 else FUZZ_BAD_LINES))
+
+
+def fuzz_program(rng: random.Random) -> str:
+    """A random program of a few sections, some programs are broken token by token"""
+    lines = ['-| 1 fp-0']
+    for _ in range(rng.randrange(1, 3)):
+        lines.append(rng.choice(['asect 0', 'rsect r', 'tplate t', 'asect 0x10']))
+        fuzz_block(rng, lines, 0)
+    lines.append(rng.choice(['end', 'end', 'end:', 'end\nldi r0, 1']))
+    text = '\n'.join(lines) + '\n'
+    # break some programs token by token
+    if rng.random() < 0.5:
+        pieces = text.split(' ')
+        for _ in range(rng.randrange(1, 4)):
+            i = rng.randrange(len(pieces))
+            action = rng.randrange(3)
+            if action == 0:
+                pieces[i] = rng.choice(FUZZ_TOKENS)
+            elif action == 1 and len(pieces) > 1:
+                del pieces[i]
+            else:
+                pieces.insert(i, rng.choice(FUZZ_TOKENS))
+        text = ' '.join(pieces)
+    return text
+
+
+def fuzz_line_marks() -> LineMarkTable:
+    """Line marks that random programs refer to: a plain one, the start and the end of a macro expansion"""
+    line_marks = LineMarkTable()
+    line_marks.mark(1, 'a.asm')
+    line_marks.mark(1, 'm.mlb', 'mstart')
+    line_marks.mark(1, 'a.asm', 'mstop')
+    return line_marks
+
+
+def _memory(function) -> int:
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def check(sources: dict[str, tuple[str, str]], fuzz: int, seed: int, totals: dict[str, float],
+          memory: Optional[dict[str, int]] = None) -> tuple[int, int]:
+    """
+    Parse expanded sources and random programs with both parsers
+
+    :param sources: Sources by file names, with their targets, see benchmarks.generators.corpus
+    :param fuzz: Number of random programs
+    :param seed: Seed of random programs
+    :param totals: Dict that time of each parser and number of fallbacks are added to
+    :param memory: Dict that peak memory of each parser on sources is recorded to, None to not measure it
+    :return: Number of checked programs and number of programs with different trees
+    """
+    checked = failed = 0
+    for filepath, (target, text) in sources.items():
+        if not text.endswith('\n'):
+            text += '\n'
+        line_marks = LineMarkTable()
+        try:
+            expanded = ''.join(process_macros(text, get_library_macros(target), filepath, line_marks).chunks())
+        except CdmException as e:
+            print(f'{filepath}: skipped, {e.description}')
+            continue
+        checked += 1
+        failed += not compare(filepath, expanded, filepath, line_marks, totals)
+        if memory is None:
+            continue
+        # parsers do not rewind token streams, each one gets a stream of its own
+        token_stream = _tokens(expanded, filepath)
+        try:
+            memory['antlr'] = max(memory['antlr'], _memory(lambda: antlr_tree(token_stream, filepath, line_marks)))
+        except CdmException:
+            continue
+        tokens = _tokens(expanded, filepath).tokens
+        memory['fast'] = max(memory['fast'], _memory(lambda: FastAsmParser(tokens, filepath, line_marks).program()))
+
+    rng = random.Random(seed)
+    for i in range(fuzz):
+        checked += 1
+        failed += not compare(f'fuzz {i}', fuzz_program(rng), 'a.asm', fuzz_line_marks(), totals)
+    return checked, failed
+
+
+def main():
+    parser = argparse.ArgumentParser('benchmarks.parser_corpus')
+    parser.add_argument('--fuzz', type=int, default=5000, help='number of random programs')
+    parser.add_argument('--seed', type=int, default=0, help='seed of random programs')
+    parser.add_argument('files', type=str, nargs='*', help='more cdm16 sources to check')
+    args = parser.parse_args()
+
+    corpus_totals = {'antlr': 0.0, 'fast': 0.0, 'fallbacks': 0}
+    memory = {'antlr': 0, 'fast': 0}
+    checked, failed = check(corpus(args.files), 0, args.seed, corpus_totals, memory)
+    totals = dict(corpus_totals)
+    fuzz_checked, fuzz_failed = check(dict(), args.fuzz, args.seed, totals)
+    checked += fuzz_checked
+    failed += fuzz_failed
+
+    print(f'{checked} programs, {failed} differ, {totals["fallbacks"]} correct ones parsed by AsmParser')
+    print(f'corpus: AsmParser {corpus_totals["antlr"] * 1000:.0f} ms, peak {memory["antlr"] / 1024:.0f} KiB, '
+          f'FastAsmParser {corpus_totals["fast"] * 1000:.0f} ms, peak {memory["fast"] / 1024:.0f} KiB')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
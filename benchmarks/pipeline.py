@@ -0,0 +1,152 @@
+"""
+Measure time of every stage of the assembler on synthetic programs from benchmarks.generators.
+
+Usage: python -m benchmarks.pipeline [-t TARGET] [-n RUNS] [--scale N] [--save DIR] [-o results.json]
+
+Stages are run the same way as in cocas.api.assemble_text and cocas.assembler.assemble,
+but separately, so that each of them can be timed. Times of a stage are summed over files.
+Macro expansion is lazy, so macro_expansion covers parsing of macros, and expansion
+itself is measured as a part of lexing. AST is built while parsing, with no parse tree.
+Default programs have about 3000 instructions per target, --scale 4 gives about 12000,
+larger programs of cdm16 do not fit into its address space.
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+
+from antlr4 import CommonTokenStream
+
+from benchmarks.generators import GENERATORS
+from cocas.api import get_library_macros, load_target
+from cocas.assembler import Template, gather_local_labels, update_varying_length
+from cocas.code_block import Section
+from cocas.error import AntlrErrorListener, CdmExceptionTag
+from cocas.fast_lexer import FastAsmLexer
+from cocas.fast_parser import FastAsmParser
+from cocas.linker import link
+from cocas.location import LineMarkTable
+from cocas.macro_processor import process_macros
+from cocas.main import write_image
+from cocas.object_module import ObjectModule, ObjectSectionRecord
+
+STAGES = ['macro_expansion', 'lexing', 'parsing', 'sections', 'varying_length',
+          'object_records', 'link', 'write_image']
+
+
+class StageTimer:
+    def __init__(self):
+        self.times: dict[str, float] = defaultdict(float)
+
+    @contextmanager
+    def __call__(self, stage: str):
+        start = time.perf_counter()
+        yield
+        self.times[stage] += time.perf_counter() - start
+
+
+def assemble_source(timer: StageTimer, text: str, filepath: str, target: str) -> ObjectModule:
+    target_instructions, code_segments = load_target(target)
+    line_marks = LineMarkTable()
+    with timer('macro_expansion'):
+        expanded = process_macros(text, get_library_macros(target), filepath, line_marks)
+
+    with timer('lexing'):
+        lexer = FastAsmLexer(expanded)
+        lexer.removeErrorListeners()
+        lexer.addErrorListener(AntlrErrorListener(CdmExceptionTag.ASM, filepath))
+        token_stream = CommonTokenStream(lexer)
+        token_stream.fill()
+    with timer('parsing'):
+        pn = FastAsmParser(token_stream.tokens, filepath, line_marks).program()
+
+    with timer('sections'):
+        templates = [Template(t, code_segments, target_instructions) for t in pn.template_sections]
+        template_fields = dict([(t.name, t.labels) for t in templates])
+        asects = [Section(asect, target_instructions, code_segments) for asect in pn.absolute_sections]
+        rsects = [Section(rsect, target_instructions, code_segments) for rsect in pn.relocatable_sections]
+        asects.sort(key=lambda s: s.address)
+    with timer('varying_length'):
+        update_varying_length(asects, {}, template_fields)
+        asects_labels = gather_local_labels(asects)
+        for rsect in rsects:
+            update_varying_length([rsect], asects_labels, template_fields)
+    with timer('object_records'):
+        obj = ObjectModule()
+        obj.asects = [ObjectSectionRecord.from_section(asect, asects_labels, template_fields) for asect in asects]
+        obj.rsects = [ObjectSectionRecord.from_section(rsect, asects_labels, template_fields) for rsect in rsects]
+    return obj
+
+
+def run(sources: dict[str, str], target: str, image_path: str) -> tuple[dict[str, float], list[ObjectModule]]:
+    timer = StageTimer()
+    objects = [assemble_source(timer, text, name, target) for name, text in sources.items()]
+    with timer('link'):
+        data, _ = link(objects)
+    with timer('write_image'):
+        write_image(image_path, data)
+    return dict(timer.times), objects
+
+
+def main():
+    parser = argparse.ArgumentParser('benchmarks.pipeline')
+    parser.add_argument('-t', '--target', action='append', choices=list(GENERATORS),
+                        help='target to benchmark, may be repeated, all targets by default')
+    parser.add_argument('-n', '--runs', type=int, default=3, help='number of runs for every target')
+    parser.add_argument('--scale', type=int, default=1, help='multiply number of generated functions')
+    parser.add_argument('--save', type=str, help='also write generated sources to this directory')
+    parser.add_argument('-o', '--output', type=str, help='write results to JSON file')
+    args = parser.parse_args()
+
+    results = {}
+    for target in args.target or list(GENERATORS):
+        sources = GENERATORS[target](functions=16 * args.scale)
+        if args.save is not None:
+            target_dir = Path(args.save, target)
+            os.makedirs(target_dir, exist_ok=True)
+            for name, text in sources.items():
+                target_dir.joinpath(name).write_text(text)
+        # parsers and the macro library are loaded once, before measurements
+        get_library_macros(target)
+
+        runs = []
+        objects = []
+        with tempfile.TemporaryDirectory() as temp_dir:
+            for _ in range(args.runs):
+                times, objects = run(sources, target, os.path.join(temp_dir, 'out.img'))
+                runs.append(times)
+        records = [sect for obj in objects for sect in obj.asects + obj.rsects]
+        stages = {}
+        for stage in STAGES:
+            times = [r[stage] for r in runs]
+            stages[stage] = {'min': min(times), 'median': statistics.median(times), 'max': max(times)}
+        totals = [sum(r.values()) for r in runs]
+        results[target] = {
+            'files': len(sources),
+            'lines': sum(text.count('\n') for text in sources.values()),
+            # every instruction has its own code location
+            'instructions': sum(len(sect.code_locations) for sect in records),
+            'bytes': sum(len(sect.data) for sect in records),
+            'runs': args.runs,
+            'stages': stages,
+            'total': {'min': min(totals), 'median': statistics.median(totals), 'max': max(totals)},
+        }
+
+        print(f'{target}: {results[target]["files"]} files, {results[target]["lines"]} lines, '
+              f'{results[target]["instructions"]} instructions, {results[target]["bytes"]} bytes')
+        for stage in STAGES:
+            print(f'  {stage:16} median {stages[stage]["median"] * 1000:9.1f} ms')
+        print(f'  {"total":16} median {results[target]["total"]["median"] * 1000:9.1f} ms')
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
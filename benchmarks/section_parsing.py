@@ -0,0 +1,171 @@
+"""
+Check that programs parsed in chunks of top-level sections are the same as programs parsed as a whole,
+and measure parsing of a huge source in worker processes.
+
+Usage: python -m benchmarks.section_parsing [--fuzz N] [--seed S] [-j JOBS] [--tables N] [files...]
+
+The corpus is the examples of every target, synthetic programs from benchmarks.generators, files given
+on the command line and N random programs of several sections, with lines of benchmarks.parser_corpus
+and multiline strings that look like section headers. Chunks are parsed in this process,
+so that random programs are checked fast. A program parsed in chunks must be the same as parsed
+by FastAsmParser, or be parsed as a whole, and a program with an error must never be accepted in chunks.
+Exit code is 1 if any program differs.
+"""
+import argparse
+import random
+import sys
+import time
+from functools import partial
+
+from antlr4 import CommonTokenStream
+
+from benchmarks.generators import corpus
+from benchmarks.parser_corpus import FUZZ_TOKENS, fuzz_block, fuzz_line_marks, tree
+from cocas.api import get_library_macros
+from cocas.ast_builder import build_ast
+from cocas.chunked_stream import ChunkedInputStream
+from cocas.error import AntlrErrorListener, CdmException, CdmExceptionTag
+from cocas.fast_lexer import FastAsmLexer
+from cocas.fast_parser import FastAsmParser, _merge, _parse_chunk, _split
+from cocas.location import LineMarkTable
+from cocas.macro_processor import process_macros
+from cocas.stats import FileStats
+
+# a line break in a string must not split the program
+FUZZ_STRINGS = ['dc "a\\\nasect 0\\\n"', 'dc "\\\nrsect r\\\nend\\\n"', "dc '\\\n'"]
+
+
+def _whole(text: str, filepath: str, line_marks: LineMarkTable):
+    lexer = FastAsmLexer(ChunkedInputStream([text], filepath))
+    lexer.removeErrorListeners()
+    lexer.addErrorListener(AntlrErrorListener(CdmExceptionTag.ASM, filepath))
+    token_stream = CommonTokenStream(lexer)
+    try:
+        token_stream.fill()
+    except CdmException:
+        return None
+    result = FastAsmParser(token_stream.tokens, filepath, line_marks).program()
+    return None if result is None else (result, len(token_stream.tokens))
+
+
+def compare(name: str, text: str, filepath: str, line_marks: LineMarkTable, chunks: int, counts: dict) -> bool:
+    """Parse the text as a whole and in chunks, print the difference and return True if there is none"""
+    expected = _whole(text, filepath, line_marks)
+    parts = _split(text, filepath, line_marks, chunks)
+    actual = _merge(parts, list(map(partial(_parse_chunk, filepath=filepath, line_marks=line_marks), parts)))
+    if len(parts) < 2 or actual is None:
+        counts['whole' if expected is not None else 'errors'] += 1
+        return True
+    counts['chunks'] += 1
+    if expected is None:
+        print(f'{name}: has an error, but is parsed in {len(parts)} chunks')
+        return False
+    if (tree(actual[0]), actual[1]) != (tree(expected[0]), expected[1]):
+        print(f'{name}: differs when parsed in {len(parts)} chunks')
+        return False
+    return True
+
+
+def fuzz_sections(rng: random.Random) -> str:
+    """A random program of several sections, with strings that look like section headers, some programs are broken"""
+    lines = ['-| 1 fp-0']
+    for _ in range(rng.randrange(1, 6)):
+        lines.append(rng.choice(['asect 0', 'rsect r', 'tplate t', '  rsect q']))
+        fuzz_block(rng, lines, 0)
+        if rng.random() < 0.3:
+            # keywords that are labels do not start sections
+            lines.append(rng.choice(['asect:', 'rsect> ext', 'end: ldi r0, end']))
+    for _ in range(rng.randrange(0, 3)):
+        lines.insert(rng.randrange(1, len(lines) + 1), rng.choice(FUZZ_STRINGS))
+    # break some programs
+    if rng.random() < 0.2:
+        lines[rng.randrange(len(lines))] = rng.choice(FUZZ_TOKENS)
+    lines.append(rng.choice(['end', 'end', 'end\nasect 0\nend', 'end\n"']))
+    return '\n'.join(lines) + '\n'
+
+
+def table_program(tables: int) -> str:
+    """A huge program of relocatable sections with lookup tables"""
+    lines = []
+    for k in range(tables):
+        lines.append(f'rsect table{k}')
+        lines.append(f'table{k}>')
+        for i in range(50):
+            lines.append('    dc ' + ', '.join(str((k * 7 + i * 13 + j) % 256) for j in range(8)))
+        lines.append(f'lookup{k}>')
+        lines += ['    if', '        cmp r0, r1', '    is lt', f'        ldi r2, table{k}',
+                  '    else', '        clr r2', '    fi', '    rts']
+    lines.append('end')
+    return '\n'.join(lines) + '\n'
+
+
+def measure(tables: int, jobs: int):
+    """Parse the table program as a whole and in worker processes, print time of this process and in total"""
+    line_marks = LineMarkTable()
+    text = ''.join(process_macros(table_program(tables), get_library_macros('cdm16'), 'tables.asm',
+                                  line_marks).chunks())
+    trees = []
+    for j in (1, jobs):
+        stats = FileStats()
+        start = time.perf_counter()
+        trees.append(build_ast(ChunkedInputStream([text], 'tables.asm'), 'tables.asm', line_marks, stats, j))
+        wall = time.perf_counter() - start
+        cpu = sum(s.cpu for s in stats.stages.values())
+        print(f'{len(text)} characters, {stats.tokens} tokens, -j {j}: {wall * 1000:.0f} ms, '
+              f'{cpu * 1000:.0f} ms of cpu in this process')
+    if trees[0] != trees[1]:
+        print('the program differs when parsed in worker processes')
+        return False
+    return True
+
+
+def check(sources: dict[str, tuple[str, str]], fuzz: int, seed: int, chunks: int) -> tuple[int, int, dict[str, int]]:
+    """
+    Parse expanded sources and random programs as a whole and in chunks
+
+    :param sources: Sources by file names, with their targets, see benchmarks.generators.corpus
+    :param fuzz: Number of random programs
+    :param seed: Seed of random programs
+    :param chunks: Number of chunks to split programs into
+    :return: Number of checked programs, number of programs that differ and numbers of programs
+             parsed in chunks, parsed as a whole and with errors
+    """
+    counts = {'chunks': 0, 'whole': 0, 'errors': 0}
+    checked = failed = 0
+    for filepath, (target, text) in sources.items():
+        if not text.endswith('\n'):
+            text += '\n'
+        line_marks = LineMarkTable()
+        try:
+            expanded = ''.join(process_macros(text, get_library_macros(target), filepath, line_marks).chunks())
+        except CdmException as e:
+            print(f'{filepath}: skipped, {e.description}')
+            continue
+        checked += 1
+        failed += not compare(filepath, expanded, filepath, line_marks, chunks, counts)
+
+    rng = random.Random(seed)
+    for i in range(fuzz):
+        checked += 1
+        failed += not compare(f'fuzz {i}', fuzz_sections(rng), 'a.asm', fuzz_line_marks(), chunks, counts)
+    return checked, failed, counts
+
+
+def main():
+    parser = argparse.ArgumentParser('benchmarks.section_parsing')
+    parser.add_argument('--fuzz', type=int, default=5000, help='number of random programs')
+    parser.add_argument('--seed', type=int, default=0, help='seed of random programs')
+    parser.add_argument('-j', '--jobs', type=int, default=4, help='number of chunks and worker processes')
+    parser.add_argument('--tables', type=int, default=400, help='number of sections in the huge program')
+    parser.add_argument('files', type=str, nargs='*', help='more cdm16 sources to check')
+    args = parser.parse_args()
+
+    checked, failed, counts = check(corpus(args.files), args.fuzz, args.seed, args.jobs)
+    print(f'{checked} programs, {failed} differ, {counts["chunks"]} parsed in chunks, {counts["whole"]} '
+          f'parsed as a whole, {counts["errors"]} with errors')
+    failed += not measure(args.tables, args.jobs)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
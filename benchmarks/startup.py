@@ -0,0 +1,75 @@
+"""
+Measure cold-start latency of cocas: every run starts a new interpreter.
+
+Usage: python -m benchmarks.startup [-n RUNS] [-o results.json]
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).parent.parent
+
+SINGLE_FILE_SOURCE = """\
+asect 0
+start:
+    ldi r0, 10
+    while
+        tst r0
+    stays nz
+        dec r0
+    wend
+    halt
+end
+"""
+
+
+def measure(command: list[str], runs: int) -> dict:
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=REPO_ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+    return {
+        'runs': runs,
+        'min': min(times),
+        'median': statistics.median(times),
+        'max': max(times),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser('benchmarks.startup')
+    parser.add_argument('-n', '--runs', type=int, default=10, help='number of runs of each command')
+    parser.add_argument('-o', '--output', type=str, help='write results to JSON file')
+    args = parser.parse_args()
+
+    cocas = [sys.executable, '-m', 'cocas.main']
+    results = {}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source = Path(temp_dir, 'single.asm')
+        source.write_text(SINGLE_FILE_SOURCE)
+        image = str(Path(temp_dir, 'single.img'))
+        commands = {
+            'interpreter': [sys.executable, '-c', 'pass'],
+            'help': cocas + ['--help'],
+            'list_targets': cocas + ['-T'],
+            'single_file': cocas + ['--no-cache', '-o', image, str(source)],
+            'single_file_cached': cocas + ['--cache-dir', temp_dir, '-o', image, str(source)],
+        }
+        for name, command in commands.items():
+            results[name] = measure(command, args.runs)
+            print(f'{name:20} min {results[name]["min"] * 1000:8.1f} ms  '
+                  f'median {results[name]["median"] * 1000:8.1f} ms')
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+"""
+Python interface of the assembler. Sources are passed as strings and the linked
+image is returned in memory, so nothing is read from or written to files,
+except the standard macro library of the target, which is read once per process.
+
+Example::
+
+    from cocas.api import assemble_and_link
+
+    result = assemble_and_link({'main.asm': 'asect 0\\nhalt\\nend\\n'}, target='cdm16')
+    if result.ok:
+        print(result.image[:2])
+    else:
+        for diagnostic in result.diagnostics:
+            print(diagnostic)
+"""
+import functools
+import importlib
+import pathlib
+import pkgutil
+from dataclasses import dataclass, field
+from typing import Mapping, Optional, Union
+
+from cocas.error import CdmException, CdmExceptionTag, CdmLinkException
+from cocas.include import IncludeCache
+from cocas.location import CodeLocation, LineMarkTable
+from cocas.object_module import ObjectModule
+from cocas.stats import FileStats, stage, stage_items
+
+TARGETS_DIR = pathlib.Path(__file__).parent.joinpath('targets')
+
+
+def available_targets() -> list[str]:
+    """List names of all supported targets"""
+    return [module.name for module in pkgutil.iter_modules([str(TARGETS_DIR)])]
+
+
+def normalize_target(target: str) -> str:
+    """Convert target name as user writes it (e.g. CdM-16) to the name of its package (cdm16)"""
+    return target.replace('-', '').lower()
+
+
+def library_path(target: str) -> pathlib.Path:
+    """Absolute path to the standard macro library of the target"""
+    return TARGETS_DIR.joinpath(target, 'standard.mlb').absolute()
+
+
+def load_target(target: str):
+    """
+    Import instruction and code segment definitions of the target
+
+    :param target: Name of the target package in cocas.targets
+    :return: Tuple of TargetInstructions and CodeSegments classes
+    """
+    target_instructions = importlib.import_module(f'cocas.targets.{target}.target_instructions',
+                                                  'cocas').TargetInstructions
+    code_segments = importlib.import_module(f'cocas.targets.{target}.code_segments', 'cocas').CodeSegments
+    return target_instructions, code_segments
+
+
+@functools.cache
+def get_library_macros(target: str):
+    """
+    Standard macro library of the target, parsed once per process and shared afterwards
+
+    :param target: Name of the target package in cocas.targets
+    :return: Macro definitions in the format returned by read_mlb
+    """
+    from cocas.macro_processor import read_mlb
+    return read_mlb(str(library_path(target)))
+
+
+def assemble_text(text: str, filepath: str, target: str, library_macros,
+                  stats: Optional[FileStats] = None, includes: Optional[IncludeCache] = None,
+                  jobs: int = 1) -> ObjectModule:
+    """
+    Run macro expansion, parsing and assembly for one source
+
+    :param text: Source code
+    :param filepath: Name of the source, it is used in code locations and errors as is
+    :param target: Name of the target package in cocas.targets
+    :param library_macros: Macros read from the standard library of the target
+    :param stats: Statistics of the file to be filled, if they are collected
+    :param includes: Included files shared by sources of the build, None to parse them for this source only
+    :param jobs: Number of processes that parse top-level sections of the source, if it is huge
+    :return: Object module of the source
+    """
+    # front-end modules load generated parsers, which takes a noticeable time
+    from cocas.assembler import assemble
+    from cocas.ast_builder import build_ast
+    from cocas.chunked_stream import ChunkedInputStream
+    from cocas.macro_processor import process_macros
+
+    target_instructions, code_segments = load_target(target)
+    # tolerate files without newline at the end
+    if not text.endswith('\n'):
+        text += '\n'
+
+    line_marks = LineMarkTable()
+    with stage(stats, 'macros'):
+        # Macros (tst, clr but not if) are replaced to commands and wrapped by tags
+        # Remove comments
+        macro_expanded_input_stream = process_macros(text, library_macros, filepath, line_marks, includes,
+                                                     profile=stats.macros if stats is not None else None)
+    if stats is not None:
+        # macros are only parsed above, they are expanded while the result is lexed,
+        # expansion is measured as a part of the macros stage, not of lexing
+        macro_expanded_input_stream = ChunkedInputStream(
+            stage_items(stats, 'macros', macro_expanded_input_stream.chunks()), filepath)
+    r = build_ast(macro_expanded_input_stream, filepath, line_marks, stats, jobs)
+    return assemble(r, target_instructions, code_segments, stats)
+
+
+@dataclass
+class Diagnostic:
+    """Error of assembly or linking, as cocas would print it"""
+    # stage that reported the error: Macro, Assembler, Linker or MAIN for wrong arguments
+    tag: str
+    # name of the source, as given to assemble_and_link, or path of an included file, and line in it,
+    # None for errors of linking
+    file: Optional[str]
+    line: Optional[int]
+    message: str
+
+
+@dataclass
+class AssemblyResult:
+    """Image made by assemble_and_link, or diagnostics of why it could not be made"""
+    # None if assembly or linking failed
+    image: Optional[bytearray] = None
+    # locations in sources by addresses in the image
+    code_locations: dict[int, CodeLocation] = field(default_factory=dict)
+    diagnostics: list[Diagnostic] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        """Whether the image was made"""
+        return self.image is not None
+
+
+def assemble_and_link(sources: Union[str, Mapping[str, str]], target: str = 'cdm16') -> AssemblyResult:
+    """
+    Assemble sources and link them into an image. Errors are not raised or printed,
+    they are returned as diagnostics
+
+    :param sources: Source code or mapping from source names to their code, names
+                    are used in code locations and errors. Sources are linked in mapping order
+    :param target: Name of the target, as in -t option of cocas
+    :return: Image, its code locations and diagnostics
+    """
+    from cocas.linker import link
+
+    if isinstance(sources, str):
+        sources = {'<source>': sources}
+    target = normalize_target(target)
+    if target not in available_targets():
+        return AssemblyResult(diagnostics=[Diagnostic('MAIN', None, None, f'Unknown target {target}')])
+    if len(sources) == 0:
+        return AssemblyResult(diagnostics=[Diagnostic('MAIN', None, None, 'No sources provided')])
+
+    try:
+        library_macros = get_library_macros(target)
+        includes = IncludeCache()
+        objects = [assemble_text(text, name, target, library_macros, includes=includes)
+                   for name, text in sources.items()]
+        image, code_locations = link(objects)
+    except CdmException as e:
+        return AssemblyResult(diagnostics=[Diagnostic(e.tag, e.file, e.line, e.description)])
+    except CdmLinkException as e:
+        return AssemblyResult(diagnostics=[Diagnostic(CdmExceptionTag.LINK.value, None, None, e.message)])
+    return AssemblyResult(image, code_locations)
@@ -1,13 +1,14 @@
+from collections.abc import Iterator, Mapping
 from dataclasses import dataclass
-from typing import Type
+from typing import Optional, Type
 
 from cocas.ast_nodes import TemplateSectionNode, LabelDeclarationNode, InstructionNode, ProgramNode
 from cocas.code_block import Section
 from cocas.default_code_segments import CodeSegmentsInterface
 from cocas.default_instructions import TargetInstructionsInterface
 from cocas.error import CdmExceptionTag
-from cocas.location import CodeLocation
 from cocas.object_module import ObjectSectionRecord, ObjectModule
+from cocas.stats import FileStats, stage
 
 TAG = CdmExceptionTag.ASM
 
@@ -44,61 +45,93 @@ class Template:
         self.labels['_'] = size
 
 
-def gather_local_labels(sects: list[Section]):
-    local_labels = dict()
-    for sect in sects:
-        local_labels.update({p for p in sect.labels.items() if not p[0].startswith('$')})
-    return local_labels
+class LocalLabels(Mapping[str, int]):
+    """
+    Addresses of labels of sections, except for the generated ones, computed when they are needed.
+    Labels of later sections take precedence, and labels with known addresses take precedence over all of them.
+    """
 
+    def __init__(self, sects: list[Section], known_labels: Optional[Mapping[str, int]] = None):
+        self._known = known_labels or dict()
+        # sections do not get new labels after they are assembled, so they are looked up once
+        self._sects: dict[str, Section] = dict()
+        for sect in sects:
+            for name in sect.label_indices:
+                if not name.startswith('$'):
+                    self._sects[name] = sect
 
-@dataclass
-class VaryingLengthEntry:
-    seg: CodeSegmentsInterface.VaryingLengthSegment
-    sect: Section
-    pos: int
-    location: CodeLocation
-
-
-def update_varying_length(sections: list[Section], known_labels: dict[str, int],
-                          template_fields: dict[str, dict[str, int]]):
-    labels = gather_local_labels(sections)
-    labels.update(known_labels)
-    var_len_entries: list[VaryingLengthEntry] = []
+    def __getitem__(self, name: str) -> int:
+        if name in self._known:
+            return self._known[name]
+        return self._sects[name].labels[name]
+
+    def __contains__(self, name) -> bool:
+        return name in self._known or name in self._sects
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(dict.fromkeys(self._known) | dict.fromkeys(self._sects))
+
+    def __len__(self) -> int:
+        return len(self._known.keys() | self._sects.keys())
+
+
+def gather_local_labels(sects: list[Section]) -> LocalLabels:
+    return LocalLabels(sects)
+
+
+def update_varying_length(sections: list[Section], known_labels: Mapping[str, int],
+                          template_fields: dict[str, dict[str, int]], stats: Optional[FileStats] = None):
+    labels = LocalLabels(sections, known_labels)
+    # varying length segments of every section with their indices and sizes of other segments in front of them
+    var_len_entries = []
     for sect in sections:
-        pos = sect.address
-        for seg in sect.segments:
+        entries = []
+        pos = end = sect.address
+        for i, seg in enumerate(sect.segments):
             if isinstance(seg, CodeSegmentsInterface.VaryingLengthSegment):
-                a = VaryingLengthEntry(seg, sect, pos, seg.location)
-                var_len_entries.append(a)
+                entries.append((i, seg, pos - end))
+                end = pos + seg.size
             pos += seg.size
+        var_len_entries.append((sect, entries))
 
     changed = True
     while changed:
         changed = False
-        for vl in var_len_entries:
-            shift = vl.seg.update_varying_length(vl.pos, vl.sect, labels, template_fields)
-            if shift:
-                for other_vl in var_len_entries:
-                    if other_vl.sect is vl.sect and other_vl.pos > vl.pos:
-                        other_vl.pos += shift
-                changed = True
-
-
-def assemble(pn: ProgramNode, target_instructions, code_segments):
-    templates = [Template(t, code_segments, target_instructions) for t in pn.template_sections]
-    template_fields = dict([(t.name, t.labels) for t in templates])
-
-    asects = [Section(asect, target_instructions, code_segments) for asect in pn.absolute_sections]
-    rsects = [Section(rsect, target_instructions, code_segments) for rsect in pn.relocatable_sections]
-    asects.sort(key=lambda s: s.address)
-
-    update_varying_length(asects, {}, template_fields)
-    asects_labels = gather_local_labels(asects)
-    for rsect in rsects:
-        update_varying_length([rsect], asects_labels, template_fields)
-
-    obj = ObjectModule()
-    obj.asects = [ObjectSectionRecord(asect, asects_labels, template_fields) for asect in asects]
-    obj.rsects = [ObjectSectionRecord(rsect, asects_labels, template_fields) for rsect in rsects]
+        if stats is not None:
+            stats.relaxation_iterations += 1
+        for sect, entries in var_len_entries:
+            pos = sect.address
+            for i, seg, gap in entries:
+                pos += gap
+                shift = seg.update_varying_length(pos, sect, labels, template_fields)
+                if shift:
+                    sect.resize_segment(i, shift)
+                    changed = True
+                    if stats is not None:
+                        stats.resized_segments += 1
+                pos += seg.size
+
+
+def assemble(pn: ProgramNode, target_instructions, code_segments, stats: Optional[FileStats] = None):
+    with stage(stats, 'sections'):
+        templates = [Template(t, code_segments, target_instructions) for t in pn.template_sections]
+        template_fields = dict([(t.name, t.labels) for t in templates])
+
+        asects = [Section(asect, target_instructions, code_segments) for asect in pn.absolute_sections]
+        rsects = [Section(rsect, target_instructions, code_segments) for rsect in pn.relocatable_sections]
+        asects.sort(key=lambda s: s.address)
+    if stats is not None:
+        stats.segments += sum(len(sect.segments) for sect in asects + rsects)
+
+    with stage(stats, 'relaxation'):
+        update_varying_length(asects, {}, template_fields, stats)
+        asects_labels = gather_local_labels(asects)
+        for rsect in rsects:
+            update_varying_length([rsect], asects_labels, template_fields, stats)
+
+    with stage(stats, 'object_records'):
+        obj = ObjectModule()
+        obj.asects = [ObjectSectionRecord.from_section(asect, asects_labels, template_fields) for asect in asects]
+        obj.rsects = [ObjectSectionRecord.from_section(rsect, asects_labels, template_fields) for rsect in rsects]
 
     return obj
@@ -1,28 +1,33 @@
 from antlr4 import *
 from cocas.ast_nodes import *
 from cocas.ast_nodes import LabelDeclarationNode
-from cocas.generated.AsmLexer import AsmLexer
 from cocas.generated.AsmParser import AsmParser
 from cocas.generated.AsmParserVisitor import AsmParserVisitor
-from base64 import b64decode
 from cocas.error import AntlrErrorListener, CdmExceptionTag, CdmException
+from cocas.chunked_stream import ChunkedInputStream
+from cocas.fast_lexer import FastAsmLexer
+from cocas.fast_parser import PARALLEL_MIN_LENGTH, FastAsmParser, parse_in_chunks, paused_gc
+from cocas.location import NO_LOCATION, CodeLocation, LineMarkTable
+from cocas.stats import FileStats, count_ast_nodes, stage
+from typing import Optional
 
 
 # noinspection PyPep8Naming
 class BuildAstVisitor(AsmParserVisitor):
-    def __init__(self, filepath: str):
+    def __init__(self, filepath: str, line_marks: LineMarkTable):
         super().__init__()
+        self.line_marks = line_marks
         self.line_offset = 0
         # self.line_offset = 0
         self.source_path = filepath
         self.line_offset = 0
         self.in_macro = False
-        self.current_macro_file = ""
-        self.current_macro_line = 0
+        # location of the macro call, it is shared by all lines of the expansion
+        self.macro_location = NO_LOCATION
 
     def _ctx_location(self, ctx) -> CodeLocation:
         if self.in_macro:
-            return CodeLocation(self.current_macro_file, self.current_macro_line)
+            return self.macro_location
         return CodeLocation(self.source_path, ctx.start.line - self.line_offset)
 
     def visitProgram(self, ctx: AsmParser.ProgramContext) -> ProgramNode:
@@ -59,19 +64,16 @@ class BuildAstVisitor(AsmParserVisitor):
     def visitLine_mark(self, ctx: AsmParser.Line_markContext):
         # TODO: use already parsed values
         value = int(ctx.line_number().getText())
-        filepath = b64decode(ctx.filepath().getText()[3:]).decode()
-        self.source_path = filepath
+        mark_id = int(ctx.filepath().getText()[3:])
+        self.source_path = self.line_marks.files[mark_id]
         self.line_offset = ctx.start.line - value + 1
 
-        info = ctx.WORD()
-        if info is not None:
-            info = info.getText()
-            if info == 'mstart':
-                self.current_macro_line = value
-                self.current_macro_file = self.source_path
-                self.in_macro = True
-            elif info == 'mstop':
-                self.in_macro = False
+        info = self.line_marks.kinds[mark_id]
+        if info == 'mstart':
+            self.macro_location = CodeLocation(self.source_path, value)
+            self.in_macro = True
+        elif info == 'mstop':
+            self.in_macro = False
 
     def visitNumber(self, ctx: AsmParser.NumberContext) -> int:
         return int(ctx.getText(), base=0)
@@ -229,22 +231,57 @@ class BuildAstVisitor(AsmParserVisitor):
         return [self.visitArgument(i) for i in ctx.children if isinstance(i, AsmParser.ArgumentContext)]
 
 
-def build_ast(input_stream: InputStream, filepath: str):
-    lexer = AsmLexer(input_stream)
-    lexer.removeErrorListeners()
-    lexer.addErrorListener(AntlrErrorListener(CdmExceptionTag.ASM, filepath))
-    token_stream = CommonTokenStream(lexer)
-    token_stream.fill()
-    parser = AsmParser(token_stream)
-    parser.removeErrorListeners()
-    parser.addErrorListener(AntlrErrorListener(CdmExceptionTag.ASM, filepath))
-
-    cst = parser.program()  # it is already a tree with sections
-    # some magic happens in generated files. antlr makes a tree of program structure like in .g4
-
-    bav = BuildAstVisitor(filepath)
-
-    # Converts Context tree with ugly file position marks
-    # into tree of nodes from ast_nodes.py
-    result = bav.visit(cst)  # BuildAstVisitor.visitProgram
+def build_ast(input_stream: InputStream, filepath: str, line_marks: LineMarkTable,
+              stats: Optional[FileStats] = None, jobs: int = 1):
+    if jobs > 1:
+        with stage(stats, 'lexing'):
+            # macros are expanded, the text is lexed by worker processes
+            text = ''.join(input_stream.chunks())
+        if len(text) >= PARALLEL_MIN_LENGTH:
+            with stage(stats, 'parsing'):
+                parsed = parse_in_chunks(text, filepath, line_marks, jobs)
+            if parsed is not None:
+                result, tokens = parsed
+                if stats is not None:
+                    stats.tokens += tokens
+                    stats.ast_nodes += count_ast_nodes(result)
+                return result
+        # the program is parsed as a whole
+        input_stream = ChunkedInputStream([text], filepath)
+
+    with stage(stats, 'lexing'):
+        # macro processor produces text as the lexer reads it, tokens have their text copied
+        lexer = FastAsmLexer(input_stream)
+        lexer.removeErrorListeners()
+        lexer.addErrorListener(AntlrErrorListener(CdmExceptionTag.ASM, filepath))
+        token_stream = CommonTokenStream(lexer)
+        token_stream.fill()
+
+    with stage(stats, 'parsing'), paused_gc():
+        # most programs are parsed directly into AST, with no parse tree
+        result = FastAsmParser(token_stream.tokens, filepath, line_marks).program()
+
+    if result is None:
+        # the program has an error, AsmParser and BuildAstVisitor report it. It is parsed with LL prediction
+        # right away, as SLL prediction would fail on the error and the program would be parsed twice
+        token_stream.seek(0)
+        parser = AsmParser(token_stream)
+        parser.mark_files = line_marks.files
+        parser.removeErrorListeners()
+        parser.addErrorListener(AntlrErrorListener(CdmExceptionTag.ASM, filepath))
+
+        with stage(stats, 'parsing'):
+            cst = parser.program()  # it is already a tree with sections
+            # some magic happens in generated files. antlr makes a tree of program structure like in .g4
+
+        with stage(stats, 'ast'):
+            bav = BuildAstVisitor(filepath, line_marks)
+
+            # Converts Context tree with ugly file position marks
+            # into tree of nodes from ast_nodes.py
+            result = bav.visit(cst)  # BuildAstVisitor.visitProgram
+
+    if stats is not None:
+        stats.tokens += len(token_stream.tokens)
+        stats.ast_nodes += count_ast_nodes(result)
     return result
@@ -1,32 +1,32 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Optional
 
-from cocas.location import CodeLocation
+from cocas.location import NO_LOCATION, CodeLocation
 
 
-@dataclass
+@dataclass(slots=True)
 class RegisterNode:
     number: int
 
 
-@dataclass
+@dataclass(slots=True)
 class LabelNode:
     name: str
 
 
-@dataclass
+@dataclass(slots=True)
 class LocatableNode:
-    def __post_init__(self):
-        self.location: CodeLocation = CodeLocation()
+    # set by parsers to the location of the line, nodes in expressions have no location
+    location: CodeLocation = field(default=NO_LOCATION, kw_only=True)
 
 
-@dataclass
+@dataclass(slots=True)
 class TemplateFieldNode(LocatableNode):
     template_name: str
     field_name: str
 
 
-@dataclass
+@dataclass(slots=True)
 class RelocatableExpressionNode(LocatableNode):
     byte_specifier: Optional[str]
     add_terms: list
@@ -34,27 +34,27 @@ class RelocatableExpressionNode(LocatableNode):
     const_term: int
 
 
-@dataclass
+@dataclass(slots=True)
 class LabelDeclarationNode(LocatableNode):
     label: LabelNode
     entry: bool
     external: bool
 
 
-@dataclass
+@dataclass(slots=True)
 class InstructionNode(LocatableNode):
     mnemonic: str
     arguments: list
 
 
-@dataclass
+@dataclass(slots=True)
 class ConditionNode:
     lines: list
     branch_mnemonic: str
     conjunction: Optional[str]
 
 
-@dataclass
+@dataclass(slots=True)
 class ConditionalStatementNode:
     conditions: list
     then_lines: list
@@ -62,7 +62,7 @@ class ConditionalStatementNode:
     cond_location: CodeLocation
 
 
-@dataclass
+@dataclass(slots=True)
 class WhileLoopNode:
     condition_lines: list
     branch_mnemonic: str
@@ -70,49 +70,46 @@ class WhileLoopNode:
     mnem_location: CodeLocation
 
 
-@dataclass
+@dataclass(slots=True)
 class UntilLoopNode:
     lines: list
     branch_mnemonic: str
     mnem_location: CodeLocation
 
 
-@dataclass
+@dataclass(slots=True)
 class BreakStatementNode(LocatableNode):
     pass
 
 
-@dataclass
+@dataclass(slots=True)
 class ContinueStatementNode(LocatableNode):
     pass
 
 
-@dataclass
+@dataclass(slots=True)
 class SectionNode:
     lines: list
     # location of lines[i] is locations[i]
     locations: list[CodeLocation]
 
-    def __post_init__(self):
-        self.line_sources: list[CodeLocation] = []
 
-
-@dataclass
+@dataclass(slots=True)
 class AbsoluteSectionNode(SectionNode):
     address: int
 
 
-@dataclass
+@dataclass(slots=True)
 class RelocatableSectionNode(SectionNode):
     name: str
 
 
-@dataclass
+@dataclass(slots=True)
 class TemplateSectionNode(SectionNode):
     name: str
 
 
-@dataclass
+@dataclass(slots=True)
 class ProgramNode:
     template_sections: list[TemplateSectionNode]
     relocatable_sections: list[RelocatableSectionNode]
@@ -0,0 +1,132 @@
+from typing import Iterable, Iterator
+
+from antlr4 import Token
+from antlr4.CommonTokenFactory import CommonTokenFactory
+
+# buffered text that lexer cannot return to is dropped in pieces at least this long,
+# so that the buffer is not copied after every token
+_TRIM_THRESHOLD = 1024
+
+
+class ChunkedInputStream:
+    """
+    Character stream for ANTLR lexers that reads text from an iterable of chunks as lexer advances.
+    Only the text of the current token and the rest of the last read chunk are kept in memory,
+    so tokens must copy their text when they are created, see CopyTextTokenFactory.
+
+    Indices are absolute, as if all chunks were joined into one string.
+    """
+
+    def __init__(self, chunks: Iterable[str], name: str = '<stream>'):
+        self.name = name
+        self._chunks = iter(chunks)
+        self._exhausted = False
+        # buffer holds text starting at absolute index _start
+        self._buffer = ''
+        self._start = 0
+        self._index = 0
+        self._marks = 0
+
+    def _fill(self, index: int) -> bool:
+        """Read chunks until character at the absolute index is buffered, False if text is shorter"""
+        while index >= self._start + len(self._buffer):
+            if self._exhausted:
+                return False
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                self._exhausted = True
+                return False
+            self._buffer += chunk
+        return True
+
+    @property
+    def index(self):
+        return self._index
+
+    @property
+    def size(self):
+        # the total length is not known until all chunks are read
+        return self._start + len(self._buffer)
+
+    def reset(self):
+        self.seek(0)
+
+    def consume(self):
+        if self._index - self._start >= len(self._buffer) and not self._fill(self._index):
+            raise Exception("cannot consume EOF")
+        self._index += 1
+
+    def LA(self, offset: int):
+        # lexers look only at the next character, it is almost always buffered
+        if offset == 1 and self._index - self._start < len(self._buffer):
+            return ord(self._buffer[self._index - self._start])
+        if offset == 0:
+            return 0  # undefined
+        if offset < 0:
+            offset += 1  # e.g., translate LA(-1) to use offset=0
+        pos = self._index + offset - 1
+        if pos < self._start or not self._fill(pos):
+            return Token.EOF
+        return ord(self._buffer[pos - self._start])
+
+    def LT(self, offset: int):
+        return self.LA(offset)
+
+    def mark(self):
+        self._marks += 1
+        return -self._marks
+
+    def release(self, marker: int):
+        self._marks -= 1
+        if self._marks == 0:
+            # keep one character before the current one for LA(-1)
+            drop = self._index - 1 - self._start
+            if drop >= _TRIM_THRESHOLD:
+                self._buffer = self._buffer[drop:]
+                self._start += drop
+
+    def seek(self, _index: int):
+        if _index < self._start:
+            raise Exception(f"cannot seek to {_index}, text before {self._start} is released")
+        self._fill(_index)
+        self._index = min(_index, self._start + len(self._buffer))
+
+    def getText(self, start: int, stop: int):
+        if start < self._start:
+            raise Exception(f"cannot get text from {start}, text before {self._start} is released")
+        return self._buffer[start - self._start:stop - self._start + 1]
+
+    def chunks(self) -> Iterator[str]:
+        """
+        Read the rest of the text by chunks, for consumers that do not need to look back, see FastAsmLexer.
+        Read text is not buffered, so the stream cannot be used after that
+        """
+        rest = self._buffer[self._index - self._start:]
+        self._buffer = ''
+        self._start = self._index
+        if rest:
+            yield rest
+        yield from self._chunks
+        self._exhausted = True
+
+    def __str__(self):
+        return self._buffer
+
+
+class CopyTextTokenFactory(CommonTokenFactory):
+    """
+    Token factory that sets text of every token when it is created, so that tokens
+    do not refer back to the character stream. Unlike CommonTokenFactory(copyText=True),
+    it keeps the text of EOF token the same as if it was not copied
+    """
+
+    def __init__(self):
+        super().__init__(copyText=True)
+
+    def create(self, source, type: int, text: str, channel: int, start: int, stop: int, line: int, column: int):
+        if type == Token.EOF and text is None:
+            text = '<EOF>'
+        return super().create(source, type, text, channel, start, stop, line, column)
+
+
+CopyTextTokenFactory.DEFAULT = CopyTextTokenFactory()
@@ -1,4 +1,6 @@
+from collections.abc import Iterator, Mapping
 from dataclasses import dataclass
+from itertools import accumulate
 from typing import Type, Callable, Any
 
 from cocas import default_instructions, default_code_segments
@@ -7,7 +9,8 @@ from cocas.ast_nodes import LabelDeclarationNode, InstructionNode, \
     ContinueStatementNode, LocatableNode, SectionNode, AbsoluteSectionNode, \
     RelocatableSectionNode
 from cocas.error import CdmTempException, CdmException, CdmExceptionTag
-from cocas.location import CodeLocation
+from cocas.location import NO_LOCATION, CodeLocation
+from cocas.relaxation import SegmentOffsets
 
 
 @dataclass
@@ -21,12 +24,18 @@ class CodeBlock:
         self.size: int = 0
         self.loop_stack: list = []
         self.segments: list[code_segments.CodeSegment] = []
-        self.labels: dict[str, int] = dict()
+        # labels and code locations refer to indices of segments they precede,
+        # so that their addresses follow sizes of segments
+        self.label_indices: dict[str, int] = dict()
+        self.location_indices: list[tuple[int, CodeLocation]] = []
+        self.labels: Mapping[str, int] = LabelAddresses(self)
         self.ents: set[str] = set()
         self.exts: set[str] = set()
-        self.code_locations: dict[int, CodeLocation] = dict()
         temp_storage = dict()  # variable to save information for future lines
         self.assemble_lines(lines, temp_storage)
+        self.offsets = SegmentOffsets(list(accumulate((seg.size for seg in self.segments), initial=self.address)))
+        # addresses of segments since the last change of size
+        self._addresses: dict[int, int] = dict()
         try:
             # check that everything was ok with this block
             target_instructions.finish(temp_storage)
@@ -34,8 +43,35 @@ class CodeBlock:
             # if it isn't ok, must be at least one line
             raise CdmException(CdmExceptionTag.ASM, lines[-1].location.file, lines[-1].location.line, e.message)
 
+    def segment_address(self, index: int) -> int:
+        """
+        Get address of a segment
+
+        :param index: Index of the segment, or number of segments to get the end of the block
+        """
+        address = self._addresses.get(index)
+        if address is None:
+            address = self._addresses[index] = self.address + self.offsets.offset(index)
+        return address
+
+    def resize_segment(self, index: int, diff: int):
+        """
+        Move labels and code locations after a segment that changed its size
+
+        :param index: Index of the segment, that already has its new size
+        :param diff: Difference between the new and old size
+        """
+        self.offsets.add(index, diff)
+        self._addresses = dict()
+
+    @property
+    def code_locations(self) -> dict[int, CodeLocation]:
+        """Code locations by their offsets from the start of the block"""
+        offsets = list(accumulate((seg.size for seg in self.segments), initial=0))
+        return {offsets[index]: location for index, location in self.location_indices}
+
     def append_label(self, label_name):
-        self.labels[label_name] = self.address + self.size
+        self.label_indices[label_name] = len(self.segments)
 
     def append_branch_instruction(self, location, mnemonic, label_name, inverse):
         br = self.target_instructions.make_branch_instruction(location, mnemonic, label_name, inverse)
@@ -54,12 +90,12 @@ class CodeBlock:
         }
         for line in lines:
             if isinstance(line, LocatableNode):
-                self.code_locations[self.size] = line.location
+                self.location_indices.append((len(self.segments), line.location))
             ast_node_handlers[type(line)](line, temp_storage)
 
     def assemble_label_declaration(self, line: LabelDeclarationNode, __):
         label_name = line.label.name
-        if (label_name in self.labels or
+        if (label_name in self.label_indices or
                 label_name in self.ents or
                 label_name in self.exts):
             raise Exception(f'Duplicate label "{label_name}" declaration')
@@ -144,13 +180,33 @@ class CodeBlock:
         if len(self.loop_stack) == 0:
             raise Exception('"break" not allowed outside of a loop')
         _, finally_label = self.loop_stack[-1]
-        self.append_branch_instruction(CodeLocation(), 'anything', finally_label, False)
+        self.append_branch_instruction(NO_LOCATION, 'anything', finally_label, False)
 
     def assemble_continue_statement(self, _: ContinueStatementNode, __):
         if len(self.loop_stack) == 0:
             raise Exception('"continue" not allowed outside of a loop')
         cond_label, _ = self.loop_stack[-1]
-        self.append_branch_instruction(CodeLocation(), 'anything', cond_label, False)
+        self.append_branch_instruction(NO_LOCATION, 'anything', cond_label, False)
+
+
+class LabelAddresses(Mapping[str, int]):
+    """Addresses of labels of a code block, computed from current sizes of its segments"""
+
+    def __init__(self, block: CodeBlock):
+        self._block = block
+        self._indices = block.label_indices
+
+    def __getitem__(self, name: str) -> int:
+        return self._block.segment_address(self._indices[name])
+
+    def __contains__(self, name) -> bool:
+        return name in self._indices
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._indices)
+
+    def __len__(self) -> int:
+        return len(self._indices)
 
 
 @dataclass
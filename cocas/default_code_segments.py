@@ -1,4 +1,4 @@
-from cocas.location import CodeLocation
+from cocas.location import NO_LOCATION, CodeLocation
 from dataclasses import dataclass, field
 
 from typing import TYPE_CHECKING
@@ -17,7 +17,7 @@ class CodeSegmentsInterface:
         def __post_init__(self):
             # ugly hack to store code location in segments
             # now this whole project is one big and ugly hack
-            self.location: CodeLocation = CodeLocation()
+            self.location: CodeLocation = NO_LOCATION
 
         def fill(self, object_record: "ObjectSectionRecord", section: "Section", labels: dict[str, int],
                  templates: dict[str, dict[str, int]]):
@@ -27,4 +27,11 @@ class CodeSegmentsInterface:
     class VaryingLengthSegment(CodeSegment):
         def update_varying_length(self, pos, section: "Section", labels: dict[str, int],
                                   templates: dict[str, dict[str, int]]) -> int:
+            """
+            Change size of the segment for current addresses of labels.
+            Labels that follow the segment are moved by assembler, not by the segment.
+
+            :param pos: Address of the segment
+            :return: Difference between the new and old size
+            """
             pass
@@ -1,9 +1,11 @@
-from typing import Union
+from typing import TYPE_CHECKING, Callable, Union
 
 from antlr4.error.ErrorListener import ErrorListener
 from colorama import Fore, Style
 from enum import Enum
-from cocas.generated import AsmParser
+
+if TYPE_CHECKING:
+    from antlr4 import Parser
 
 
 class CdmExceptionTag(Enum):
@@ -48,13 +50,51 @@ def log_error(tag: str, message: str):
     print(message)
 
 
+def log_os_error(e: OSError):
+    message = e.strerror
+    if e.filename is not None:
+        message += f': {Style.BRIGHT}{e.filename}{Style.NORMAL}'
+    log_error("MAIN", message)
+
+
 class AntlrErrorListener(ErrorListener):
     def __init__(self, tag, file):
         self.file = file
         self.tag = tag
 
     def syntaxError(self, recognizer, offending_symbol, line, column, msg, e):
-        if isinstance(recognizer, AsmParser.AsmParser):
+        # AsmParser tracks line marks, checked without importing it as it is slow to load
+        if hasattr(recognizer, 'current_offset'):
             line = line - recognizer.current_offset
             self.file = recognizer.current_file
         raise CdmException(self.tag, self.file, line, msg)
+
+
+def parse_two_stage(make_parser: Callable[[], "Parser"], rule: str):
+    """
+    Parse with SLL prediction, that is faster, but stops at the first error and may fail
+    on valid text, and only if it fails, parse again with full LL prediction.
+    Errors are reported by the second stage exactly as if the text was parsed only once.
+
+    :param make_parser: Function that makes a parser with its own lexer and token stream,
+                        or with a token stream that is rewound to its start, and error listeners set
+    :param rule: Name of the start rule of the parser
+    :return: The parse tree
+    """
+    from antlr4 import PredictionMode
+    from antlr4.error.ErrorStrategy import BailErrorStrategy
+    from antlr4.error.Errors import ParseCancellationException
+
+    parser = make_parser()
+    parser.removeErrorListeners()
+    parser._errHandler = BailErrorStrategy()
+    parser._interp.predictionMode = PredictionMode.SLL
+    try:
+        # lexer errors stop the first stage too, so that they are reported
+        # in the same order relative to parser errors
+        parser.getTokenStream().fill()
+        return getattr(parser, rule)()
+    except (ParseCancellationException, CdmException):
+        # syntax errors and lexer errors are reported by the second stage
+        pass
+    return getattr(make_parser(), rule)()
@@ -0,0 +1,201 @@
+import re
+from typing import Union
+
+from antlr4 import InputStream, Token
+from antlr4.Token import CommonToken
+
+from cocas.chunked_stream import ChunkedInputStream, CopyTextTokenFactory
+from cocas.generated.AsmParser import AsmParser
+
+# Tokens of grammar/AsmLexer.g4. ANTLR takes the longest match, and the first rule among matches of the same
+# length, alternatives are ordered so that the first matching one is the same token. Keywords and registers
+# are matched as words and told apart by FastAsmLexer. Characters after U+FFFE match nothing, as in the grammar
+_TOKEN = re.compile(r'''
+    (?P<skip>[ \t]+|\#[^\n]*)
+  | (?P<newline>\r?\n)
+  | (?P<base64>fp-[a-zA-Z0-9/+=]+)
+  | (?P<word>[a-zA-Z_][a-zA-Z_0-9]*)
+  | (?P<binary>0b[01]+)
+  | (?P<hex>0x[0-9a-fA-F]+)
+  | (?P<decimal>[0-9]+)
+  | (?P<string>"[^"\\\n]*(?:\\.[^"\\\n]*)*")
+  | (?P<char>'(?:\\.|[^\\'\n])')
+  | (?P<line_mark>-\|)
+  | (?P<punctuation>[.,+\-:*>()])
+  | (?P<unexpected>[\x00-\ufffe])
+''', re.VERBOSE | re.DOTALL)
+
+# beginning of a string or character that may continue in the text that is not read yet,
+# escaped newline is the only way for a token to span lines
+_UNFINISHED_STRING = re.compile(r'"(?:[^"\\\n]|\\.)*\\?', re.DOTALL)
+_UNFINISHED_CHAR = re.compile(r"'(?:\\.?|[^\\'\n])?", re.DOTALL)
+
+_KEYWORDS = {
+    'asect': AsmParser.Asect, 'break': AsmParser.Break, 'continue': AsmParser.Continue, 'do': AsmParser.Do,
+    'else': AsmParser.Else, 'end': AsmParser.End, 'ext': AsmParser.Ext, 'fi': AsmParser.Fi, 'if': AsmParser.If,
+    'is': AsmParser.Is, 'macro': AsmParser.Macro, 'rsect': AsmParser.Rsect, 'stays': AsmParser.Stays,
+    'then': AsmParser.Then, 'tplate': AsmParser.Tplate, 'until': AsmParser.Until, 'wend': AsmParser.Wend,
+    'while': AsmParser.While,
+}
+_PUNCTUATION = {
+    '.': AsmParser.DOT, ',': AsmParser.COMMA, '+': AsmParser.PLUS, '-': AsmParser.MINUS, ':': AsmParser.COLON,
+    '*': AsmParser.ASTERISK, '>': AsmParser.ANGLE_BRACKET, '(': AsmParser.OPEN_PAREN, ')': AsmParser.CLOSE_PAREN,
+}
+_TYPES = {
+    'newline': AsmParser.NEWLINE, 'base64': AsmParser.BASE64, 'binary': AsmParser.BINARY_NUMBER,
+    'hex': AsmParser.HEX_NUMBER, 'decimal': AsmParser.DECIMAL_NUMBER, 'string': AsmParser.STRING,
+    'char': AsmParser.CHAR, 'line_mark': AsmParser.LINE_MARK_MARKER, 'unexpected': AsmParser.UNEXPECTED_TOKEN,
+}
+
+_new_token = CommonToken.__new__
+
+# text is lexed in pieces of at least this many characters, when it is read from chunks
+_READ_SIZE = 4096
+
+
+class FastAsmLexer:
+    """
+    Token source for AsmParser that gives the same tokens as the generated AsmLexer,
+    but matches them with a regular expression instead of running ANTLR lexer interpreter.
+    The text is read from ChunkedInputStream by chunks and lexed a piece at a time,
+    tokens have their text set, as if they were created by CopyTextTokenFactory.
+
+    The generated lexer is the reference, benchmarks/lexer_corpus.py checks that token streams are identical.
+    """
+
+    def __init__(self, input_stream: Union[ChunkedInputStream, InputStream]):
+        self._input = input_stream
+        if isinstance(input_stream, ChunkedInputStream):
+            self._chunks = input_stream.chunks()
+        else:
+            self._chunks = iter([str(input_stream)])
+        self._exhausted = False
+        self._factory = CopyTextTokenFactory.DEFAULT
+        self._listeners = []
+        self._token_source = (self, input_stream)
+        # text that is read, but not lexed yet, it starts at the absolute index _offset
+        self._text = ''
+        self._offset = 0
+        # index in _text where the current line starts, negative if it starts in the lexed text
+        self._line_start = 0
+        self.line = 1
+        self.column = 0
+        self._tokens: list[CommonToken] = []
+        self._next = 0
+
+    def addErrorListener(self, listener):
+        self._listeners.append(listener)
+
+    def removeErrorListeners(self):
+        self._listeners = []
+
+    def getSourceName(self) -> str:
+        return getattr(self._input, 'name', '<unknown>')
+
+    def getInputStream(self):
+        return self._input
+
+    def getTokenFactory(self):
+        return self._factory
+
+    def _token(self, token_type: int, text: str, start: int, stop: int, line: int, column: int) -> CommonToken:
+        # all fields are set here, the constructor would set most of them twice
+        token = _new_token(CommonToken)
+        token.source = self._token_source
+        token.type = token_type
+        token.channel = Token.DEFAULT_CHANNEL
+        token.start = start
+        token.stop = stop
+        token.tokenIndex = -1
+        token.line = line
+        token.column = column
+        token._text = text
+        return token
+
+    def _read(self, more: bool) -> int:
+        """
+        Read text up to the end of a line, return the index in _text where lexing must stop
+
+        :param more: Read at least one more chunk, as the text that is read cannot be lexed
+        """
+        while not self._exhausted and (more or len(self._text) < _READ_SIZE or not self._text.endswith('\n')):
+            more = False
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                self._exhausted = True
+            else:
+                self._text += chunk
+        return len(self._text) if self._exhausted else self._text.rfind('\n') + 1
+
+    def _recognition_error(self, index: int):
+        column = index - self._line_start
+        # the character is skipped if listeners do not raise an exception
+        for listener in self._listeners:
+            listener.syntaxError(self, None, self.line, column, f"token recognition error at: '{self._text[index]}'",
+                                 None)
+
+    def _lex(self):
+        """Lex the next piece of text into _tokens"""
+        self._tokens = []
+        self._next = 0
+        # nothing is lexed from the text left by the previous piece, it ends with an unfinished string
+        limit = self._read(bool(self._text))
+        text = self._text
+        tokens = self._tokens
+        pos = 0
+        line_start = self._line_start
+        for match in _TOKEN.finditer(text, 0, limit):
+            start = match.start()
+            while pos < start:
+                self._line_start = line_start
+                self._recognition_error(pos)
+                pos += 1
+            kind = match.lastgroup
+            pos = match.end()
+            if kind == 'skip':
+                continue
+            value = match.group()
+            if kind == 'word':
+                token_type = _KEYWORDS.get(value)
+                if token_type is None:
+                    token_type = AsmParser.REGISTER if value[0] == 'r' and value[1:].isdigit() else AsmParser.WORD
+            elif kind == 'punctuation':
+                token_type = _PUNCTUATION[value]
+            elif kind == 'unexpected' and value in '"\'' and not self._exhausted:
+                unfinished = _UNFINISHED_STRING if value == '"' else _UNFINISHED_CHAR
+                if unfinished.fullmatch(text, start, limit):
+                    # the string may end in the text that is not read yet, it is lexed with the next piece
+                    pos = start
+                    break
+                token_type = AsmParser.UNEXPECTED_TOKEN
+            else:
+                token_type = _TYPES[kind]
+            tokens.append(self._token(token_type, value, self._offset + start, self._offset + pos - 1,
+                                      self.line, start - line_start))
+            if token_type == AsmParser.NEWLINE:
+                self.line += 1
+                line_start = pos
+            elif token_type == AsmParser.STRING or token_type == AsmParser.CHAR:
+                newlines = value.count('\n')
+                if newlines:
+                    self.line += newlines
+                    line_start = start + value.rfind('\n') + 1
+        else:
+            while pos < limit:
+                self._line_start = line_start
+                self._recognition_error(pos)
+                pos += 1
+
+        self._text = text[pos:]
+        self._offset += pos
+        self._line_start = line_start - pos
+        self.column = -self._line_start
+
+    def nextToken(self) -> CommonToken:
+        while self._next == len(self._tokens):
+            if self._exhausted and not self._text:
+                return self._token(Token.EOF, '<EOF>', self._offset, self._offset - 1, self.line, self.column)
+            self._lex()
+        token = self._tokens[self._next]
+        self._next += 1
+        return token
@@ -0,0 +1,495 @@
+import gc
+import pickle
+import re
+from contextlib import contextmanager
+from dataclasses import dataclass
+from functools import partial
+from typing import Optional
+
+from antlr4 import CommonTokenStream, Token
+from antlr4.Token import CommonToken
+from antlr4.error.ErrorListener import ErrorListener
+
+from cocas.ast_nodes import *
+from cocas.chunked_stream import ChunkedInputStream
+from cocas.fast_lexer import FastAsmLexer
+from cocas.generated.AsmParser import AsmParser
+from cocas.location import NO_LOCATION, CodeLocation, LineMarkTable
+
+# tokens that can be a name, keywords are names when they are not in their place in the grammar
+_NAMES = frozenset([AsmParser.Asect, AsmParser.Break, AsmParser.Continue, AsmParser.Do, AsmParser.Else,
+                    AsmParser.End, AsmParser.Ext, AsmParser.Fi, AsmParser.If, AsmParser.Is, AsmParser.Macro,
+                    AsmParser.Rsect, AsmParser.Stays, AsmParser.Then, AsmParser.Tplate, AsmParser.Until,
+                    AsmParser.Wend, AsmParser.While, AsmParser.WORD])
+_NUMBERS = frozenset([AsmParser.DECIMAL_NUMBER, AsmParser.HEX_NUMBER, AsmParser.BINARY_NUMBER])
+_LABEL_MARKS = frozenset([AsmParser.COLON, AsmParser.ANGLE_BRACKET])
+_SECTIONS = frozenset([AsmParser.Asect, AsmParser.Rsect, AsmParser.Tplate])
+
+# programs are split into chunks that are parsed in parallel only if their text is at least this long,
+# smaller ones are parsed faster than worker processes are started
+PARALLEL_MIN_LENGTH = 500_000
+# lines that start a top-level section or end the program, unless the keyword is a label
+_SECTION_START = re.compile(r'^[ \t]*(asect|rsect|tplate|end)(?![a-zA-Z_0-9])(?![ \t]*[:>])', re.MULTILINE)
+# line marks as they are written by LineMarkTable.mark
+_LINE_MARK = re.compile(r'^-\| ([0-9]+) fp-([0-9]+)\n', re.MULTILINE)
+
+
+@contextmanager
+def paused_gc():
+    """
+    Disable garbage collector in with-block. Trees of FastAsmParser are made of many small objects
+    without reference cycles, collections that are triggered while they are built find no garbage,
+    but take most of the time of parsing of a large program. It must not cover other stages:
+    parse trees of ANTLR parsers have cycles, their garbage is only freed by the collector
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class _Fallback(Exception):
+    """The program has an error, it is parsed by AsmParser to report the error the same way"""
+
+
+class _StopOnError(ErrorListener):
+    def syntaxError(self, recognizer, offending_symbol, line, column, msg, e):
+        raise _Fallback()
+
+
+@dataclass
+class _Chunk:
+    """Text of consecutive top-level sections of a program"""
+    text: str
+    # number of the first line of the chunk in the program
+    line: int
+    # state of line marks at the start of the chunk, None for the first chunk, that starts with line marks
+    state: Optional[tuple]
+    # the chunk ends with the end of program
+    last: bool
+
+
+def _parse_chunk(chunk: _Chunk, filepath: str, line_marks: LineMarkTable) -> Optional[bytes]:
+    """
+    Lex and parse the chunk in a worker process
+
+    :return: Pickled sections of the chunk, state of line marks at its end and number of tokens,
+             or None if the chunk has an error
+    """
+    with paused_gc():
+        lexer = FastAsmLexer(ChunkedInputStream([chunk.text], filepath))
+        lexer.line = chunk.line
+        lexer.removeErrorListeners()
+        lexer.addErrorListener(_StopOnError())
+        token_stream = CommonTokenStream(lexer)
+        ret = ProgramNode([], [], [])
+        try:
+            token_stream.fill()
+            parser = FastAsmParser(token_stream.tokens, filepath, line_marks)
+            if chunk.state is None:
+                parser._prologue()
+            else:
+                parser._set_state(chunk.state)
+            parser._sections(ret)
+            if chunk.last:
+                parser._expect(AsmParser.End)
+            elif parser.types[parser.pos] != Token.EOF:
+                return None
+        except _Fallback:
+            return None
+        # the tree is pickled with garbage collector paused, executor would pickle it after the with-block
+        return pickle.dumps((ret, parser._state(), len(token_stream.tokens)), pickle.HIGHEST_PROTOCOL)
+
+
+def _split(text: str, filepath: str, line_marks: LineMarkTable, count: int) -> list[_Chunk]:
+    """Split the text into at most count chunks of about the same length"""
+    starts = []
+    for match in _SECTION_START.finditer(text):
+        if match.group(1) == 'end':
+            break
+        starts.append(match.start())
+    # the first chunk starts with the text, with line marks before the first section
+    bounds = [0]
+    for start in starts[1:]:
+        if start - bounds[-1] >= len(text) / count:
+            bounds.append(start)
+
+    # line marks are replayed to find their state at the start of every chunk
+    tracker = FastAsmParser([], filepath, line_marks)
+    marks = _LINE_MARK.finditer(text, 0, bounds[-1])
+    mark = next(marks, None)
+    chunks = []
+    pos = 0
+    line = 1
+    for start, stop in zip(bounds, bounds[1:] + [len(text)]):
+        while mark is not None and mark.start() < start:
+            line += text.count('\n', pos, mark.start())
+            pos = mark.start()
+            try:
+                tracker._mark(line, int(mark.group(1)), int(mark.group(2)))
+            except IndexError:
+                # the mark is not written by the macro processor, state is found by parsing the whole program
+                return []
+            mark = next(marks, None)
+        line += text.count('\n', pos, start)
+        pos = start
+        chunks.append(_Chunk(text[start:stop], line, tracker._state() if start else None, stop == len(text)))
+    return chunks
+
+
+def _merge(chunks: list[_Chunk], results: list[Optional[bytes]]) -> Optional[tuple[ProgramNode, int]]:
+    """Merge sections of chunks into the program, if every chunk is parsed as it would be in the whole program"""
+    ret = ProgramNode([], [], [])
+    # every chunk but the last one ends with EOF that is not a token of the program
+    tokens = 1 - len(chunks)
+    for i, result in enumerate(results):
+        if result is None:
+            return None
+        part, state, count = pickle.loads(result)
+        # split points and states of line marks are only guessed from the text, such as a line
+        # in a multiline string that starts with a section keyword, and are checked here
+        if i + 1 < len(chunks) and chunks[i + 1].state != state:
+            return None
+        ret.absolute_sections += part.absolute_sections
+        ret.relocatable_sections += part.relocatable_sections
+        ret.template_sections += part.template_sections
+        tokens += count
+    return ret, tokens
+
+
+def parse_in_chunks(text: str, filepath: str, line_marks: LineMarkTable,
+                    jobs: int) -> Optional[tuple[ProgramNode, int]]:
+    """
+    Lex and parse a huge program in worker processes. The text produced by macro processor is split
+    into chunks at lines that start top-level sections, as sections share nothing but the state
+    of line marks. The state at the start of every chunk is found from line marks before it.
+    Chunks are parsed in parallel and their sections are merged in order
+
+    :param text: The whole text produced by macro processor
+    :param filepath: Path to the source file
+    :param line_marks: Line marks of the text
+    :param jobs: Number of worker processes
+    :return: The tree and the number of tokens, or None if the program must be parsed as a whole,
+             either because it cannot be split or because a chunk has an error
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    chunks = _split(text, filepath, line_marks, jobs)
+    if len(chunks) < 2:
+        return None
+    with ProcessPoolExecutor(len(chunks)) as executor:
+        results = list(executor.map(partial(_parse_chunk, filepath=filepath, line_marks=line_marks), chunks))
+    return _merge(chunks, results)
+
+
+class FastAsmParser:
+    """
+    Recursive descent parser of grammar/AsmParser.g4 that builds the same nodes as BuildAstVisitor,
+    without building the parse tree. Keywords are told apart from names by the next token, as names
+    are always followed by colon or angle bracket when both are possible.
+
+    Only correct programs are parsed: on a syntax error, or on an error that BuildAstVisitor would
+    report, parsing stops and the program must be parsed by AsmParser, so that errors and their
+    order are exactly the same.
+    """
+
+    def __init__(self, tokens: list[CommonToken], filepath: str, line_marks: LineMarkTable):
+        self.types = [token.type for token in tokens]
+        self.texts = [token.text for token in tokens]
+        self.lines = [token.line for token in tokens]
+        self.pos = 0
+        self.line_marks = line_marks
+        # state of line marks, the same as in BuildAstVisitor
+        self.source_path = filepath
+        self.line_offset = 0
+        self.in_macro = False
+        self.macro_location = NO_LOCATION
+
+    def _state(self) -> tuple:
+        return self.source_path, self.line_offset, self.in_macro, self.macro_location
+
+    def _set_state(self, state: tuple):
+        self.source_path, self.line_offset, self.in_macro, self.macro_location = state
+
+    def _location(self, line: int) -> CodeLocation:
+        if self.in_macro:
+            # lines of a macro expansion share the location of the call
+            return self.macro_location
+        return CodeLocation(self.source_path, line - self.line_offset)
+
+    def _expect(self, token_type: int) -> str:
+        if self.types[self.pos] != token_type:
+            raise _Fallback()
+        self.pos += 1
+        return self.texts[self.pos - 1]
+
+    def _newlines(self):
+        """NEWLINE+"""
+        self._expect(AsmParser.NEWLINE)
+        while self.types[self.pos] == AsmParser.NEWLINE:
+            self.pos += 1
+
+    def _is_label(self) -> bool:
+        return self.types[self.pos] in _NAMES and self.types[self.pos + 1] in _LABEL_MARKS
+
+    def _name(self) -> str:
+        if self.types[self.pos] not in _NAMES:
+            raise _Fallback()
+        self.pos += 1
+        return self.texts[self.pos - 1]
+
+    def _number(self) -> int:
+        if self.types[self.pos] not in _NUMBERS:
+            raise _Fallback()
+        self.pos += 1
+        try:
+            return int(self.texts[self.pos - 1], base=0)
+        except ValueError:
+            raise _Fallback()
+
+    def program(self) -> Optional[ProgramNode]:
+        """
+        Parse the program
+
+        :return: The tree or None if the program must be parsed by AsmParser
+        """
+        try:
+            return self._program()
+        except _Fallback:
+            return None
+
+    def _program(self) -> ProgramNode:
+        ret = ProgramNode([], [], [])
+        self._prologue()
+        self._sections(ret)
+        # text after the end of program is not parsed, as by AsmParser
+        self._expect(AsmParser.End)
+        return ret
+
+    def _prologue(self):
+        types = self.types
+        while types[self.pos] == AsmParser.NEWLINE:
+            self.pos += 1
+        self._line_mark()
+        while types[self.pos] == AsmParser.LINE_MARK_MARKER:
+            self._line_mark()
+
+    def _sections(self, ret: ProgramNode):
+        types = self.types
+        while types[self.pos] in _SECTIONS:
+            section_type = types[self.pos]
+            self.pos += 1
+            if section_type == AsmParser.Asect:
+                address = self._number()
+            else:
+                name = self._name()
+            self._newlines()
+            lines, locations = self._code_block()
+            if section_type == AsmParser.Asect:
+                ret.absolute_sections.append(AbsoluteSectionNode(lines, locations, address))
+            elif section_type == AsmParser.Rsect:
+                ret.relocatable_sections.append(RelocatableSectionNode(lines, locations, name))
+            else:
+                ret.template_sections.append(TemplateSectionNode(lines, locations, name))
+
+    def _line_mark(self):
+        start_line = self.lines[self.pos]
+        self._expect(AsmParser.LINE_MARK_MARKER)
+        value_text = self._expect(AsmParser.DECIMAL_NUMBER)
+        filepath_text = self._expect(AsmParser.BASE64)
+        if self.types[self.pos] == AsmParser.WORD:
+            self.pos += 1
+        self._newlines()
+        try:
+            self._mark(start_line, int(value_text), int(filepath_text[3:]))
+        except (ValueError, IndexError):
+            raise _Fallback()
+
+    def _mark(self, start_line: int, value: int, mark_id: int):
+        self.source_path = self.line_marks.files[mark_id]
+        info = self.line_marks.kinds[mark_id]
+        self.line_offset = start_line - value + 1
+        if info == 'mstart':
+            self.macro_location = CodeLocation(self.source_path, value)
+            self.in_macro = True
+        elif info == 'mstop':
+            self.in_macro = False
+
+    def _code_block(self) -> tuple[list, list[CodeLocation]]:
+        ret = []
+        locations = []
+        types = self.types
+        while True:
+            token_type = types[self.pos]
+            if token_type == AsmParser.LINE_MARK_MARKER:
+                self._line_mark()
+                continue
+            start_line = self.lines[self.pos]
+            if token_type == AsmParser.WORD or self._is_label():
+                nodes = self._line()
+            elif token_type == AsmParser.If:
+                nodes = [self._conditional()]
+            elif token_type == AsmParser.While:
+                nodes = [self._while_loop()]
+            elif token_type == AsmParser.Do:
+                nodes = [self._until_loop()]
+            elif token_type == AsmParser.Break:
+                self.pos += 1
+                self._newlines()
+                nodes = [BreakStatementNode()]
+            elif token_type == AsmParser.Continue:
+                self.pos += 1
+                self._newlines()
+                nodes = [ContinueStatementNode()]
+            else:
+                return ret, locations
+            # location is taken after the nested blocks, with their line marks
+            location = self._location(start_line)
+            for node in nodes:
+                if isinstance(node, LocatableNode):
+                    node.location = location
+                locations.append(location)
+            ret += nodes
+
+    def _line(self) -> list:
+        types = self.types
+        if self._is_label():
+            is_entry = types[self.pos + 1] == AsmParser.ANGLE_BRACKET
+            label = LabelDeclarationNode(LabelNode(self.texts[self.pos]), is_entry, False)
+            self.pos += 2
+            if types[self.pos] != AsmParser.WORD:
+                if types[self.pos] == AsmParser.Ext:
+                    self.pos += 1
+                    label.external = True
+                self._newlines()
+                if label.entry and label.external:
+                    # BuildAstVisitor reports it
+                    raise _Fallback()
+                return [label]
+            ret = [label]
+        else:
+            ret = []
+        mnemonic = self._expect(AsmParser.WORD)
+        arguments = []
+        if types[self.pos] != AsmParser.NEWLINE:
+            arguments.append(self._argument())
+            while types[self.pos] == AsmParser.COMMA:
+                self.pos += 1
+                arguments.append(self._argument())
+        self._newlines()
+        ret.append(InstructionNode(mnemonic, arguments))
+        return ret
+
+    def _argument(self):
+        token_type = self.types[self.pos]
+        text = self.texts[self.pos]
+        if token_type == AsmParser.CHAR:
+            self.pos += 1
+            return ord(text[2]) if text[1] == '\\' else ord(text[1])
+        if token_type == AsmParser.STRING:
+            self.pos += 1
+            return text[1:-1]
+        if token_type == AsmParser.REGISTER:
+            self.pos += 1
+            return RegisterNode(int(text[1:]))
+        if token_type in _NAMES and self.types[self.pos + 1] == AsmParser.OPEN_PAREN:
+            self.pos += 2
+            expr = self._addr_expr()
+            self._expect(AsmParser.CLOSE_PAREN)
+            expr.byte_specifier = text
+            return expr
+        return self._addr_expr()
+
+    def _addr_expr(self) -> RelocatableExpressionNode:
+        add_terms = []
+        sub_terms = []
+        const_term = 0
+        types = self.types
+        first = True
+        while first or types[self.pos] == AsmParser.PLUS or types[self.pos] == AsmParser.MINUS:
+            minus = types[self.pos] == AsmParser.MINUS
+            if minus or types[self.pos] == AsmParser.PLUS:
+                self.pos += 1
+            first = False
+            term = self._term()
+            if minus:
+                if isinstance(term, int):
+                    const_term -= term
+                else:
+                    sub_terms.append(term)
+            else:
+                if isinstance(term, int):
+                    const_term += term
+                else:
+                    add_terms.append(term)
+        return RelocatableExpressionNode(None, add_terms, sub_terms, const_term)
+
+    def _term(self):
+        if self.types[self.pos] in _NUMBERS:
+            return self._number()
+        name = self._name()
+        if self.types[self.pos] == AsmParser.DOT:
+            self.pos += 1
+            return TemplateFieldNode(name, self._name())
+        return LabelNode(name)
+
+    def _condition(self) -> ConditionNode:
+        lines, _ = self._code_block()
+        self._expect(AsmParser.Is)
+        return ConditionNode(lines, self._expect(AsmParser.WORD), None)
+
+    def _conditional(self) -> ConditionalStatementNode:
+        self.pos += 1
+        self._newlines()
+        cond_location = self._location(self.lines[self.pos])
+        conditions = []
+        while True:
+            condition = self._condition()
+            conditions.append(condition)
+            if self.types[self.pos] != AsmParser.COMMA:
+                break
+            self.pos += 1
+            condition.conjunction = self._expect(AsmParser.WORD)
+            self._newlines()
+            if condition.conjunction != 'and' and condition.conjunction != 'or':
+                # BuildAstVisitor reports it
+                raise _Fallback()
+        self._newlines()
+        if self.types[self.pos] == AsmParser.Then and not self._is_label():
+            self.pos += 1
+            self._newlines()
+        then_lines, _ = self._code_block()
+        else_lines = []
+        if self.types[self.pos] == AsmParser.Else:
+            self.pos += 1
+            self._newlines()
+            else_lines, _ = self._code_block()
+        self._expect(AsmParser.Fi)
+        self._newlines()
+        return ConditionalStatementNode(conditions, then_lines, else_lines, cond_location)
+
+    def _while_loop(self) -> WhileLoopNode:
+        self.pos += 1
+        self._newlines()
+        condition_lines, _ = self._code_block()
+        self._expect(AsmParser.Stays)
+        mnemonic_line = self.lines[self.pos]
+        mnemonic = self._expect(AsmParser.WORD)
+        self._newlines()
+        lines, _ = self._code_block()
+        self._expect(AsmParser.Wend)
+        self._newlines()
+        return WhileLoopNode(condition_lines, mnemonic, lines, self._location(mnemonic_line))
+
+    def _until_loop(self) -> UntilLoopNode:
+        self.pos += 1
+        self._newlines()
+        lines, _ = self._code_block()
+        self._expect(AsmParser.Until)
+        mnemonic_line = self.lines[self.pos]
+        mnemonic = self._expect(AsmParser.WORD)
+        self._newlines()
+        return UntilLoopNode(lines, mnemonic, self._location(mnemonic_line))
@@ -9,7 +9,7 @@ else:
 	from typing.io import TextIO
 
 
-from base64 import b64decode
+
 
 def serializedATN():
     return [
@@ -277,10 +277,23 @@ class AsmParser ( Parser ):
 
 
 
+        # paths of line mark ids, LineMarkTable.files of the source being parsed
+        self.mark_files = []
         self.current_file = ''
         self.current_line = 0
         self.current_offset = 0
 
+        def mark_file(token):
+            # line marks are made by the macro processor, but a source may contain them too
+            mark_id = token.text[3:]
+            if not mark_id.isdecimal() or int(mark_id) >= len(self.mark_files):
+                self.notifyErrorListeners(f'Unknown file of line mark: {token.text}', token, None)
+                return self.current_file
+            return self.mark_files[int(mark_id)]
+
+        # members are defined in the constructor of the generated parser
+        self.mark_file = mark_file
+
 
 
     class Program_nomacrosContext(ParserRuleContext):
@@ -1010,7 +1023,7 @@ class AsmParser ( Parser ):
                     break
 
             self.current_line = int((None if localctx._line_number is None else self._input.getText(localctx._line_number.start,localctx._line_number.stop)))
-            self.current_file =  b64decode((None if localctx._filepath is None else self._input.getText(localctx._filepath.start,localctx._filepath.stop))[3:]).decode()
+            self.current_file = self.mark_file((None if localctx._filepath is None else localctx._filepath.start))
             localctx.source_file = self.current_file
             localctx.source_line = self.current_line
             self.current_offset = (None if localctx._line_number is None else localctx._line_number.start).line - self.current_line + 1
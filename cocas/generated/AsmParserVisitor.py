@@ -5,7 +5,7 @@ if __name__ is not None and "." in __name__:
 else:
     from AsmParser import AsmParser
 
-from base64 import b64decode
+
 
 
 # This class defines a complete generic visitor for a parse tree produced by AsmParser.
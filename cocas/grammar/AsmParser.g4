@@ -2,14 +2,23 @@ parser grammar AsmParser;
 
 options { tokenVocab=AsmLexer; }
 
-@header {
-from base64 import b64decode
-}
-
 @members {
+    # paths of line mark ids, LineMarkTable.files of the source being parsed
+    self.mark_files = []
     self.current_file = ''
     self.current_line = 0
     self.current_offset = 0
+
+    def mark_file(token):
+        # line marks are made by the macro processor, but a source may contain them too
+        mark_id = token.text[3:]
+        if not mark_id.isdecimal() or int(mark_id) >= len(self.mark_files):
+            self.notifyErrorListeners(f'Unknown file of line mark: {token.text}', token, None)
+            return self.current_file
+        return self.mark_files[int(mark_id)]
+
+    # members are defined in the constructor of the generated parser
+    self.mark_file = mark_file
 }
 
 program_nomacros : NEWLINE* section* End ;
@@ -44,7 +53,7 @@ source_file = '',
 source_line = 0
 ] : LINE_MARK_MARKER  line_number filepath WORD? NEWLINE+
     {self.current_line = int($line_number.text)}
-    {self.current_file =  b64decode($filepath.text[3:]).decode()}
+    {self.current_file = self.mark_file($filepath.start)}
     {$source_file = self.current_file}
     {$source_line = self.current_line}
     {self.current_offset = $line_number.start.line - self.current_line + 1}
@@ -0,0 +1,82 @@
+import codecs
+import hashlib
+import os
+import re
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from cocas.macro_processor import ParsedSource
+
+# include "file" on a line of its own, path in quotes is taken as is, without escape sequences
+_INCLUDE = re.compile(r'^[ \t]*include[ \t]+"((?:[^"\\\n]|\\.)*)"', re.MULTILINE)
+
+
+def include_path(including_file: str, name: str) -> str:
+    """
+    Resolve the file name of include directive
+
+    :param including_file: Path to the file with the directive
+    :param name: File name in the directive, relative paths are resolved from the directory of including file
+    :return: Path to the included file
+    """
+    return os.path.normpath(os.path.join(os.path.dirname(including_file), name))
+
+
+def find_includes(filepath: str, data: bytes) -> dict[str, bytes]:
+    """
+    Find files that the source may include, directly or through other included files,
+    without running macro processor, so that they can be a part of cache keys.
+    Files that cannot be read are skipped, the error is reported when the source is assembled
+
+    :param filepath: Path to the source file
+    :param data: Contents of the source file
+    :return: Contents of included files by their paths
+    """
+    found = dict()
+    pending = [(filepath, data)]
+    while pending:
+        including_file, including_data = pending.pop()
+        for name in _INCLUDE.findall(codecs.decode(including_data, 'utf8', 'replace')):
+            path = include_path(including_file, name)
+            if path in found:
+                continue
+            try:
+                with open(path, 'rb') as file:
+                    found[path] = file.read()
+            except OSError:
+                continue
+            pending.append((path, found[path]))
+    return found
+
+
+class IncludeCache:
+    """
+    Included files parsed by the macro processor, shared by all sources of a build.
+    A file is read every time it is included, but it is parsed again only if the hash
+    of its contents has changed, so the cache stays valid between builds in watch mode.
+    """
+
+    def __init__(self):
+        self.sources: dict[str, tuple[bytes, 'ParsedSource']] = dict()
+
+    def get(self, filepath: str) -> 'ParsedSource':
+        """
+        Parse the included file or take it from the cache
+
+        :param filepath: Path to the included file
+        :return: Lines and macro definitions of the file
+        """
+        from cocas.macro_processor import parse_source
+
+        with open(filepath, 'rb') as file:
+            data = file.read()
+        digest = hashlib.sha256(data).digest()
+        cached = self.sources.get(filepath)
+        if cached is not None and cached[0] == digest:
+            return cached[1]
+        text = codecs.decode(data, 'utf8', 'strict')
+        if not text.endswith('\n'):
+            text += '\n'
+        source = parse_source(text, filepath)
+        self.sources[filepath] = (digest, source)
+        return source
@@ -0,0 +1,483 @@
+import bisect
+import dataclasses
+from dataclasses import dataclass, field
+from typing import Optional, Union
+
+from cocas.ast_builder import build_ast
+from cocas.ast_nodes import *
+from cocas.chunked_stream import ChunkedInputStream
+from cocas.error import CdmException, CdmExceptionTag
+from cocas.include import IncludeCache
+from cocas.location import CodeLocation, LineMarkTable
+from cocas.macro_processor import ExpandMacrosVisitor, ParsedSource, SourceLine, SourceMacro, parse_source, \
+    process_macros
+
+# statements of a section are split into pieces that are at least this many lines long
+PIECE_LINES = 64
+
+_SECTIONS = frozenset(['asect', 'rsect', 'tplate'])
+_BLOCK_STARTS = frozenset(['if', 'while', 'do'])
+_BLOCK_ENDS = frozenset(['fi', 'wend', 'until'])
+
+
+class _Unsplittable(Exception):
+    """Pieces of the source are not parsed as they would be in the whole source, it is parsed as a whole"""
+
+
+@dataclass
+class _Piece:
+    """
+    Lines of the source that are expanded and parsed on their own. A piece either starts a group,
+    with a top-level section header and the statements after it, or continues the section
+    of the group with more top-level statements. The first piece also has the lines before
+    the first header, and the last one has the end of program and everything after it
+    """
+    # position of the text of the piece in the source
+    offset: int
+    length: int
+    # number of its first line and the number of lines in it
+    line: int
+    lines: int
+    # lines and macros of the piece, numbered as lines of the source
+    items: list[Union[SourceMacro, SourceLine]]
+    header: bool
+    # state of the macro processor at the start of the piece
+    nonce: int = 0
+    macros: dict = field(default_factory=dict)
+    # the piece has the end of program
+    last: bool = False
+    # text of some expansion depends on the nonce, the piece is expanded again when the nonce at its start changes
+    stateful: bool = False
+    # sections of the piece, or the error found in it, statements that continue a section
+    # are parsed as an absolute section of their own
+    program: Optional[ProgramNode] = None
+    error: Optional[CdmException] = None
+
+
+def _starts_section(item: Union[SourceMacro, SourceLine]) -> bool:
+    return isinstance(item, SourceLine) and item.label == '' and item.instruction in _SECTIONS
+
+
+def _is_end(item: Union[SourceMacro, SourceLine]) -> bool:
+    return isinstance(item, SourceLine) and item.instruction == 'end'
+
+
+def _split(items: list[Union[SourceMacro, SourceLine]], line: int,
+           header: bool) -> tuple[list[tuple[int, list, bool]], int]:
+    """
+    Split lines of the source into pieces, before section headers and between top-level statements
+    of sections, up to the end of program. Nesting of blocks is found from keywords of the lines,
+    a piece that splits a block is not parsed and the group is parsed as a whole
+
+    :param items: Lines and macros
+    :param line: Number of the first line
+    :param header: The first piece starts a group
+    :return: First line, items and header flag of every piece, and the nesting depth at the end
+    """
+    pieces = [(line, [], header)]
+    # lines before the first header are not split, nor are lines after the end of program
+    in_section = not header
+    ended = False
+    depth = 0
+    for item in items:
+        if not ended:
+            if _starts_section(item):
+                if pieces[-1][1]:
+                    pieces.append((item.start, [], True))
+                in_section = True
+                depth = 0
+            elif in_section and depth == 0 and item.start - pieces[-1][0] >= PIECE_LINES:
+                pieces.append((item.start, [], False))
+        pieces[-1][1].append(item)
+        if isinstance(item, SourceLine) and item.label == '':
+            if item.instruction in _BLOCK_STARTS:
+                depth += 1
+            elif item.instruction in _BLOCK_ENDS:
+                depth -= 1
+        ended = ended or _is_end(item)
+    return pieces, depth
+
+
+def _copy_macros(macros: dict) -> dict:
+    return {name: dict(arities) for name, arities in macros.items()}
+
+
+def _sections(program: ProgramNode) -> list[SectionNode]:
+    return program.template_sections + program.relocatable_sections + program.absolute_sections
+
+
+def _moved_lines(lines: list, move) -> list:
+    """
+    Copy the code block and blocks nested in it with locations of nodes replaced with move(location).
+    Nodes are copied, as trees returned by earlier parses share them and must not change
+    """
+    moved = []
+    for line in lines:
+        if isinstance(line, LocatableNode):
+            line = dataclasses.replace(line, location=move(line.location))
+        elif isinstance(line, ConditionalStatementNode):
+            conditions = [dataclasses.replace(condition, lines=_moved_lines(condition.lines, move))
+                          for condition in line.conditions]
+            line = ConditionalStatementNode(conditions, _moved_lines(line.then_lines, move),
+                                            _moved_lines(line.else_lines, move), move(line.cond_location))
+        elif isinstance(line, WhileLoopNode):
+            line = WhileLoopNode(_moved_lines(line.condition_lines, move), line.branch_mnemonic,
+                                 _moved_lines(line.lines, move), move(line.mnem_location))
+        elif isinstance(line, UntilLoopNode):
+            line = UntilLoopNode(_moved_lines(line.lines, move), line.branch_mnemonic, move(line.mnem_location))
+        moved.append(line)
+    return moved
+
+
+def _moved_section(section: SectionNode, move) -> SectionNode:
+    return dataclasses.replace(section, lines=_moved_lines(section.lines, move),
+                               locations=[move(location) for location in section.locations])
+
+
+class IncrementalParser:
+    """
+    Front-end for editors, that keeps the tree of a source between edits and parses again
+    only the part of the source that an edit has changed.
+
+    The source is split into pieces at top-level section headers, and sections are split
+    between their top-level statements. Pieces share nothing but the macros defined before them,
+    the nonce of the macro processor and the section they continue, so every piece is expanded
+    and parsed on its own, and the statements of pieces of a section are joined. A section whose
+    pieces cannot be parsed on their own, such as a section with an error, is parsed as a whole.
+    After an edit, only the pieces that it touches are parsed again, the trees of the other
+    pieces are reused. Their locations are moved by the number of added or removed lines,
+    and the pieces that use the nonce are expanded again if the edit changes the number
+    of expansions before them. Edits of macro definitions, and edits that end the program
+    before its last piece, make the whole source parsed again.
+
+    The tree is the same as built by build_ast from the whole source. Trees of successive edits
+    share the nodes of unchanged pieces, and nodes are never changed after they are returned,
+    so a tree returned earlier stays as it was. Errors are found in the pieces
+    that have them, and the first one is reported, errors of the macro processor before errors
+    of the assembler, as in cocas the whole source is expanded before it is parsed. Errors of the
+    assembler are found in sections parsed as a whole, but a block that is not closed is reported
+    at the end of its section, not at the next header.
+    Included files are read from the include cache only when the pieces that include them
+    are parsed, parse must be called again when an included file changes.
+    """
+
+    def __init__(self, filepath: str, library_macros, includes: Optional[IncludeCache] = None):
+        """
+        :param filepath: Path to the source file, it is used in code locations and errors
+        :param library_macros: Macros read from the standard library of the target
+        :param includes: Included files shared with other sources, None to parse them for this source only
+        """
+        self.filepath = filepath
+        self.library_macros = library_macros
+        self.includes = includes if includes is not None else IncludeCache()
+        # marks of all expansions refer to the same table, its ids are never reused
+        self.line_marks = LineMarkTable()
+        self.text = ''
+        # text as it is processed, with a newline at the end
+        self._source = '\n'
+        # None if the source is not split into pieces, then an edit parses it as a whole
+        self._pieces: Optional[list[_Piece]] = None
+
+    def parse(self, text: str) -> ProgramNode:
+        """
+        Parse the whole source
+
+        :param text: Source code
+        :return: The tree of the source
+        """
+        self.text = text
+        self._source = text if text.endswith('\n') else text + '\n'
+        self._pieces = None
+        visitor = ExpandMacrosVisitor(None, self.library_macros, self.filepath, self.line_marks, self.includes)
+        try:
+            items = parse_source(self._source, self.filepath).items
+            self._pieces = self._expand(self._source, 0, 1, items, True, visitor, True)
+            self._join_groups(range(len(self._pieces)))
+        except (CdmException, _Unsplittable):
+            # macro processor stops at the first error, it is reported as by cocas
+            self._pieces = None
+            return self._parse_whole()
+        return self._program()
+
+    def edit(self, start: int, stop: int, text: str) -> ProgramNode:
+        """
+        Replace a part of the source and parse it again
+
+        :param start: Position of the first replaced character in the source
+        :param stop: Position after the last replaced character, the same as start if the text is inserted
+        :param text: Text that replaces the characters
+        :return: The tree of the edited source
+        """
+        new_text = self.text[:start] + text + self.text[stop:]
+        if self._pieces is None:
+            return self.parse(new_text)
+        source = new_text if new_text.endswith('\n') else new_text + '\n'
+        growth = len(source) - len(self._source)
+        offsets = [piece.offset for piece in self._pieces]
+        first = bisect.bisect_right(offsets, start) - 1
+        last = bisect.bisect_right(offsets, max(start, stop - 1)) - 1
+        self.text, self._source = new_text, source
+        try:
+            replaced = self._reparse(first, last, growth)
+        except (CdmException, _Unsplittable):
+            replaced = False
+        except Exception:
+            # pieces may be left partly updated, the next edit parses the whole source
+            self._pieces = None
+            raise
+        if not replaced:
+            return self.parse(new_text)
+        return self._program()
+
+    def _reparse(self, first: int, last: int, growth: int) -> bool:
+        """
+        Parse pieces from first to last again, after their text has grown by growth characters
+
+        :return: False if the whole source must be parsed again
+        """
+        pieces = self._pieces
+        while True:
+            head, tail = pieces[first], pieces[last]
+            stop = tail.offset + tail.length + growth
+            span = self._source[head.offset:stop]
+            if span and not span.endswith('\n'):
+                # the newline at the end of the piece is removed, its last line is joined with the next one
+                last += 1
+                continue
+            if any(isinstance(item, SourceMacro) for piece in pieces[first:last + 1] for item in piece.items or ()):
+                return False
+            try:
+                items = parse_source(span, self.filepath).items if span else []
+            except CdmException as e:
+                # lines of the text are not known until the error is fixed, it is a piece with the error
+                if e.file == self.filepath:
+                    e.line += head.line - 1
+                items = None
+                replacement = [_Piece(head.offset, len(span), head.line, span.count('\n'), None, head.header,
+                                      head.nonce, head.macros, last + 1 == len(pieces), error=e)]
+                break
+            for item in items:
+                if isinstance(item, SourceMacro):
+                    return False
+                item.start += head.line - 1
+                item.stop += head.line - 1
+            if first > 0 and head.header and (not items or not _starts_section(items[0])):
+                # the header is removed, lines of the piece continue the previous section
+                first -= 1
+                continue
+            if first == 0 and not items:
+                last += 1
+                continue
+            _, depth = _split(items, head.line, head.header)
+            if depth != 0 and last + 1 < len(pieces) and not pieces[last + 1].header:
+                # a block is not closed in the piece, the next one may close it
+                last += 1
+                continue
+            break
+
+        after = pieces[last + 1:]
+        line_shift = span.count('\n') - sum(piece.lines for piece in pieces[first:last + 1])
+        nonce_shift = 0
+        if items is not None:
+            if after and any(_is_end(item) for item in items):
+                return False
+            visitor = self._visitor(head)
+            replacement = []
+            if items:
+                replacement = self._expand(span, head.offset, head.line, items, head.header, visitor, not after)
+            if after:
+                if visitor.macros != after[0].macros:
+                    return False
+                nonce_shift = visitor.nonce - after[0].nonce
+
+        moved = dict()
+
+        def move(location: CodeLocation) -> CodeLocation:
+            if location.file != self.filepath:
+                return location
+            new_location = moved.get(location)
+            if new_location is None:
+                new_location = moved[location] = CodeLocation(location.file, location.line + line_shift,
+                                                              location.column)
+            return new_location
+
+        changed = list(range(first, first + len(replacement)))
+        for i, piece in enumerate(after, first + len(replacement)):
+            piece.offset += growth
+            piece.nonce += nonce_shift
+            if line_shift:
+                piece.line += line_shift
+                for item in piece.items or ():
+                    item.start += line_shift
+                    item.stop += line_shift
+                if piece.error is not None and piece.error.file == self.filepath:
+                    error = piece.error
+                    piece.error = CdmException(error.tag, error.file, error.line + line_shift, error.description)
+            if nonce_shift and piece.stateful:
+                self._expand_piece(piece, self._visitor(piece))
+                changed.append(i)
+            elif line_shift and piece.program is not None:
+                program = piece.program
+                piece.program = ProgramNode([_moved_section(section, move) for section in program.template_sections],
+                                            [_moved_section(section, move) for section in program.relocatable_sections],
+                                            [_moved_section(section, move) for section in program.absolute_sections])
+        pieces[first:last + 1] = replacement
+        # pieces after the edit may now continue a section
+        changed.append(first + len(replacement))
+        self._join_groups(changed)
+        return True
+
+    def _visitor(self, piece: _Piece) -> ExpandMacrosVisitor:
+        """Macro processor in the state at the start of the piece"""
+        visitor = ExpandMacrosVisitor(None, self.library_macros, self.filepath, self.line_marks, self.includes)
+        visitor.nonce = piece.nonce
+        visitor.macros = _copy_macros(piece.macros)
+        return visitor
+
+    def _expand(self, span: str, offset: int, line: int, items: list[Union[SourceMacro, SourceLine]],
+                header: bool, visitor: ExpandMacrosVisitor, last: bool) -> list[_Piece]:
+        """
+        Split the text into pieces, expand and parse them
+
+        :param span: Text of the pieces
+        :param offset: Position of the text in the source
+        :param line: Number of the first line of the text
+        :param items: Lines and macros of the text, numbered as lines of the source
+        :param header: The text starts a group
+        :param visitor: Macro processor in the state at the start of the text, it is left in the state at its end
+        :param last: The text has the end of program
+        :return: Pieces of the text
+        """
+        pieces = []
+        pos = 0
+        pos_line = line
+        split, _ = _split(items, line, header)
+        for piece_line, piece_items, piece_header in split:
+            while pos_line < piece_line:
+                pos = span.index('\n', pos) + 1
+                pos_line += 1
+            pieces.append(_Piece(offset + pos, 0, piece_line, 0, piece_items, piece_header))
+        for piece, next_piece in zip(pieces, pieces[1:]):
+            piece.length = next_piece.offset - piece.offset
+            piece.lines = next_piece.line - piece.line
+        pieces[-1].length = offset + len(span) - pieces[-1].offset
+        pieces[-1].lines = line + span.count('\n') - pieces[-1].line
+        pieces[-1].last = last
+        for piece in pieces:
+            piece.nonce = visitor.nonce
+            piece.macros = _copy_macros(visitor.macros)
+            self._expand_piece(piece, visitor)
+        return pieces
+
+    def _expand_piece(self, piece: _Piece, visitor: ExpandMacrosVisitor):
+        """Expand and parse the piece with the macro processor in the state at its start"""
+        if piece.items and _starts_section(piece.items[0]):
+            header = piece.items[0]
+            if visitor.find_macro(header.instruction, len(header.parameters)) is not None:
+                # the header is a macro call, it may not start a section
+                raise _Unsplittable()
+        stateful_expansions = visitor.stateful_expansions
+        try:
+            text = ''.join(visitor.expand_source(ParsedSource(self.filepath, piece.items), piece.line))
+        except CdmException as e:
+            # state of the macro processor after the error is corrected when it is fixed,
+            # as after an edit that changes the nonce
+            visitor.include_stack.clear()
+            piece.program = None
+            piece.error = e
+            return
+        piece.stateful = visitor.stateful_expansions != stateful_expansions
+        if not piece.header:
+            # statements in the middle of a section are parsed as a section of their own
+            text = f'{self.line_marks.mark(piece.line, self.filepath)}asect 0\n{text}'
+        if not piece.last:
+            # the piece is parsed as a program that ends where the next piece starts
+            text += 'end\n'
+        try:
+            piece.program = build_ast(ChunkedInputStream([text], self.filepath), self.filepath, self.line_marks)
+            piece.error = None
+        except CdmException as e:
+            piece.program = None
+            piece.error = e
+
+    def _group(self, i: int) -> tuple[int, int]:
+        """Bounds of the group of pieces with the i-th piece"""
+        start = i
+        while not self._pieces[start].header:
+            start -= 1
+        stop = i + 1
+        while stop < len(self._pieces) and not self._pieces[stop].header:
+            stop += 1
+        return start, stop
+
+    def _joinable(self, start: int, stop: int) -> bool:
+        """Pieces of the group are parsed as they would be in the whole source"""
+        pieces = self._pieces[start:stop]
+        if any(piece.program is None for piece in pieces):
+            return False
+        if len(_sections(pieces[0].program)) != 1:
+            return False
+        # sections of the other pieces are made by the header that they are parsed with
+        return all(len(piece.program.absolute_sections) == 1 and len(_sections(piece.program)) == 1
+                   for piece in pieces[1:])
+
+    def _join_groups(self, changed):
+        """Parse groups of changed pieces as a whole, if they cannot be joined from their pieces"""
+        groups = []
+        for i in sorted(changed):
+            if i < len(self._pieces) and (not groups or i >= groups[-1][1]):
+                groups.append(self._group(i))
+        # groups after the joined ones move to lower indices
+        for start, stop in reversed(groups):
+            if stop - start == 1 or self._joinable(start, stop):
+                continue
+            if any(piece.error is not None and piece.error.tag == CdmExceptionTag.MACRO.value
+                   for piece in self._pieces[start:stop]):
+                # the group is not parsed until the error of the macro processor is fixed
+                continue
+            pieces = self._pieces[start:stop]
+            whole = _Piece(pieces[0].offset, sum(piece.length for piece in pieces), pieces[0].line,
+                           sum(piece.lines for piece in pieces), [item for piece in pieces for item in piece.items],
+                           True, pieces[0].nonce, pieces[0].macros, pieces[-1].last)
+            self._expand_piece(whole, self._visitor(whole))
+            self._pieces[start:stop] = [whole]
+
+    def _program(self) -> ProgramNode:
+        errors = [piece.error for piece in self._pieces if piece.error is not None]
+        if errors:
+            # the whole text is expanded before it is parsed, errors of the macro processor come first
+            raise next((e for e in errors if e.tag == CdmExceptionTag.MACRO.value), errors[0])
+        ret = ProgramNode([], [], [])
+        pieces = self._pieces
+        for i, piece in enumerate(pieces):
+            if not piece.header:
+                continue
+            program = piece.program
+            stop = i + 1
+            if stop < len(pieces) and not pieces[stop].header:
+                # statements of the other pieces of the group are joined into the section
+                section = _sections(program)[0]
+                lines = list(section.lines)
+                locations = list(section.locations)
+                while stop < len(pieces) and not pieces[stop].header:
+                    body = pieces[stop].program.absolute_sections[0]
+                    lines += body.lines
+                    locations += body.locations
+                    stop += 1
+                section = dataclasses.replace(section, lines=lines, locations=locations)
+                program = ProgramNode([], [], [])
+                if isinstance(section, TemplateSectionNode):
+                    program.template_sections.append(section)
+                elif isinstance(section, RelocatableSectionNode):
+                    program.relocatable_sections.append(section)
+                else:
+                    program.absolute_sections.append(section)
+            ret.template_sections += program.template_sections
+            ret.relocatable_sections += program.relocatable_sections
+            ret.absolute_sections += program.absolute_sections
+        return ret
+
+    def _parse_whole(self) -> ProgramNode:
+        line_marks = LineMarkTable()
+        input_stream = process_macros(self._source, self.library_macros, self.filepath, line_marks, self.includes)
+        return build_ast(input_stream, self.filepath, line_marks)
@@ -1,6 +1,6 @@
 from dataclasses import astuple
 
-from cocas.assembler import ObjectSectionRecord, ObjectModule
+from cocas.object_module import ObjectSectionRecord, ObjectModule
 import itertools
 
 from cocas.error import CdmLinkException
@@ -107,6 +107,8 @@ def link(objects: list[ObjectModule]):
     ents = gather_ents(asects + rsects, sect_addresses)
     image = bytearray(2 ** 16)
     code_locations: dict[int, CodeLocation] = {}
+    # lower parts are updated while linking, copies keep the object modules intact, so they can be linked again
+    lower_parts = {id(sect): dict(sect.lower_parts) for sect in asects + rsects}
 
     for asect in asects:
         image_begin = asect.address
@@ -124,11 +126,11 @@ def link(objects: list[ObjectModule]):
             pos = image_begin + offset
             lower_limit = 1 << 8 * entry_bytes.start
             val = int.from_bytes(image[pos:pos + len(entry_bytes)], 'little', signed=False) * lower_limit
-            val += rsect.lower_parts.get(offset, 0)
+            val += lower_parts[id(rsect)].get(offset, 0)
             val += image_begin * sign
             val %= (1 << 8 * entry_bytes.stop)
             if entry_bytes.start > 0:
-                rsect.lower_parts[pos] = val % lower_limit
+                lower_parts[id(rsect)][pos] = val % lower_limit
             image[pos:pos + len(entry_bytes)] = (val // lower_limit).to_bytes(len(entry_bytes), 'little', signed=False)
 
     for sect in asects + rsects:
@@ -137,12 +139,12 @@ def link(objects: list[ObjectModule]):
                 pos = sect_addresses[sect.name] + offset
                 lower_limit = 1 << 8 * entry_bytes.start
                 val = int.from_bytes(image[pos:pos + len(entry_bytes)], 'little', signed=False) * lower_limit
-                val += sect.lower_parts.get(offset, 0)
+                val += lower_parts[id(sect)].get(offset, 0)
                 val += ents[ext_name] * sign
                 val %= (1 << 8 * entry_bytes.stop)
                 image[pos:pos + len(entry_bytes)] = (val // lower_limit).to_bytes(len(entry_bytes), 'little',
                                                                                   signed=False)
                 if entry_bytes.start > 0:
-                    sect.lower_parts[pos] = val % lower_limit
+                    lower_parts[id(sect)][pos] = val % lower_limit
 
     return image, code_locations
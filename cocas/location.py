@@ -1,8 +1,48 @@
+import sys
 from dataclasses import dataclass
+from typing import Optional
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class CodeLocation:
+    """
+    Location is immutable, so that lines and nodes share it instead of having copies.
+    Paths of files from line marks are interned, every location refers to the same string
+    """
     file: str = "unknown"
     line: int = 0
     column: int = 0
+
+
+# location of nodes and segments that are not placed in source code
+NO_LOCATION = CodeLocation()
+
+
+class LineMarkTable:
+    """
+    Line marks in the text produced by the macro processor refer to this table by small integer ids
+    instead of spelling out the file path. Every id stands for a file and the kind of the mark:
+    None for a plain mark, 'mstart' for the first line of an expanded macro call and 'mstop'
+    for the line after it. Ids are added as marks are generated, before the lexer reads them.
+    """
+
+    def __init__(self):
+        self.files: list[str] = []
+        self.kinds: list[Optional[str]] = []
+        self._ids: dict[tuple[str, Optional[str]], int] = dict()
+
+    def mark(self, line: int, file: str, kind: Optional[str] = None) -> str:
+        """
+        Make a line mark, which is a line of its own
+
+        :param line: Line number in the file that the next line of text comes from
+        :param file: Path to that file
+        :param kind: None, 'mstart' or 'mstop'
+        :return: Text of the mark
+        """
+        mark_id = self._ids.get((file, kind))
+        if mark_id is None:
+            mark_id = self._ids[file, kind] = len(self.files)
+            self.files.append(sys.intern(file))
+            self.kinds.append(kind)
+        return f'-| {line} fp-{mark_id}\n'
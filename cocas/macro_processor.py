@@ -1,14 +1,17 @@
+import time
 from antlr4 import *
-from antlr4.TokenStreamRewriter import TokenStreamRewriter
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import Iterator, Optional, Union
 
-from cocas.location import CodeLocation
+from cocas.chunked_stream import ChunkedInputStream
+from cocas.include import IncludeCache, include_path
+from cocas.location import CodeLocation, LineMarkTable
+from cocas.stats import MacroStats
 from cocas.generated.MacroLexer import MacroLexer
 from cocas.generated.MacroParser import MacroParser
 from cocas.generated.MacroVisitor import MacroVisitor
-from base64 import b64encode
 import re
-from cocas.error import AntlrErrorListener, CdmExceptionTag, CdmException, CdmTempException
+from cocas.error import AntlrErrorListener, CdmExceptionTag, CdmException, CdmTempException, parse_two_stage
 
 
 def unique(params: list[str]):
@@ -63,108 +66,267 @@ class MacroLine:
     parameter_pieces: list[list]
 
 
+@dataclass
+class MacroLineTemplate:
+    """
+    Macro line compiled into format strings. Parameters of the macro are positional fields,
+    the nonce is the field {nonce}, and values of macro variables are fields {v0}, {v1}, ...
+    whose names are made by formatting the corresponding element of variables
+    """
+    label: str
+    instruction: str
+    parameters: list[str]
+    # the whole line, as it is output when it is not expanded
+    text: str
+    variables: list[tuple[str, str]]
+    # stripped instruction if it does not depend on parameters, nonce or variables, otherwise None
+    static_instruction: Optional[str]
+    # line uses neither the nonce nor macro variables
+    stateless: bool
+
+
+def _compile_pieces(pieces: list, arity: int, variables: list[tuple[str, str]]) -> str:
+    parts = []
+    for piece in pieces:
+        if isinstance(piece, MacroParameter):
+            # $0 is substituted with the last parameter, as params[-1] would be
+            parts.append(f'{{{piece.n - 1 if piece.n > 0 else max(arity - 1, 0)}}}')
+        elif isinstance(piece, MacroNonce):
+            parts.append('{nonce}')
+        elif isinstance(piece, MacroVariable):
+            field_name = f'v{len(variables)}'
+            variables.append((field_name, _compile_pieces(piece.name_pieces, arity, variables)))
+            parts.append(f'{{{field_name}}}')
+        else:
+            parts.append(piece.replace('{', '{{').replace('}', '}}'))
+    return ''.join(parts)
+
+
+def compile_macro_line(line: MacroLine, arity: int) -> MacroLineTemplate:
+    variables = []
+    label = _compile_pieces(line.label_pieces, arity, variables)
+    instruction = _compile_pieces(line.instruction_pieces, arity, variables)
+    parameters = [_compile_pieces(pieces, arity, variables) for pieces in line.parameter_pieces]
+    static_instruction = None
+    if all(isinstance(piece, str) for piece in line.instruction_pieces):
+        static_instruction = ''.join(line.instruction_pieces).strip()
+    stateless = not variables and not any(isinstance(piece, MacroNonce) for pieces in
+                                          [line.label_pieces, line.instruction_pieces, *line.parameter_pieces]
+                                          for piece in pieces)
+    return MacroLineTemplate(label, instruction, parameters, f'{label}{instruction}{",".join(parameters)}\n',
+                             variables, static_instruction, stateless)
+
+
 @dataclass
 class MacroDefinition:
     name: str
     arity: int
     lines: list[MacroLine]
     location: CodeLocation
+    # lines are compiled once, when the macro is defined, and expanded by formatting the templates
+    templates: list[MacroLineTemplate] = field(init=False, repr=False, compare=False)
+    # expansion depends only on parameters, unless nested macros or macro instructions are used
+    stateless: bool = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        self.templates = [compile_macro_line(line, self.arity) for line in self.lines]
+        self.stateless = all(template.stateless for template in self.templates)
 
 
-def substitute_piece(piece, params: list[str], nonce: str, variables: dict[str, str]):
-    if isinstance(piece, MacroParameter):
-        return params[piece.n - 1]
-    elif isinstance(piece, MacroNonce):
-        return nonce
-    elif isinstance(piece, MacroVariable):
-        sub = lambda p: substitute_piece(p, params, nonce, variables)
-        var_name = ''.join(map(sub, piece.name_pieces))
-        return variables[var_name]
-    else:
-        return piece
+@dataclass
+class _Expansion:
+    """Macro call that is being expanded, element of the work stack of ExpandMacrosVisitor.expand_macro"""
+    macro: MacroDefinition
+    params: list[str]
+    # nonce of this call and the value of ExpandMacrosVisitor.nonce that it was taken from
+    nonce: str
+    first_nonce: int
+    parts: list[str]
+    variables: dict[str, str] = field(default_factory=dict)
+    # index of the next macro line to expand
+    line: int = 0
+    # text depends only on the macro and parameters, so it can be reused for the same call
+    memoizable: bool = True
+    # perf_counter at the start of expansion, set only if expansions are profiled
+    start: float = 0.0
+
+
+# nested macro calls deeper than this are considered a runaway recursion
+MAX_EXPANSION_DEPTH = 1000
+
+
+@dataclass
+class SourceMacro:
+    """Macro definition in a source file, it spans lines from start to stop"""
+    macro: MacroDefinition
+    start: int
+    stop: int
+
+
+@dataclass
+class SourceLine:
+    """Line of a source file, it is either a macro call or the text that is output as is"""
+    label: str
+    instruction: str
+    parameters: list[str]
+    # text without comment, with newline
+    text: str
+    start: int
+    stop: int
+
+
+@dataclass
+class ParsedSource:
+    """Source file parsed by the macro processor, but not yet expanded"""
+    filepath: str
+    items: list[Union[SourceMacro, SourceLine]]
 
 
-def substitute_pieces_in_line(line: MacroLine, params: list[str], nonce: str, variables: dict[str, str]):
-    sub = lambda p: substitute_piece(p, params, nonce, variables)
-    sub_all = lambda ps: ''.join(map(sub, ps))
-    label_part = sub_all(line.label_pieces)
-    instruction_part = sub_all(line.instruction_pieces)
-    parameter_parts = list(map(sub_all, line.parameter_pieces))
-    return label_part, instruction_part, parameter_parts
+# file name of include directive
+_INCLUDE_NAME = re.compile(r'"((?:[^"\\\n]|\\.)*)"')
 
 
 # noinspection PyPep8Naming
 class ExpandMacrosVisitor(MacroVisitor):
-    def __init__(self, rewriter: TokenStreamRewriter, mlb_macros, filepath: str):
+    def __init__(self, token_stream: Optional[CommonTokenStream], mlb_macros, filepath: str,
+                 line_marks: Optional[LineMarkTable] = None, includes: Optional[IncludeCache] = None,
+                 max_depth: int = MAX_EXPANSION_DEPTH, profile: Optional[dict[str, MacroStats]] = None):
         self.nonce = 0
-        self.macros = {name: mlb_macros[name].copy() for name in mlb_macros}
-        self.rewriter = rewriter
+        # expansions of macros that use the nonce or macro variables, their text changes with the nonce
+        self.stateful_expansions = 0
+        # expansions by macro name/arity, recorded only if the dict is given
+        self.profile = profile
+        self.max_depth = max_depth
+        self.includes = includes if includes is not None else IncludeCache()
+        # files whose expansion is in progress, the source file and files included by it
+        self.include_stack: list[str] = []
+        # expanded text of calls by macro name and parameters, and how many nonces the expansion takes,
+        # profiled expansions are not memoized, as calls of macros nested in memoized ones would not be counted
+        self.memoize = profile is None
+        self.memo: dict[tuple[str, tuple[str, ...]], tuple[str, int]] = dict()
+        # library macros are shared by all files of a build, so they are never modified,
+        # macros defined in the file are stored separately
+        self.library_macros = mlb_macros
+        self.macros = dict()
+        self.token_stream = token_stream
         self.filepath = filepath
+        self.line_marks = line_marks if line_marks is not None else LineMarkTable()
 
     def _generate_location_line(self, filepath: str, line: int, info: str = None) -> str:
-        if info is not None:
-            info = " " + info
-        else:
-            info = ""
-        return f'-| {line} fp-{b64encode(filepath.encode()).decode()} {info}\n'
+        return self.line_marks.mark(line, filepath, info)
+
+    def find_macro(self, name: str, arity: int) -> Optional[MacroDefinition]:
+        for macros in (self.macros, self.library_macros):
+            if arity in macros.get(name, ()):
+                return macros[name][arity]
+        return None
 
     def add_macro(self, macro: MacroDefinition):
-        if macro.name not in self.macros:
-            self.macros[macro.name] = dict()
-        if macro.arity in self.macros[macro.name]:
+        if self.find_macro(macro.name, macro.arity) is not None:
             raise CdmTempException(f'Multiple definitions of macro {macro.name}')
-        self.macros[macro.name][macro.arity] = macro
+        self.macros.setdefault(macro.name, dict())[macro.arity] = macro
+        # memoized macros may call the new one, and their lines were not expanded before
+        self.memo.clear()
+
+    def _start_expansion(self, macro: MacroDefinition, params: list[str]) -> _Expansion:
+        self.nonce += 1
+        if not macro.stateless:
+            self.stateful_expansions += 1
+        location_line = self._generate_location_line(macro.location.file, macro.location.line)
+        expansion = _Expansion(macro, params, str(self.nonce), self.nonce, [location_line],
+                               memoizable=macro.stateless)
+        if self.profile is not None:
+            expansion.start = time.perf_counter()
+        return expansion
+
+    def _profile_expansion(self, macro: MacroDefinition, text: str, depth: int, elapsed: float):
+        stats = self.profile.setdefault(f'{macro.name}/{macro.arity}', MacroStats())
+        stats.calls += 1
+        stats.lines += sum(1 for line in text.split('\n') if line.strip() and not line.startswith('-|'))
+        stats.max_depth = max(stats.max_depth, depth)
+        stats.time += elapsed
+
+    def _add_nested_text(self, expansion: _Expansion, text: str):
+        expansion.parts.append(text)
+        location = expansion.macro.location
+        location_line = self._generate_location_line(location.file, location.line + expansion.line + 1)
+        expansion.parts.append(f'\n{location_line}')
+        expansion.line += 1
 
     # Returns a None for things as asect or empty line.
     # Returns string of macro
-    def expand_macro(self, macro_name: str, macro_params: list[str]):
-        arity = len(macro_params)
-        if macro_name in self.macros and arity in self.macros[macro_name]:
-            ret_parts = []
-            self.nonce += 1
-            macro_nonce = str(self.nonce)
-            macro: MacroDefinition = self.macros[macro_name][arity]
-
-            variables = {}
-
-            ret_parts.append(self._generate_location_line(macro.location.file, macro.location.line))
-
-            line_number = 0
-            for line in macro.lines:
-                label_part, instruction_part, parameter_parts \
-                    = substitute_pieces_in_line(line, macro_params, macro_nonce, variables)
-                label = label_part.rstrip()
-                instruction = instruction_part.strip()
-                parameters = list(map(str.strip, parameter_parts))
-                if parameters == ['']:
-                    parameters = []
-
-                # IMPORTANT:
-                # to correctly generate location information
-                # each line that does not contain another macro
-                # MUST add exactly ONE line to ret_parts
-                if instruction in macro_instructions:
-                    variables.update(macro_instructions[instruction](parameters))
-                    if label != '':
-                        ret_parts.append(f'{label}\n')
-                    else:
-                        ret_parts.append('\n')
-                else:
-                    expanded_text = self.expand_macro(instruction, parameters)
-                    if expanded_text is not None:
-                        if label != '':
-                            ret_parts.append(f'{label}\n')
-                        else:
-                            ret_parts.append('\n')
-                        ret_parts.append(expanded_text)
-                        location_line = self._generate_location_line(macro.location.file,
-                                                                     macro.location.line + line_number + 1)
-                        ret_parts.append(f'\n{location_line}')
-                    else:
-                        ret_parts.append(f'{label_part}{instruction_part}{",".join(parameter_parts)}\n')
-                line_number += 1
-            return ''.join(ret_parts)
-        return None
+    def expand_macro(self, macro_name: str, macro_params: list[str]) -> Optional[str]:
+        macro = self.find_macro(macro_name, len(macro_params))
+        if macro is None:
+            return None
+        memoized = self.memo.get((macro.name, tuple(macro_params)))
+        if memoized is not None:
+            self.nonce += memoized[1]
+            return memoized[0]
+
+        # nested calls are expanded on a stack of their own instead of recursion,
+        # the top element is the innermost call
+        stack = [self._start_expansion(macro, macro_params)]
+        while True:
+            top = stack[-1]
+            if top.line == len(top.macro.templates):
+                text = ''.join(top.parts)
+                if top.memoizable and self.memoize:
+                    self.memo[top.macro.name, tuple(top.params)] = (text, self.nonce - top.first_nonce + 1)
+                if self.profile is not None:
+                    self._profile_expansion(top.macro, text, len(stack), time.perf_counter() - top.start)
+                stack.pop()
+                if not stack:
+                    return text
+                stack[-1].memoizable = stack[-1].memoizable and top.memoizable
+                self._add_nested_text(stack[-1], text)
+                continue
+
+            line = top.macro.templates[top.line]
+            params = top.params
+            values = {field_name: top.variables[name.format(*params, nonce=top.nonce)]
+                      for field_name, name in line.variables}
+            instruction = line.static_instruction
+            if instruction is None:
+                instruction = line.instruction.format(*params, nonce=top.nonce, **values).strip()
+            # most lines are plain instructions, they are output without formatting their parts
+            if (instruction not in macro_instructions and instruction not in self.macros
+                    and instruction not in self.library_macros):
+                top.parts.append(line.text.format(*params, nonce=top.nonce, **values))
+                top.line += 1
+                continue
+
+            label = line.label.format(*params, nonce=top.nonce, **values).rstrip()
+            parameters = [param.format(*params, nonce=top.nonce, **values).strip() for param in line.parameters]
+            if parameters == ['']:
+                parameters = []
+
+            # IMPORTANT:
+            # to correctly generate location information
+            # each line that does not contain another macro
+            # MUST add exactly ONE line to parts
+            if instruction in macro_instructions:
+                top.variables.update(macro_instructions[instruction](parameters))
+                top.memoizable = False
+                top.parts.append(f'{label}\n' if label != '' else '\n')
+                top.line += 1
+                continue
+            nested = self.find_macro(instruction, len(parameters))
+            if nested is None:
+                top.parts.append(line.text.format(*params, nonce=top.nonce, **values))
+                top.line += 1
+                continue
+
+            top.parts.append(f'{label}\n' if label != '' else '\n')
+            memoized = self.memo.get((nested.name, tuple(parameters)))
+            if memoized is not None:
+                self.nonce += memoized[1]
+                self._add_nested_text(top, memoized[0])
+                continue
+            if len(stack) >= self.max_depth:
+                raise CdmTempException(f'Macros are nested deeper than {self.max_depth} levels, '
+                                       f'{instruction}/{len(parameters)} may be recursive')
+            stack.append(self._start_expansion(nested, parameters))
 
     def visitMlb(self, ctx: MacroParser.MlbContext):
         for child in filter(lambda c: isinstance(c, MacroParser.Mlb_macroContext), ctx.children):
@@ -174,35 +336,79 @@ class ExpandMacrosVisitor(MacroVisitor):
                 raise CdmException(CdmExceptionTag.MACRO, self.filepath, child.start.line, e.message)
         return self.macros
 
-    def visitProgram(self, ctx: MacroParser.ProgramContext):
-        if len(ctx.children) > 0:
-            self.rewriter.insertBeforeToken(ctx.children[0].start, self._generate_location_line(self.filepath, 1))
+    def _token_text(self, start: int, stop: int) -> str:
+        return ''.join(token.text for token in self.token_stream.tokens[start:stop] if token.type != Token.EOF)
+
+    # Returns lines and macro definitions of the program, macros are expanded by expand_source
+    def visitProgram(self, ctx: MacroParser.ProgramContext) -> list[Union[SourceMacro, SourceLine]]:
+        items = []
         for child in ctx.children:
+            if isinstance(child, MacroParser.MacroContext):
+                items.append(SourceMacro(self.visitMacro(child), child.start.line, child.stop.line))
+            elif isinstance(child, MacroParser.LineContext):
+                label, instruction, parameters = self.visitLine(child)
+                text = self._token_text(child.start.tokenIndex, child.stop.tokenIndex + 1)
+                items.append(SourceLine(label, instruction, parameters, text, child.start.line, child.stop.line))
+        return items
+
+    def expand_source(self, source: ParsedSource, first_line: int = 1) -> Iterator[str]:
+        """
+        Expand macros of the parsed file and remove macro definitions, which are added to macros of the visitor.
+        Text is produced a line or an expanded macro at a time, so it is never kept whole in memory
+
+        :param source: Source file or included file
+        :param first_line: Line of the first item, if the source is a part of the file
+        :return: Generator of the text with line marks
+        """
+        filepath = source.filepath
+        self.include_stack.append(filepath)
+        for i, item in enumerate(source.items):
+            if i == 0:
+                yield self._generate_location_line(filepath, first_line)
+            if isinstance(item, SourceLine) and item.instruction == 'include':
+                yield from self._include(filepath, item)
+                continue
             try:
-                if isinstance(child, MacroParser.MacroContext):
-                    self.add_macro(self.visitMacro(child))
-                elif isinstance(child, MacroParser.LineContext):
-                    label, instruction, parameters = self.visitLine(child)
-                    expanded_text = self.expand_macro(instruction, parameters)
+                if isinstance(item, SourceMacro):
+                    self.add_macro(item.macro)
+                    yield self._generate_location_line(filepath, item.stop + 1)
+                else:
+                    expanded_text = self.expand_macro(item.instruction, item.parameters)
                     if expanded_text is not None:
-                        if label != '':
-                            expanded_text = f'{label}\n{expanded_text}'
-
-                        mstart = self._generate_location_line(self.filepath, child.start.line, "mstart")
-                        mstop = self._generate_location_line(self.filepath, child.stop.line + 1, "mstop")
-                        expanded_text = f'{mstart}{expanded_text}{mstop}'
-                        self.rewriter.insertBeforeToken(child.start, expanded_text)
-                        self.rewriter.delete(self.rewriter.DEFAULT_PROGRAM_NAME, child.start, child.stop)
+                        if item.label != '':
+                            expanded_text = f'{item.label}\n{expanded_text}'
+
+                        mstart = self._generate_location_line(filepath, item.start, "mstart")
+                        mstop = self._generate_location_line(filepath, item.stop + 1, "mstop")
+                        yield f'{mstart}{expanded_text}{mstop}'
+                    else:
+                        yield item.text
             except CdmTempException as e:
-                raise CdmException(CdmExceptionTag.MACRO, self.filepath, child.start.line, e.message)
+                raise CdmException(CdmExceptionTag.MACRO, filepath, item.start, e.message)
+        self.include_stack.pop()
+
+    def _include(self, filepath: str, line: SourceLine) -> Iterator[str]:
+        match = _INCLUDE_NAME.fullmatch(line.parameters[0]) if len(line.parameters) == 1 else None
+        if line.label != '' or match is None:
+            raise CdmException(CdmExceptionTag.MACRO, filepath, line.start,
+                               'Expected include "file" on a line of its own')
+        path = include_path(filepath, match[1])
+        if path in self.include_stack:
+            raise CdmException(CdmExceptionTag.MACRO, filepath, line.start, f'File {path} includes itself')
+        try:
+            source = self.includes.get(path)
+        except OSError as e:
+            raise CdmException(CdmExceptionTag.MACRO, filepath, line.start,
+                               f'Cannot include {match[1]}: {e.strerror}')
+        yield from self.expand_source(source)
+        # lines after the directive come from the including file again
+        yield self._generate_location_line(filepath, line.stop + 1)
 
     def visitMacro(self, ctx: MacroParser.MacroContext):
         header = ctx.macro_header()
         name = header.NAME().getText()
         arity = int(header.DIGIT().getText())
         lines = self.visitMacro_body(ctx.macro_body())
-        self.rewriter.delete(self.rewriter.DEFAULT_PROGRAM_NAME, ctx.start, ctx.stop)
-        self.rewriter.insertAfterToken(ctx.stop, self._generate_location_line(self.filepath, ctx.stop.line + 1))
         return MacroDefinition(name, arity, lines, CodeLocation(self.filepath, ctx.macro_body().start.line, 0))
 
     def visitMlb_macro(self, ctx: MacroParser.Mlb_macroContext):
@@ -281,28 +487,116 @@ class ExpandMacrosVisitor(MacroVisitor):
 
 # filepath should be absolute
 def read_mlb(filepath):
-    input_stream = FileStream(filepath)
-    lexer = MacroLexer(input_stream)
-    token_stream = CommonTokenStream(lexer)
-    parser = MacroParser(token_stream)
-    cst = parser.mlb()
+    text = str(FileStream(filepath))
+    cst = parse_two_stage(lambda: MacroParser(CommonTokenStream(MacroLexer(InputStream(text)))), 'mlb')
     return ExpandMacrosVisitor(None, dict(), filepath).visit(cst)
 
 
+# Lines that are certainly parsed by the macro grammar as a single line, with labels, instruction
+# and comma-separated parameters in the named groups, and whose text is passed to the output
+# as is, except for the comment. Anything unusual, such as macro variables or characters that
+# are not valid in the macro grammar, does not match, and the file is processed by MacroParser
+_PIECE = r"""(?:[A-Za-z0-9_.+\-()]|"[^"\\\n]*(?:\\.[^"\\\n]*)*"|'(?:\\.|[^\\'\n])')"""
+_SIMPLE_LINE = re.compile(rf"""
+    (?P<labels>(?:[ \t]*[A-Za-z0-9_.+\-()]+[:>])*)
+    [ \t]*
+    (?:
+        (?P<instruction>[A-Za-z0-9_.+\-()]+)
+        (?:[ \t]+(?P<first_param>(?:{_PIECE}|[ \t])*))?
+        (?P<params>(?:,(?:{_PIECE}|[ \t])*)*)
+    )?
+    [ \t]*
+    (?P<comment>\#.*)?
+""", re.VERBOSE)
+_PARAM = re.compile(rf",((?:{_PIECE}|[ \t])*)")
+_MACRO_KEYWORD = re.compile(r'(?<![A-Za-z0-9_])(?:macro|mend)(?![A-Za-z0-9_])')
+
+
+def _prescan(text: str) -> Optional[list[re.Match]]:
+    """
+    Match every line of the text against _SIMPLE_LINE
+
+    :param text: Source code that ends with a newline
+    :return: Matches of all lines or None if some line needs the full macro processing
+    """
+    if '\r' in text:
+        return None
+    lines = []
+    for line in text.split('\n')[:-1]:
+        match = _SIMPLE_LINE.fullmatch(line)
+        if match is None:
+            return None
+        code = line[:match.start('comment')] if match['comment'] is not None else line
+        # macro definitions are parsed by MacroParser
+        if _MACRO_KEYWORD.search(code):
+            return None
+        lines.append(match)
+    return lines
+
+
+def _simple_source_lines(lines: list[re.Match]) -> list[SourceLine]:
+    """Make the same lines as ExpandMacrosVisitor.visitProgram for a file of simple lines, without parsing it"""
+    items = []
+    for line_number, match in enumerate(lines, 1):
+        line = match.string
+        if match['comment'] is not None:
+            line = line[:match.start('comment')]
+        instruction = match['instruction']
+        if instruction is None:
+            label, instruction, parameters = line.rstrip(), '', []
+        else:
+            label = line[:match.start('instruction')].rstrip()
+            parameters = [(match['first_param'] or '').strip()]
+            parameters += [param.strip() for param in _PARAM.findall(match['params'])]
+            if parameters == ['']:
+                parameters = []
+        items.append(SourceLine(label, instruction, parameters, line + '\n', line_number, line_number))
+    return items
+
+
+def parse_source(text: str, filepath: str) -> ParsedSource:
+    """
+    Split the source into lines and macro definitions. Files without macro definitions
+    and with simple lines only are not parsed by MacroParser
+
+    :param text: Source code, it must end with a newline
+    :param filepath: Path to the source file, it is used in macro locations and errors
+    :return: Parsed source, ready to be expanded by ExpandMacrosVisitor.expand_source
+    """
+    lines = _prescan(text)
+    if lines is not None:
+        return ParsedSource(filepath, _simple_source_lines(lines))
+
+    def make_parser() -> MacroParser:
+        lexer = MacroLexer(InputStream(text))  # using generated class
+        lexer.removeErrorListeners()
+        # Adds a class that will be called somehow from antlr. And it will raise exceptions with MACRO and filepath
+        lexer.addErrorListener(AntlrErrorListener(CdmExceptionTag.MACRO, filepath))
+        parser = MacroParser(CommonTokenStream(lexer))  # using generated class
+        parser.removeErrorListeners()
+        parser.addErrorListener(AntlrErrorListener(CdmExceptionTag.MACRO, filepath))
+        return parser
+
+    cst = parse_two_stage(make_parser, 'program')  # .children contains lines, their .children are tokens
+    return ParsedSource(filepath, ExpandMacrosVisitor(cst.parser.getTokenStream(), None, filepath).visit(cst))
+
+
 # filepath should be absolute
-def process_macros(input_stream: InputStream, library_macros, filepath: str):
-    lexer = MacroLexer(input_stream)  # using generated class
-    lexer.removeErrorListeners()
-    # Adds a class that will be called somehow from antlr. And it will raise exceptions with MACRO and filepath
-    lexer.addErrorListener(AntlrErrorListener(CdmExceptionTag.MACRO, filepath))
-    token_stream = CommonTokenStream(lexer)
-
-    parser = MacroParser(token_stream)  # using generated class
-    parser.removeErrorListeners()
-    parser.addErrorListener(AntlrErrorListener(CdmExceptionTag.MACRO, filepath))
-    cst = parser.program()  # .children contains lines, their .children are tokens
-    rewriter = TokenStreamRewriter(token_stream)
-    emv = ExpandMacrosVisitor(rewriter, library_macros, filepath)
-    emv.visit(cst)
-    new_test = rewriter.getDefaultText()
-    return InputStream(new_test)
+def process_macros(text: str, library_macros, filepath: str, line_marks: LineMarkTable,
+                   includes: Optional[IncludeCache] = None, max_depth: int = MAX_EXPANSION_DEPTH,
+                   profile: Optional[dict[str, MacroStats]] = None):
+    """
+    Expand macros of the source
+
+    :param text: Source code, it must end with a newline
+    :param library_macros: Macros read from the standard library of the target
+    :param filepath: Path to the source file
+    :param line_marks: Table that line marks of the expanded source are added to
+    :param includes: Included files parsed by previous sources of the build, None to parse them anew
+    :param max_depth: Maximal nesting depth of macro calls
+    :param profile: Dict that expansions are recorded to by macro name/arity, None to not record them
+    :return: Character stream of the expanded source, macros are expanded lazily, as it is read
+    """
+    source = parse_source(text, filepath)
+    emv = ExpandMacrosVisitor(None, library_macros, filepath, line_marks, includes, max_depth, profile)
+    return ChunkedInputStream(emv.expand_source(source), filepath)
@@ -1,20 +1,25 @@
 import argparse
 import codecs
-import importlib
 import json
 import os
 import pathlib
-import pkgutil
+import sys
+import tracemalloc
 from dataclasses import asdict
+from functools import partial
+from typing import Optional
 
-import antlr4
 import colorama
 
-from cocas.assembler import assemble
-from cocas.ast_builder import build_ast
-from cocas.error import CdmException, log_error, CdmLinkException, CdmExceptionTag
+from cocas.api import assemble_text, available_targets, library_path, normalize_target
+from cocas.error import CdmException, log_error, log_os_error, CdmLinkException, CdmExceptionTag
+from cocas.include import IncludeCache, find_includes
 from cocas.linker import link
-from cocas.macro_processor import process_macros, read_mlb
+from cocas.location import CodeLocation
+from cocas.object_cache import ObjectCache, default_cache_dir
+from cocas.object_file import OBJECT_FILE_SUFFIX, read_object_file, write_object_file
+from cocas.object_module import ObjectModule
+from cocas.stats import BuildStats, FileStats, stage
 
 
 def write_image(filename: str, arr: bytearray):
@@ -43,102 +48,372 @@ def write_image(filename: str, arr: bytearray):
     f.close()
 
 
+def write_debug_info(filename: str, code_locations: dict[int, CodeLocation]):
+    """
+    Write code locations of the image into file as JSON
+
+    :param filename: Path to output file
+    :param code_locations: Code locations returned by linker
+    """
+    code_locations = {key: asdict(loc) for key, loc in code_locations.items()}
+    json_locations = json.dumps(code_locations, indent=4, sort_keys=True)
+    with open(filename, 'w') as f:
+        f.write(json_locations)
+
+
+def assemble_file(filepath: str, data: bytes, target: str, library_macros,
+                  stats: Optional[FileStats] = None, includes: Optional[IncludeCache] = None,
+                  jobs: int = 1) -> ObjectModule:
+    """
+    Run macro expansion, parsing and assembly for one source file.
+
+    :param filepath: Path to the source file
+    :param data: Contents of the source file
+    :param target: Name of the target package in cocas.targets
+    :param library_macros: Macros read from the standard library of the target
+    :param stats: Statistics of the file to be filled, if they are collected
+    :param includes: Included files shared by sources of the build
+    :param jobs: Number of processes that parse top-level sections of the file, if it is huge
+    :return: Object module of the file
+    """
+    text = codecs.decode(data, 'utf8', 'strict')
+    return assemble_text(text, str(pathlib.Path(filepath).absolute()), target, library_macros, stats, includes, jobs)
+
+
+def _assemble_file_with_stats(filepath: str, data: bytes, target: str, library_macros, collect_stats: bool,
+                              includes: Optional[IncludeCache] = None, trace_memory: bool = True, jobs: int = 1,
+                              build_stats: Optional[BuildStats] = None) -> tuple[ObjectModule, Optional[FileStats]]:
+    """
+    Assemble file, collecting its statistics if requested.
+    Defined at module level so that it can be sent to worker processes.
+    Build statistics are given if the file is assembled in the build stage that is being measured.
+    """
+    stats = None
+    if collect_stats:
+        # worker processes measure memory on their own
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        stats = FileStats(outer=build_stats)
+    return assemble_file(filepath, data, target, library_macros, stats, includes, jobs), stats
+
+
+def load_library_macros(target: str, cache: Optional[ObjectCache]):
+    """
+    Read standard macro library, using parsed macros from the cache when the library has not changed
+
+    :param target: Name of the target package in cocas.targets
+    :param cache: Cache of the build or None if it is disabled
+    :return: Macro definitions in the format returned by read_mlb
+    """
+    from cocas.macro_processor import read_mlb
+
+    path = library_path(target)
+    if cache is None:
+        return read_mlb(str(path))
+    key = ObjectCache.library_key(path.read_bytes(), str(path))
+    library_macros = cache.load_macros(key)
+    if library_macros is None:
+        library_macros = read_mlb(str(path))
+        cache.store_macros(key, library_macros)
+    return library_macros
+
+
+# library macros of a worker process, they are sent once per process instead of once per file,
+# and included files parsed by the process
+_worker_library_macros = None
+_worker_includes = None
+
+
+def _init_worker(library_macros):
+    global _worker_library_macros, _worker_includes
+    _worker_library_macros = library_macros
+    _worker_includes = IncludeCache()
+
+
+def _assemble_file_in_worker(filepath: str, data: bytes, target: str, collect_stats: bool,
+                             trace_memory: bool) -> tuple[ObjectModule, Optional[FileStats]]:
+    return _assemble_file_with_stats(filepath, data, target, _worker_library_macros, collect_stats,
+                                     _worker_includes, trace_memory)
+
+
+def object_file_paths(sources: list[str], output: Optional[str]) -> list[str]:
+    """
+    Paths to object files of source files, they are written in the current directory
+
+    :param sources: Paths to source files
+    :param output: Path to object file, if there is only one source file,
+                   otherwise object files are named after source files
+    :return: Path to object file of every source file
+    """
+    if output is not None:
+        return [output]
+    return [pathlib.Path(filepath).with_suffix(OBJECT_FILE_SUFFIX).name for filepath in sources]
+
+
+def find_name_collision(sources: list[str], object_paths: list[str]) -> Optional[tuple[str, str, str]]:
+    """
+    Find two source files whose object files have the same path, such as a/x.asm and b/x.asm
+
+    :return: Paths to both source files and to the object file, or None if all object files are different
+    """
+    sources_by_path: dict[str, str] = dict()
+    for filepath, object_path in zip(sources, object_paths):
+        other = sources_by_path.setdefault(os.path.normcase(os.path.abspath(object_path)), filepath)
+        if other != filepath:
+            return other, filepath, object_path
+    return None
+
+
+def write_object_files(sources: list[str], objects: list[ObjectModule], output: Optional[str]):
+    """
+    Write object module of every source file into object file
+
+    :param sources: Paths to source files
+    :param objects: Object modules of the source files
+    :param output: Path to object file, if there is only one source file,
+                   otherwise object files are named after source files, see object_file_paths
+    :return: Exit code, None on success
+    """
+    for object_path, obj in zip(object_file_paths(sources, output), objects):
+        try:
+            write_object_file(object_path, obj)
+        except OSError as e:
+            log_os_error(e)
+            return 1
+
+
+def write_outputs(data: bytearray, code_locations: dict[int, CodeLocation], output: str, debug: Optional[str]):
+    """
+    Write linked image and its code locations
+
+    :param data: Linked image
+    :param code_locations: Code locations of the image
+    :param output: Path to image file
+    :param debug: Path to file with code locations or None if they are not needed
+    :return: Exit code, None on success
+    """
+    try:
+        write_image(output, data)
+    except OSError as e:
+        log_os_error(e)
+        return 1
+
+    # write code locations(debug info)
+    if debug is not None:
+        try:
+            write_debug_info(debug, code_locations)
+        except OSError as e:
+            log_os_error(e)
+            return 1
+
+
+def report_stats(stats: BuildStats, print_report: bool, json_path: Optional[str], macro_profile: Optional[str]):
+    """
+    Print statistics and write them to files, as requested
+
+    :param stats: Statistics of the build
+    :param print_report: Print human-readable statistics to standard output
+    :param json_path: Path to JSON file or None
+    :param macro_profile: Path to the report of macro expansions or None
+    """
+    if print_report:
+        print(stats.report())
+    try:
+        if json_path is not None:
+            with open(json_path, 'w') as f:
+                json.dump(stats.to_dict(), f, indent=4)
+        if macro_profile is not None:
+            with open(macro_profile, 'w') as f:
+                f.write(stats.macro_report() + '\n')
+    except OSError as e:
+        log_os_error(e)
+
+
 def main():
     colorama.init()
-    targets_dir = os.path.join(os.path.dirname(__file__), "targets")
-    available_targets = list(map(lambda i: i.name, pkgutil.iter_modules([targets_dir])))
+    targets = available_targets()
 
     parser = argparse.ArgumentParser('cocas')
     parser.add_argument('-t', '--target', type=str, default='cdm-16',
                         help='target processor, CdM-16 is default')
     parser.add_argument('-T', '--list-targets', action='count', help='list available targets and exit')
-    # TODO: enable object file generation (if stand-alone linker will be ready)
-    # parser.add_argument('-c', '--compile', type=str, help='generate object files without linking')
+    parser.add_argument('-c', '--compile', action='store_true', help='generate object files without linking')
     parser.add_argument('-o', '--output', type=str, help='specify output file name')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='assemble source files in N parallel processes, '
+                        'a single huge source file is parsed by sections in N processes')
+    parser.add_argument('--no-cache', action='store_true', help='do not use cache of assembled files')
+    parser.add_argument('--cache-dir', type=str, help='directory for cache of assembled files')
+    parser.add_argument('--cache-size', type=int, default=64, help='cache size limit in megabytes, 64 is default')
+    parser.add_argument('--serve', action='store_true',
+                        help='serve JSON requests from standard input, see cocas/server.py for the protocol')
+    parser.add_argument('-w', '--watch', action='store_true',
+                        help='rebuild the image every time source files or macro library change')
+    parser.add_argument('--stats', action='store_true',
+                        help='print time and memory used by every stage of the build, it makes build slower')
+    parser.add_argument('--stats-json', type=str, metavar='FILE',
+                        help='write statistics of the build to JSON file')
+    parser.add_argument('--macro-profile', type=str, metavar='FILE',
+                        help='write calls, expanded lines, nesting depth and expansion time of every macro to FILE')
     parser.add_argument('--debug', type=str, help=argparse.SUPPRESS)
-    parser.add_argument('sources', type=str, nargs='*', help='source files')
+    parser.add_argument('sources', type=str, nargs='*', help=f'source files and {OBJECT_FILE_SUFFIX} object files')
     args = parser.parse_args()
     if args.list_targets:
-        print('Available targets: ' + ', '.join(available_targets))
+        print('Available targets: ' + ', '.join(targets))
         return
 
-    target: str = args.target.replace('-', '').lower()
-    if target not in available_targets:
+    target: str = normalize_target(args.target)
+    if target not in targets:
         print('Error: unknown target ' + target)
-        print('Available targets: ' + ', '.join(available_targets))
+        print('Available targets: ' + ', '.join(targets))
+        return 1
+
+    if args.serve:
+        from cocas.server import AssemblyServer
+        AssemblyServer(target).serve(sys.stdin, sys.stdout)
         return
 
     if len(args.sources) == 0:
         print('Error: no source files provided')
+        return 1
+
+    if args.jobs < 1:
+        print('Error: number of jobs must be positive')
+        return 1
+
+    if args.watch:
+        if args.compile:
+            print('Error: watch mode cannot be used with -c')
+            return 1
+        from cocas.watch import SourceWatcher
+        cache = None
+        if not args.no_cache:
+            cache = ObjectCache(args.cache_dir or default_cache_dir(), args.cache_size * 2 ** 20)
+        SourceWatcher(args.sources, target, args.output or 'out.img', args.debug, cache).watch()
         return
 
-    target_instructions = importlib.import_module(f'cocas.targets.{target}.target_instructions',
-                                                  'cocas').TargetInstructions
-    code_segments = importlib.import_module(f'cocas.targets.{target}.code_segments', 'cocas').CodeSegments
+    if args.compile:
+        if any(filepath.endswith(OBJECT_FILE_SUFFIX) for filepath in args.sources):
+            print('Error: object files cannot be compiled')
+            return 1
+        if args.output is not None and len(args.sources) > 1:
+            print('Error: output file name can be specified only for one source file')
+            return 1
+        collision = find_name_collision(args.sources, object_file_paths(args.sources, args.output))
+        if collision is not None:
+            print(f'Error: object files of {collision[0]} and {collision[1]} would both be written to '
+                  f'{collision[2]}, compile them separately with -o')
+            return 1
+
+    return build(args, target)
+
+
+def build(args: argparse.Namespace, target: str):
+    """
+    Assemble and link the sources, or write their object files, as requested by command-line arguments
+
+    :param args: Parsed command-line arguments
+    :param target: Name of the target package in cocas.targets
+    :return: Exit code, None on success
+    """
+    stats = None
+    # memory is not traced for the macro profile alone, tracing would distort expansion times
+    trace_memory = args.stats or args.stats_json is not None
+    if trace_memory or args.macro_profile is not None:
+        if trace_memory:
+            tracemalloc.start()
+        stats = BuildStats()
 
-    library_macros = read_mlb(str(pathlib.Path(__file__).parent.joinpath(f'targets/{target}/standard.mlb').absolute()))
-    objects = []
+    cache = None
+    # macros of files loaded from cache are not expanded, so the profile would miss them
+    if not args.no_cache and args.macro_profile is None:
+        cache = ObjectCache(args.cache_dir or default_cache_dir(), args.cache_size * 2 ** 20)
+    with stage(stats, 'library'):
+        library_macros = load_library_macros(target, cache)
 
-    for filepath in args.sources:
+    objects: list[Optional[ObjectModule]] = [None] * len(args.sources)
+    sources: dict[int, bytes] = dict()
+    for i, filepath in enumerate(args.sources):
         try:
-            with open(filepath, 'rb') as file:
-                data = file.read()
+            if filepath.endswith(OBJECT_FILE_SUFFIX):
+                objects[i] = read_object_file(filepath)
+            else:
+                with open(filepath, 'rb') as file:
+                    sources[i] = file.read()
         except OSError as e:
-            message = e.strerror
-            if e.filename is not None:
-                message += f': {colorama.Style.BRIGHT}{e.filename}{colorama.Style.NORMAL}'
-            log_error("MAIN", message)
+            log_os_error(e)
             return 1
-        data = codecs.decode(data, 'utf8', 'strict')
-        # tolerate files without newline at the end
-        if data[-1] != '\n':
-            data += '\n'
-
-        try:
-            input_stream = antlr4.InputStream(data)
-            # Macros (tst, clr but not if) are replaced to commands and wrapped by tags
-            # Remove comments
-            macro_expanded_input_stream = process_macros(input_stream, library_macros,
-                                                         str(pathlib.Path(filepath).absolute()))
-            r = build_ast(macro_expanded_input_stream, str(pathlib.Path(filepath).absolute()))
-            obj = assemble(r, target_instructions, code_segments)
-
-            objects.append(obj)
-        except CdmException as e:
-            e.log()
+        except CdmLinkException as e:
+            log_error(str(CdmExceptionTag.LINK), e.message)
             return 1
 
+    keys: dict[int, str] = dict()
+    if cache is not None:
+        with stage(stats, 'cache'):
+            library = library_path(target).read_bytes()
+            for i in sources:
+                filepath = str(pathlib.Path(args.sources[i]).absolute())
+                keys[i] = cache.key(sources[i], filepath, target, library, find_includes(filepath, sources[i]))
+                objects[i] = cache.load(keys[i])
+    # only files that are not found in cache are assembled
+    stale = [i for i in sources if objects[i] is None]
+
+    executor = None
+    if args.jobs > 1 and len(stale) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        executor = ProcessPoolExecutor(min(args.jobs, len(stale)), initializer=_init_worker,
+                                       initargs=(library_macros,))
+        assemble_source = partial(_assemble_file_in_worker, target=target, collect_stats=stats is not None,
+                                  trace_memory=trace_memory)
+        results = executor.map(assemble_source, [args.sources[i] for i in stale], [sources[i] for i in stale])
+    else:
+        # with a single source file to assemble, its sections may be parsed in parallel
+        assemble_source = partial(_assemble_file_with_stats, target=target, library_macros=library_macros,
+                                  collect_stats=stats is not None, includes=IncludeCache(), trace_memory=trace_memory,
+                                  jobs=args.jobs, build_stats=stats)
+        results = map(assemble_source, [args.sources[i] for i in stale], [sources[i] for i in stale])
+
+    # results are consumed in command-line order, so the reported error
+    # is always the one from the first failing file
     try:
-        data, code_locations = link(objects)
-    except CdmLinkException as e:
-        log_error(str(CdmExceptionTag.LINK), e.message)
+        with stage(stats, 'assembly'):
+            for i, (obj, file_stats) in zip(stale, results):
+                objects[i] = obj
+                if stats is not None:
+                    stats.files[args.sources[i]] = file_stats
+                if cache is not None:
+                    cache.store(keys[i], obj)
+    except CdmException as e:
+        e.log()
         return 1
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+        if cache is not None:
+            cache.evict()
+
+    if stats is not None:
+        # files are listed in command-line order
+        stats.files = {args.sources[i]: stats.files.get(args.sources[i], FileStats(cached=True)) for i in sources}
+
+    if args.compile:
+        with stage(stats, 'output'):
+            result = write_object_files(args.sources, objects, args.output)
+        if result is None and stats is not None:
+            report_stats(stats, args.stats, args.stats_json, args.macro_profile)
+        return result
 
     try:
-        if args.output is not None:
-            write_image(args.output, data)
-        else:
-            write_image("out.img", data)
-    except OSError as e:
-        message = e.strerror
-        if e.filename is not None:
-            message += f': {colorama.Style.BRIGHT}{e.filename}{colorama.Style.NORMAL}'
-        log_error("MAIN", message)
+        with stage(stats, 'link'):
+            data, code_locations = link(objects)
+    except CdmLinkException as e:
+        log_error(str(CdmExceptionTag.LINK), e.message)
         return 1
 
-    # write code locations(debug info)
-    if args.debug is not None:
-        code_locations = {key: asdict(loc) for key, loc in code_locations.items()}
-        json_locations = json.dumps(code_locations, indent=4, sort_keys=True)
-        try:
-            with open(args.debug, 'w') as f:
-                f.write(json_locations)
-        except OSError as e:
-            message = e.strerror
-            if e.filename is not None:
-                message += f': {colorama.Style.BRIGHT}{e.filename}{colorama.Style.NORMAL}'
-            log_error("MAIN", message)
-            return 1
+    with stage(stats, 'output'):
+        result = write_outputs(data, code_locations, args.output or 'out.img', args.debug)
+    if result is None and stats is not None:
+        report_stats(stats, args.stats, args.stats_json, args.macro_profile)
+    return result
 
 
 if __name__ == '__main__':
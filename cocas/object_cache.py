@@ -0,0 +1,260 @@
+import functools
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+from cocas.error import CdmLinkException
+from cocas.location import CodeLocation
+from cocas.object_file import dump_object_module, read_object_file
+from cocas.object_module import ObjectModule
+
+OBJECT_SUFFIX = '.obj'
+MACROS_SUFFIX = '.mlb'
+
+# code of the assembler is a part of every key, so that entries made by another version are not used
+COCAS_DIR = Path(__file__).parent
+
+
+@functools.cache
+def code_digest() -> bytes:
+    """Hash of the source code of cocas, computed once per process"""
+    h = hashlib.sha256()
+    for path in sorted(COCAS_DIR.rglob('*.py')):
+        name = path.relative_to(COCAS_DIR).as_posix().encode()
+        data = path.read_bytes()
+        h.update(len(name).to_bytes(8, 'little') + name + len(data).to_bytes(8, 'little') + data)
+    return h.digest()
+
+
+def _dump_pieces(pieces: list) -> list:
+    from cocas.macro_processor import MacroNonce, MacroParameter, MacroVariable
+
+    values = []
+    for piece in pieces:
+        if isinstance(piece, MacroParameter):
+            values.append(piece.n)
+        elif isinstance(piece, MacroNonce):
+            values.append(None)
+        elif isinstance(piece, MacroVariable):
+            values.append(_dump_pieces(piece.name_pieces))
+        else:
+            values.append(piece)
+    return values
+
+
+def _load_pieces(values) -> list:
+    from cocas.macro_processor import MacroNonce, MacroParameter, MacroVariable
+
+    if not isinstance(values, list):
+        raise ValueError('Expected a list of pieces')
+    pieces = []
+    for value in values:
+        if isinstance(value, str):
+            pieces.append(value)
+        elif type(value) is int:
+            pieces.append(MacroParameter(value))
+        elif value is None:
+            pieces.append(MacroNonce())
+        else:
+            pieces.append(MacroVariable(_load_pieces(value)))
+    return pieces
+
+
+def dump_macros(macros: dict) -> bytes:
+    """
+    Serialize parsed macro library as JSON. Pieces of macro lines are text as strings,
+    parameters as their numbers, the nonce as null and macro variables as lists of pieces of their names
+
+    :param macros: Macro definitions in the format returned by read_mlb
+    :return: Contents of the cache entry
+    """
+    definitions = []
+    for by_arity in macros.values():
+        for macro in by_arity.values():
+            location = macro.location
+            lines = [[_dump_pieces(line.label_pieces), _dump_pieces(line.instruction_pieces),
+                      [_dump_pieces(pieces) for pieces in line.parameter_pieces]] for line in macro.lines]
+            definitions.append({'name': macro.name, 'arity': macro.arity, 'lines': lines,
+                                'location': [location.file, location.line, location.column]})
+    return json.dumps(definitions).encode()
+
+
+def load_macros(data: bytes) -> dict:
+    """
+    Deserialize macro library saved by dump_macros
+
+    :param data: Contents of the cache entry
+    :return: Macro definitions in the format returned by read_mlb
+    :raise ValueError: Entry is corrupted
+    """
+    from cocas.macro_processor import MacroDefinition, MacroLine
+
+    definitions = json.loads(data)
+    if not isinstance(definitions, list):
+        raise ValueError('Expected a list of macros')
+    try:
+        macros = dict()
+        for definition in definitions:
+            lines = [MacroLine(_load_pieces(label), _load_pieces(instruction), [_load_pieces(p) for p in parameters])
+                     for label, instruction, parameters in definition['lines']]
+            file, line, column = definition['location']
+            macro = MacroDefinition(definition['name'], definition['arity'], lines, CodeLocation(file, line, column))
+            macros.setdefault(macro.name, dict())[macro.arity] = macro
+    except (TypeError, KeyError, AttributeError) as e:
+        raise ValueError(f'Corrupted macro library: {e}') from e
+    return macros
+
+
+def default_cache_dir() -> str:
+    """Cache directory used when none is specified: $XDG_CACHE_HOME/cocas or ~/.cache/cocas"""
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(Path.home(), '.cache')
+    return os.path.join(base, 'cocas')
+
+
+class ObjectCache:
+    """
+    On-disk cache of assembled object modules and parsed macro libraries.
+    Entries are addressed by a hash of everything that affects their contents,
+    so an entry never needs to be invalidated, it is just not looked up anymore.
+    When total size of the entries exceeds the limit, least recently used ones are removed.
+    """
+
+    def __init__(self, directory: str, size_limit: int):
+        """
+        :param directory: Directory where entries are stored, created if missing
+        :param size_limit: Maximal total size of entries in bytes
+        """
+        self.directory = directory
+        self.size_limit = size_limit
+
+    @staticmethod
+    def _hash(*parts: bytes) -> str:
+        h = hashlib.sha256()
+        for part in (code_digest(),) + parts:
+            h.update(len(part).to_bytes(8, 'little'))
+            h.update(part)
+        return h.hexdigest()
+
+    @staticmethod
+    def key(source: bytes, filepath: str, target: str, library: bytes,
+            includes: Optional[dict[str, bytes]] = None) -> str:
+        """
+        Make cache key of a source file
+
+        :param source: Contents of the source file
+        :param filepath: Absolute path of the source file, it is stored in code locations
+        :param target: Name of the target
+        :param library: Contents of the standard macro library of the target
+        :param includes: Contents of files included by the source, by their paths, see find_includes
+        :return: Hex digest that identifies the object module
+        """
+        included = []
+        for path, contents in sorted((includes or dict()).items()):
+            included += [path.encode(), contents]
+        return ObjectCache._hash(filepath.encode(), target.encode(), library, source, *included)
+
+    @staticmethod
+    def library_key(library: bytes, filepath: str) -> str:
+        """
+        Make cache key of a macro library
+
+        :param library: Contents of the macro library file
+        :param filepath: Absolute path of the macro library, it is stored in macro locations
+        :return: Hex digest that identifies parsed macros
+        """
+        return ObjectCache._hash(b'mlb', filepath.encode(), library)
+
+    def _path(self, key: str, suffix: str) -> str:
+        return os.path.join(self.directory, key + suffix)
+
+    def _write(self, key: str, suffix: str, data: bytes):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # write to temporary file first, so that concurrent builds never see partial entries
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.replace(temp_path, self._path(key, suffix))
+            except BaseException:
+                os.remove(temp_path)
+                raise
+        except OSError:
+            pass
+
+    def load(self, key: str) -> Optional[ObjectModule]:
+        """
+        Find object module in the cache
+
+        :param key: Cache key made by ObjectCache.key
+        :return: Cached object module or None if there is no valid entry
+        """
+        path = self._path(key, OBJECT_SUFFIX)
+        try:
+            obj = read_object_file(path)
+            # mark entry as recently used
+            os.utime(path)
+        except (OSError, CdmLinkException):
+            return None
+        return obj
+
+    def store(self, key: str, obj: ObjectModule):
+        """
+        Save object module to the cache. Failures are ignored, as cache
+        is not required to assemble anything
+
+        :param key: Cache key made by ObjectCache.key
+        :param obj: Object module to be saved
+        """
+        self._write(key, OBJECT_SUFFIX, dump_object_module(obj))
+
+    def load_macros(self, key: str) -> Optional[dict]:
+        """
+        Find parsed macro library in the cache
+
+        :param key: Cache key made by ObjectCache.library_key
+        :return: Macro definitions in the format returned by read_mlb or None if there is no valid entry
+        """
+        path = self._path(key, MACROS_SUFFIX)
+        try:
+            with open(path, 'rb') as f:
+                macros = load_macros(f.read())
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return macros
+
+    def store_macros(self, key: str, macros: dict):
+        """
+        Save parsed macro library to the cache. Failures are ignored
+
+        :param key: Cache key made by ObjectCache.library_key
+        :param macros: Macro definitions returned by read_mlb
+        """
+        self._write(key, MACROS_SUFFIX, dump_macros(macros))
+
+    def evict(self):
+        """Remove least recently used entries until cache fits into size limit"""
+        try:
+            entries = [entry for entry in os.scandir(self.directory)
+                       if entry.is_file() and entry.name.endswith((OBJECT_SUFFIX, MACROS_SUFFIX))]
+        except OSError:
+            return
+        stats = []
+        for entry in entries:
+            try:
+                stats.append((entry.stat().st_mtime, entry.stat().st_size, entry.path))
+            except OSError:
+                pass
+        total_size = sum(size for _, size, _ in stats)
+        for _, size, path in sorted(stats):
+            if total_size <= self.size_limit:
+                break
+            try:
+                os.remove(path)
+                total_size -= size
+            except OSError:
+                pass
@@ -0,0 +1,200 @@
+import mmap
+import struct
+
+from cocas.error import CdmLinkException
+from cocas.location import CodeLocation
+from cocas.object_module import ObjectModule, ObjectSectionRecord, ExternalEntry
+
+# Object file layout, all numbers are little-endian:
+#
+#   header      magic "CDMO", u16 version, u16 reserved
+#   strings     u32 count, then u32 length and utf-8 bytes of each string
+#   sections    u32 asect count, u32 rsect count, then asects and rsects
+#
+# Every section is
+#
+#   u32 address, u32 name, u32 alignment
+#   u32 size, data bytes
+#   u32 count, (u32 name, u32 offset) for every entry
+#   u32 count, (u32 name, u32 count, external entries) for every external label
+#   u32 count, relative entries
+#   u32 count, (u32 offset, u32 value) for every lower part
+#   u32 count, (u32 offset, u32 file, u32 line, u32 column) for every code location
+#
+# where external and relative entries are (u32 offset, u8 first byte, u8 last byte + 1, i8 sign)
+# and names and files are indices in the string table.
+
+OBJECT_FILE_SUFFIX = '.obj'
+MAGIC = b'CDMO'
+VERSION = 1
+
+_header = struct.Struct('<4sHH')
+_section_header = struct.Struct('<III')
+_u32 = struct.Struct('<I')
+_pair = struct.Struct('<II')
+_entry = struct.Struct('<IBBb')
+_location = struct.Struct('<IIII')
+
+
+class _StringTable:
+    def __init__(self):
+        self.strings: list[str] = []
+        self.indices: dict[str, int] = dict()
+
+    def index(self, string: str) -> int:
+        if string not in self.indices:
+            self.indices[string] = len(self.strings)
+            self.strings.append(string)
+        return self.indices[string]
+
+
+def _dump_entries(out: bytearray, entries: list[ExternalEntry]):
+    out += _u32.pack(len(entries))
+    for entry in entries:
+        out += _entry.pack(entry.offset, entry.entry_bytes.start, entry.entry_bytes.stop, entry.sign)
+
+
+def _dump_section(out: bytearray, sect: ObjectSectionRecord, strings: _StringTable):
+    out += _section_header.pack(sect.address, strings.index(sect.name), sect.alignment)
+    out += _u32.pack(len(sect.data))
+    out += sect.data
+    out += _u32.pack(len(sect.entries))
+    for name, offset in sect.entries.items():
+        out += _pair.pack(strings.index(name), offset)
+    out += _u32.pack(len(sect.external))
+    for name, entries in sect.external.items():
+        out += _u32.pack(strings.index(name))
+        _dump_entries(out, entries)
+    _dump_entries(out, sect.relative)
+    out += _u32.pack(len(sect.lower_parts))
+    for offset, value in sect.lower_parts.items():
+        out += _pair.pack(offset, value)
+    out += _u32.pack(len(sect.code_locations))
+    for offset, location in sect.code_locations.items():
+        out += _location.pack(offset, strings.index(location.file), location.line, location.column)
+
+
+def dump_object_module(obj: ObjectModule) -> bytes:
+    """
+    Serialize object module to the binary object format
+
+    :param obj: Object module to serialize
+    :return: Contents of the object file
+    """
+    strings = _StringTable()
+    body = bytearray(_pair.pack(len(obj.asects), len(obj.rsects)))
+    for sect in obj.asects + obj.rsects:
+        _dump_section(body, sect, strings)
+
+    out = bytearray(_header.pack(MAGIC, VERSION, 0))
+    out += _u32.pack(len(strings.strings))
+    for string in strings.strings:
+        encoded = string.encode('utf-8')
+        out += _u32.pack(len(encoded))
+        out += encoded
+    out += body
+    return bytes(out)
+
+
+class _Reader:
+    def __init__(self, buffer: memoryview):
+        self.buffer = buffer
+        self.pos = 0
+
+    def unpack(self, fmt: struct.Struct) -> tuple:
+        values = fmt.unpack_from(self.buffer, self.pos)
+        self.pos += fmt.size
+        return values
+
+    def u32(self) -> int:
+        return self.unpack(_u32)[0]
+
+    def take(self, size: int) -> memoryview:
+        if self.pos + size > len(self.buffer):
+            raise struct.error('unexpected end of data')
+        view = self.buffer[self.pos:self.pos + size]
+        self.pos += size
+        return view
+
+
+def _load_entries(reader: _Reader) -> list[ExternalEntry]:
+    entries = []
+    for _ in range(reader.u32()):
+        offset, start, stop, sign = reader.unpack(_entry)
+        entries.append(ExternalEntry(offset, range(start, stop), sign))
+    return entries
+
+
+def _load_section(reader: _Reader, strings: list[str]) -> ObjectSectionRecord:
+    address, name, alignment = reader.unpack(_section_header)
+    sect = ObjectSectionRecord(address, strings[name], alignment=alignment)
+    # data is not copied, it refers to the buffer the module is loaded from
+    sect.data = reader.take(reader.u32())
+    for _ in range(reader.u32()):
+        name, offset = reader.unpack(_pair)
+        sect.entries[strings[name]] = offset
+    for _ in range(reader.u32()):
+        name = strings[reader.u32()]
+        sect.external[name] = _load_entries(reader)
+    sect.relative = _load_entries(reader)
+    for _ in range(reader.u32()):
+        offset, value = reader.unpack(_pair)
+        sect.lower_parts[offset] = value
+    for _ in range(reader.u32()):
+        offset, file, line, column = reader.unpack(_location)
+        sect.code_locations[offset] = CodeLocation(strings[file], line, column)
+    return sect
+
+
+def load_object_module(buffer, source: str = 'object data') -> ObjectModule:
+    """
+    Deserialize object module from the binary object format.
+    Section data of the result refers to the buffer without copying
+
+    :param buffer: Object supporting buffer protocol with contents of the object file
+    :param source: Name of the data source used in error messages
+    :return: Object module
+    """
+    reader = _Reader(memoryview(buffer))
+    try:
+        magic, version, _ = reader.unpack(_header)
+        if magic != MAGIC:
+            raise CdmLinkException(f'Not an object file: {source}')
+        if version != VERSION:
+            raise CdmLinkException(f'Unsupported object file version {version}: {source}')
+        strings = [bytes(reader.take(reader.u32())).decode('utf-8') for _ in range(reader.u32())]
+        asects_count, rsects_count = reader.unpack(_pair)
+        obj = ObjectModule()
+        obj.asects = [_load_section(reader, strings) for _ in range(asects_count)]
+        obj.rsects = [_load_section(reader, strings) for _ in range(rsects_count)]
+    except (struct.error, IndexError, UnicodeDecodeError):
+        raise CdmLinkException(f'Corrupted object file: {source}')
+    return obj
+
+
+def write_object_file(filename: str, obj: ObjectModule):
+    """
+    Write object module into file in the binary object format
+
+    :param filename: Path to output file
+    :param obj: Object module to be written
+    """
+    with open(filename, 'wb') as f:
+        f.write(dump_object_module(obj))
+
+
+def read_object_file(filename: str) -> ObjectModule:
+    """
+    Read object module from file. The file is memory-mapped, so section data
+    is not copied into memory until the image is linked
+
+    :param filename: Path to object file
+    :return: Object module
+    """
+    with open(filename, 'rb') as f:
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty files cannot be mapped
+            raise CdmLinkException(f'Not an object file: {filename}')
+    return load_object_module(mapped, filename)
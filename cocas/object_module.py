@@ -1,6 +1,10 @@
 from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
 
-from cocas.code_block import Section
+from cocas.location import CodeLocation
+
+if TYPE_CHECKING:
+    from cocas.code_block import Section
 
 
 @dataclass
@@ -12,19 +16,25 @@ class ExternalEntry:
 
 @dataclass
 class ObjectSectionRecord:
-    def __init__(self, section: Section, labels: dict[str, int], templates: dict[str, dict[str, int]]):
-        self.address: int = section.address
-        self.name: str = section.name
-        self.data = bytearray()
-        self.entries: dict[str, int] = dict(p for p in section.labels.items() if p[0] in section.ents)
-        self.external: dict[str, list[ExternalEntry]] = dict()
-        self.relative: list[ExternalEntry] = []
-        self.lower_parts: dict[int, int] = dict()
-        self.code_locations = section.code_locations
-        self.alignment = 1
+    address: int
+    name: str
+    data: bytearray = field(default_factory=bytearray)
+    entries: dict[str, int] = field(default_factory=dict)
+    external: dict[str, list[ExternalEntry]] = field(default_factory=dict)
+    relative: list[ExternalEntry] = field(default_factory=list)
+    lower_parts: dict[int, int] = field(default_factory=dict)
+    code_locations: dict[int, CodeLocation] = field(default_factory=dict)
+    alignment: int = field(default=1)
+
+    @classmethod
+    def from_section(cls, section: "Section", labels: dict[str, int], templates: dict[str, dict[str, int]]):
+        record = cls(section.address, section.name)
+        record.entries = {name: section.labels[name] for name in section.labels if name in section.ents}
+        record.code_locations = section.code_locations
 
         for seg in section.segments:
-            seg.fill(self, section, labels, templates)
+            seg.fill(record, section, labels, templates)
+        return record
 
 
 @dataclass
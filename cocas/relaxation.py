@@ -0,0 +1,42 @@
+"""
+Offsets of segments of a code block while varying length segments change their sizes.
+
+Offsets are kept in a Fenwick tree of sizes of segments, labels and code locations refer to the segment
+they precede. When a segment changes its size, only the tree is updated, in O(log n), and addresses
+of labels are computed from it when they are needed.
+"""
+
+
+class SegmentOffsets:
+    """Sums of sizes of segments in front of every segment, that can be updated when one of them changes"""
+
+    def __init__(self, starts: list[int]):
+        """
+        :param starts: Addresses of all segments and of the end of the code block
+        """
+        # every node of the tree is the sum of sizes of segments in a range that ends with it
+        self._tree = [0] + [starts[i] - starts[i & (i - 1)] for i in range(1, len(starts))]
+
+    def add(self, index: int, diff: int):
+        """
+        Change size of a segment
+
+        :param index: Index of the segment
+        :param diff: Difference between its new and old size
+        """
+        i = index + 1
+        while i < len(self._tree):
+            self._tree[i] += diff
+            i += i & -i
+
+    def offset(self, index: int) -> int:
+        """
+        Get offset of a segment from the start of the code block
+
+        :param index: Index of the segment, or number of segments to get size of the code block
+        """
+        result = 0
+        while index > 0:
+            result += self._tree[index]
+            index &= index - 1
+        return result
@@ -0,0 +1,147 @@
+import base64
+import codecs
+import json
+import pathlib
+from dataclasses import asdict
+from typing import TextIO
+
+from cocas.api import assemble_text, available_targets, get_library_macros, normalize_target
+from cocas.error import CdmException, CdmExceptionTag, CdmLinkException
+from cocas.include import IncludeCache
+from cocas.linker import link
+from cocas.object_file import dump_object_module, load_object_module
+
+# Requests and responses are JSON objects, one per line.
+#
+# Every request has "method" and optional "id", which is copied to the response.
+# Methods:
+#
+#   assemble  {"target": str, "sources": [source]}
+#             -> {"objects": [base64 of object file]}
+#   link      {"objects": [base64 of object file]}
+#             -> {"image": base64, "code_locations": {address: location}}
+#   build     {"target": str, "sources": [source]}
+#             -> same as link, sources are assembled and linked
+#   shutdown  {} -> {}, then server exits
+#
+# where source is either a path or {"path": str, "text": str}, in the latter case
+# the file is not read and path is used only in code locations and errors.
+# "target" may be omitted, then the target given on command line is used.
+#
+# Every response has "ok". If it is false, response has "errors", a list of
+# {"tag": str, "file": str or null, "line": int or null, "message": str}.
+
+
+class RequestError(Exception):
+    def __init__(self, message: str):
+        self.message = message
+
+
+class AssemblyServer:
+    """
+    Serves assemble and link requests in one process, so that targets,
+    generated parsers and macro libraries are loaded only once
+    """
+
+    def __init__(self, default_target: str):
+        self.default_target = default_target
+        self.available_targets = available_targets()
+        # included files are parsed again only when they change
+        self.includes = IncludeCache()
+
+    def _target(self, request: dict) -> str:
+        target = normalize_target(str(request.get('target', self.default_target)))
+        if target not in self.available_targets:
+            raise RequestError(f'Unknown target {target}')
+        return target
+
+    def _assemble(self, request: dict) -> list:
+        target = self._target(request)
+        library_macros = get_library_macros(target)
+        objects = []
+        for source in request.get('sources', []):
+            if isinstance(source, str):
+                filepath = str(pathlib.Path(source).absolute())
+                with open(filepath, 'rb') as file:
+                    text = codecs.decode(file.read(), 'utf8', 'strict')
+            elif isinstance(source, dict) and 'path' in source and 'text' in source:
+                filepath = str(source['path'])
+                text = str(source['text'])
+            else:
+                raise RequestError('Source must be a path or an object with "path" and "text"')
+            objects.append(assemble_text(text, filepath, target, library_macros, includes=self.includes))
+        if not objects:
+            raise RequestError('No source files provided')
+        return objects
+
+    @staticmethod
+    def _link(objects: list) -> dict:
+        image, code_locations = link(objects)
+        return {
+            'image': base64.b64encode(image).decode(),
+            'code_locations': {str(address): asdict(location) for address, location in code_locations.items()},
+        }
+
+    def handle(self, request: dict) -> dict:
+        """
+        Execute a single request
+
+        :param request: Decoded request
+        :return: Response without "id"
+        """
+        method = request.get('method')
+        if method == 'assemble':
+            objects = self._assemble(request)
+            return {'objects': [base64.b64encode(dump_object_module(obj)).decode() for obj in objects]}
+        elif method == 'link':
+            objects = []
+            for i, encoded in enumerate(request.get('objects', [])):
+                objects.append(load_object_module(base64.b64decode(encoded), f'object {i}'))
+            if not objects:
+                raise RequestError('No object files provided')
+            return self._link(objects)
+        elif method == 'build':
+            return self._link(self._assemble(request))
+        elif method == 'shutdown':
+            return {}
+        raise RequestError(f'Unknown method {method}')
+
+    def serve(self, requests: TextIO, responses: TextIO):
+        """
+        Read requests line by line until shutdown request or end of input
+
+        :param requests: Stream of requests
+        :param responses: Stream where responses are written
+        """
+        for line in requests:
+            if not line.strip():
+                continue
+            request_id = None
+            method = None
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise RequestError('Request must be a JSON object')
+                request_id = request.get('id')
+                method = request.get('method')
+                response = {'ok': True} | self.handle(request)
+            except RequestError as e:
+                response = {'ok': False, 'errors': [_error('MAIN', None, None, e.message)]}
+            except OSError as e:
+                response = {'ok': False, 'errors': [_error('MAIN', e.filename, None, e.strerror)]}
+            except CdmException as e:
+                response = {'ok': False, 'errors': [_error(e.tag, e.file, e.line, e.description)]}
+            except CdmLinkException as e:
+                response = {'ok': False, 'errors': [_error(CdmExceptionTag.LINK.value, None, None, e.message)]}
+            except Exception as e:
+                # a single bad request must not stop the server
+                response = {'ok': False, 'errors': [_error('MAIN', None, None, f'{type(e).__name__}: {e}')]}
+            response['id'] = request_id
+            responses.write(json.dumps(response) + '\n')
+            responses.flush()
+            if method == 'shutdown':
+                return
+
+
+def _error(tag: str, file, line, message: str) -> dict:
+    return {'tag': tag, 'file': file, 'line': line, 'message': message}
@@ -0,0 +1,192 @@
+import dataclasses
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from dataclasses import InitVar, dataclass, field
+from typing import Iterable, Iterator, Optional, TypeVar
+
+# stages of a single file, in order of execution
+FILE_STAGES = ['macros', 'lexing', 'parsing', 'ast', 'sections', 'relaxation', 'object_records']
+# stages of the whole build
+BUILD_STAGES = ['library', 'cache', 'assembly', 'link', 'output']
+
+T = TypeVar('T')
+
+
+@dataclass
+class StageStats:
+    wall: float = 0.0
+    cpu: float = 0.0
+    # maximal memory allocated during the stage above the amount allocated at its start,
+    # measured only if tracemalloc is tracing
+    peak_memory: int = 0
+
+
+@dataclass
+class _Stages:
+    stages: dict[str, StageStats] = field(default_factory=dict)
+    # statistics whose stages the stages of these ones are nested in, they share the peaks of open stages
+    outer: InitVar[Optional['_Stages']] = None
+
+    def __post_init__(self, outer: Optional['_Stages']):
+        # peaks of traced memory of stages that are being measured, innermost last. Tracemalloc has
+        # a single peak, so before a nested stage resets it, it is added to the peaks of outer stages
+        self._open_peaks: list[list[int]] = outer._open_peaks if outer is not None else []
+        # time of stages nested in open stages of these statistics, innermost last, it is not counted
+        # in the outer stage. Stages of outer statistics include the stages nested in them
+        self._open_nested: list[list[float]] = []
+
+    def _update_open_peaks(self):
+        peak = tracemalloc.get_traced_memory()[1]
+        for open_peak in self._open_peaks:
+            open_peak[0] = max(open_peak[0], peak)
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Measure the code in with-block as the stage, stages may be entered several times and nested.
+        Time of a stage nested in another stage of the same statistics is only counted in the nested one
+        """
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            self._update_open_peaks()
+            tracemalloc.reset_peak()
+            start_memory = tracemalloc.get_traced_memory()[0]
+            peak = [start_memory]
+            self._open_peaks.append(peak)
+        nested = [0.0, 0.0]
+        self._open_nested.append(nested)
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start_wall
+            cpu = time.process_time() - start_cpu
+            self._open_nested.pop()
+            if self._open_nested:
+                self._open_nested[-1][0] += wall
+                self._open_nested[-1][1] += cpu
+            stats = self.stages.setdefault(name, StageStats())
+            stats.wall += wall - nested[0]
+            stats.cpu += cpu - nested[1]
+            if tracing:
+                self._update_open_peaks()
+                self._open_peaks.pop()
+                stats.peak_memory = max(stats.peak_memory, peak[0] - start_memory)
+
+    def stage_items(self, name: str, items: Iterable[T]) -> Iterator[T]:
+        """Measure producing every item of the lazy iterable as the stage, while it is consumed by other stages"""
+        iterator = iter(items)
+        while True:
+            try:
+                with self.stage(name):
+                    item = next(iterator)
+            except StopIteration:
+                return
+            yield item
+
+
+@dataclass
+class MacroStats:
+    """Expansions of a macro, including expansions of macros nested in it"""
+    calls: int = 0
+    # lines of code produced, without empty lines
+    lines: int = 0
+    # maximal nesting depth of the calls, 1 for calls in source files
+    max_depth: int = 0
+    # total time of expansions
+    time: float = 0.0
+
+    def add(self, other: 'MacroStats'):
+        self.calls += other.calls
+        self.lines += other.lines
+        self.max_depth = max(self.max_depth, other.max_depth)
+        self.time += other.time
+
+
+@dataclass
+class FileStats(_Stages):
+    """Statistics of assembling a single source file"""
+    cached: bool = False
+    tokens: int = 0
+    ast_nodes: int = 0
+    segments: int = 0
+    # varying length segments which changed their size during relaxation
+    resized_segments: int = 0
+    relaxation_iterations: int = 0
+    # expansions of macros by name/arity
+    macros: dict[str, MacroStats] = field(default_factory=dict)
+
+
+@dataclass
+class BuildStats(_Stages):
+    """Statistics of the whole build, with statistics of every source file"""
+    files: dict[str, FileStats] = field(default_factory=dict)
+
+    def to_dict(self) -> dict:
+        return dataclasses.asdict(self)
+
+    def report(self) -> str:
+        """Format statistics as a human-readable table"""
+        lines = [f'{"stage":24}{"wall, ms":>12}{"cpu, ms":>12}{"peak, KiB":>12}']
+
+        def add_stages(stages: dict[str, StageStats], order: list[str], indent: str):
+            for name in order:
+                if name in stages:
+                    s = stages[name]
+                    lines.append(f'{indent + name:24}{s.wall * 1000:12.1f}{s.cpu * 1000:12.1f}'
+                                 f'{s.peak_memory / 1024:12.0f}')
+
+        add_stages(self.stages, BUILD_STAGES, '')
+        for filepath, stats in self.files.items():
+            lines.append('')
+            if stats.cached:
+                lines.append(f'{filepath}: loaded from cache')
+                continue
+            lines.append(f'{filepath}:')
+            add_stages(stats.stages, FILE_STAGES, '  ')
+            lines.append(f'  {stats.tokens} tokens, {stats.ast_nodes} AST nodes, {stats.segments} segments, '
+                         f'{stats.resized_segments} resized in {stats.relaxation_iterations} relaxation iterations')
+        return '\n'.join(lines)
+
+    def macro_report(self) -> str:
+        """Format expansions of every macro, summed over files, as a human-readable table"""
+        macros: dict[str, MacroStats] = dict()
+        for stats in self.files.values():
+            for name, macro_stats in stats.macros.items():
+                macros.setdefault(name, MacroStats()).add(macro_stats)
+        lines = [f'{"macro":24}{"calls":>10}{"lines":>10}{"max depth":>10}{"time, ms":>12}']
+        # macros that produce most code come first
+        for name, s in sorted(macros.items(), key=lambda item: (-item[1].lines, -item[1].calls, item[0])):
+            lines.append(f'{name:24}{s.calls:10}{s.lines:10}{s.max_depth:10}{s.time * 1000:12.1f}')
+        return '\n'.join(lines)
+
+
+def stage(stats: Optional[_Stages], name: str):
+    """Measure the stage if statistics are collected, that is stats is not None"""
+    if stats is None:
+        return nullcontext()
+    return stats.stage(name)
+
+
+def stage_items(stats: Optional[_Stages], name: str, items: Iterable[T]) -> Iterable[T]:
+    """Measure producing items as the stage if statistics are collected, see _Stages.stage_items"""
+    if stats is None:
+        return items
+    return stats.stage_items(name, items)
+
+
+def count_ast_nodes(node) -> int:
+    """Count nodes of the tree built by BuildAstVisitor"""
+    # trees of long programs are deep, so they are walked without recursion
+    count = 0
+    pending = [node]
+    while pending:
+        node = pending.pop()
+        if isinstance(node, list):
+            pending.extend(node)
+        elif dataclasses.is_dataclass(node) and type(node).__module__ == 'cocas.ast_nodes':
+            count += 1
+            pending.extend(getattr(node, f.name) for f in dataclasses.fields(node))
+    return count
@@ -27,19 +27,7 @@ class CodeSegments(CodeSegmentsInterface):
         pass
 
     class VaryingLengthSegment(CodeSegment, CodeSegmentsInterface.VaryingLengthSegment):
-        @staticmethod
-        def update_surroundings(diff: int, pos: int, section: Section, labels: dict[str, int]):
-            for label_name in section.labels:
-                if section.labels[label_name] > pos:
-                    section.labels[label_name] += diff
-                    if label_name in labels:
-                        labels[label_name] += diff
-            old_locations = section.code_locations
-            section.code_locations = dict()
-            for PC, location in old_locations.items():
-                if PC > pos:
-                    PC += diff
-                section.code_locations[PC] = location
+        pass
 
     class AlignmentPaddingSegment(VaryingLengthSegment):
         def __init__(self, alignment: int, location: CodeLocation):
@@ -59,7 +47,6 @@ class CodeSegments(CodeSegmentsInterface):
                 new_size = 0
             diff = new_size - self.size
             self.size = new_size
-            self.__class__.update_surroundings(diff, pos, section, labels)
             return diff
 
     class AlignedSegment(CodeSegment):
@@ -154,7 +141,6 @@ class CodeSegments(CodeSegmentsInterface):
             if bad or not -64 <= value < 64:
                 self.size = 4
                 self.size_locked = True
-                self.__class__.update_surroundings(2, pos, section, labels)
                 return 2
 
     class Branch(InstructionSegment, VaryingLengthSegment):
@@ -212,7 +198,6 @@ class CodeSegments(CodeSegmentsInterface):
             if bad or not -1024 <= dist < 1024:
                 self.size = 4
                 self.size_locked = True
-                self.__class__.update_surroundings(2, pos, section, labels)
                 return 2
 
     class Imm6(InstructionSegment):
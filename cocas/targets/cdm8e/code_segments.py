@@ -137,18 +137,6 @@ class CodeSegments(CodeSegmentsInterface):
                     shift_length = self.expanded_size - self.base_size
                     self.is_expanded = True
                     self.size = self.expanded_size
-                    old_locations = section.code_locations
-                    section.code_locations = dict()
-                    for PC, location in old_locations.items():
-                        if PC > pos:
-                            PC += shift_length
-                        section.code_locations[PC] = location
-
-                    for label_name in section.labels:
-                        if section.labels[label_name] > pos:
-                            section.labels[label_name] += shift_length
-                            if label_name in labels:
-                                labels[label_name] += shift_length
                     return shift_length
             except CdmException as e:
                 raise e
@@ -0,0 +1,172 @@
+import os
+import pathlib
+import time
+from typing import Optional
+
+from colorama import Style
+
+from cocas.api import library_path
+from cocas.error import CdmException, CdmExceptionTag, CdmLinkException, log_error, log_os_error
+from cocas.include import IncludeCache, find_includes
+from cocas.linker import link
+from cocas.object_cache import ObjectCache
+from cocas.object_file import OBJECT_FILE_SUFFIX, load_object_module
+from cocas.object_module import ObjectModule
+
+
+def _stamp(path: str) -> Optional[tuple[int, int]]:
+    """Modification time and size of the file, or None if it cannot be accessed"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class SourceWatcher:
+    """
+    Keeps object modules of all sources in memory and polls the sources and the standard
+    macro library of the target. When some of them change, only the changed sources are
+    assembled again, and the image is relinked from the new and the kept object modules.
+    """
+
+    def __init__(self, sources: list[str], target: str, output: str, debug: Optional[str],
+                 cache: Optional[ObjectCache], interval: float = 0.05):
+        """
+        :param sources: Source files and object files, in linking order
+        :param target: Name of the target package in cocas.targets
+        :param output: Path to the image file
+        :param debug: Path to the file with code locations or None
+        :param cache: Cache of assembled files used for the first build, or None
+        :param interval: Time between polls in seconds
+        """
+        self.sources = sources
+        self.target = target
+        self.output = output
+        self.debug = debug
+        self.cache = cache
+        self.interval = interval
+        self.library_path = library_path(target)
+        self.library_stamp: Optional[tuple[int, int]] = None
+        self.library_macros = None
+        self.stamps: list[Optional[tuple[int, int]]] = [None] * len(sources)
+        self.objects: list[Optional[ObjectModule]] = [None] * len(sources)
+        # stamps of files included by every source, when it was last assembled
+        self.include_stamps: list[dict[str, Optional[tuple[int, int]]]] = [dict() for _ in sources]
+        self.includes = IncludeCache()
+
+    def _load_library(self) -> bool:
+        from cocas.main import load_library_macros
+
+        self.library_macros = None
+        try:
+            self.library_macros = load_library_macros(self.target, self.cache)
+        except OSError as e:
+            log_os_error(e)
+            return False
+        except CdmException as e:
+            e.log()
+            return False
+        return True
+
+    def _load_object(self, i: int) -> bool:
+        from cocas.main import assemble_file
+
+        filepath = self.sources[i]
+        try:
+            with open(filepath, 'rb') as file:
+                data = file.read()
+            if filepath.endswith(OBJECT_FILE_SUFFIX):
+                # not memory-mapped, object file may be rewritten while we keep the module
+                self.objects[i] = load_object_module(data, filepath)
+                return True
+            absolute_path = str(pathlib.Path(filepath).absolute())
+            includes = find_includes(absolute_path, data)
+            # a change of any included file makes the source assembled again
+            self.include_stamps[i] = {path: _stamp(path) for path in includes}
+            key = None
+            if self.cache is not None:
+                key = self.cache.key(data, absolute_path, self.target, self.library_path.read_bytes(), includes)
+                self.objects[i] = self.cache.load(key)
+                if self.objects[i] is not None:
+                    return True
+            self.objects[i] = assemble_file(filepath, data, self.target, self.library_macros, includes=self.includes)
+            if self.cache is not None:
+                self.cache.store(key, self.objects[i])
+        except OSError as e:
+            log_os_error(e)
+        except CdmException as e:
+            e.log()
+        except CdmLinkException as e:
+            log_error(str(CdmExceptionTag.LINK), e.message)
+        else:
+            return True
+        self.objects[i] = None
+        return False
+
+    def _link(self) -> bool:
+        from cocas.main import write_debug_info, write_image
+
+        try:
+            data, code_locations = link(self.objects)
+        except CdmLinkException as e:
+            log_error(str(CdmExceptionTag.LINK), e.message)
+            return False
+        try:
+            write_image(self.output, data)
+            if self.debug is not None:
+                write_debug_info(self.debug, code_locations)
+        except OSError as e:
+            log_os_error(e)
+            return False
+        return True
+
+    def poll(self) -> Optional[bool]:
+        """
+        Check all files once and rebuild the image if some of them changed
+
+        :return: None if nothing changed, otherwise whether the image was written
+        """
+        start = time.perf_counter()
+        library_stamp = _stamp(str(self.library_path))
+        stamps = [_stamp(filepath) for filepath in self.sources]
+        changed = [i for i, stamp in enumerate(stamps) if stamp != self.stamps[i] or any(
+            _stamp(path) != include_stamp for path, include_stamp in self.include_stamps[i].items())]
+        if library_stamp == self.library_stamp and not changed:
+            return None
+
+        if library_stamp != self.library_stamp:
+            self.library_stamp = library_stamp
+            if not self._load_library():
+                return False
+            # expansion of library macros may change in every source file
+            changed = [i for i, filepath in enumerate(self.sources)
+                       if i in changed or not filepath.endswith(OBJECT_FILE_SUFFIX)]
+        elif self.library_macros is None:
+            # library failed to load and has not changed since then
+            return False
+
+        # stamps are taken before reading, so that a file saved during the build is picked up by the next poll
+        ok = True
+        for i in changed:
+            self.stamps[i] = stamps[i]
+            # every changed file is assembled, so that all errors are shown at once
+            ok = self._load_object(i) and ok
+        if not ok or any(obj is None for obj in self.objects):
+            return False
+        if not self._link():
+            return False
+        elapsed = (time.perf_counter() - start) * 1000
+        print(f'{Style.BRIGHT}{self.output}{Style.RESET_ALL} updated in {elapsed:.0f} ms, '
+              f'{len(changed)} of {len(self.sources)} files processed')
+        return True
+
+    def watch(self):
+        """Build the image and rebuild it after every change until interrupted"""
+        print('Watching for changes, press Ctrl+C to stop')
+        try:
+            while True:
+                self.poll()
+                time.sleep(self.interval)
+        except KeyboardInterrupt:
+            pass
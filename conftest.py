@@ -0,0 +1,2 @@
+# pytest puts the directory of this file on sys.path, so that tests import cocas and the checks from benchmarks
+# without installing the package
@@ -1,8 +1,6 @@
 import importlib
 import importlib.util
 import os.path
-import subprocess
-import sys
 from os import listdir
 from os.path import isfile
 from pathlib import Path
@@ -11,14 +9,14 @@ from tempfile import NamedTemporaryFile
 from colorama import init as color_init, Fore, Style
 
 from runners import LogisimRunner, EmulatorRunner, Runner, RunnerStatus
+from cocas.api import assemble_and_link
+from cocas.main import write_image
 
 required_keys = {"code"}
 optional_keys = {"r0", "r1", "r2", "r3", "sp", "ps", "pc", "mem"}
 
 # def print_error(name, )
 
-assembler_path = Path(__file__).parent.parent.joinpath('cocas/main.py')
-
 runners: list[Runner] = [LogisimRunner(), EmulatorRunner()]
 
 
@@ -53,63 +51,61 @@ def run_test(filename: str):
     if len(missing_keys := required_keys - test.keys()) != 0:
         return log(error(f"Missing required keys: {missing_keys}"))
 
+    success = True
+    assembled = assemble_and_link({f"{test_name}.asm": test["code"]})
+    if not assembled.ok:
+        log(error("Error assembling test, assembler output here:"))
+        for diagnostic in assembled.diagnostics:
+            print(f"[{diagnostic.tag}] {diagnostic.file}:{diagnostic.line} {diagnostic.message}")
+        return
     # TODO: always remove .img file
-    with NamedTemporaryFile(suffix=".asm", delete=True, mode='w') as asm_file:
-        success = True
-        asm_file.write(test["code"])
-        asm_file.flush()
-        img_file_name = os.path.splitext(asm_file.name)[0] + ".img"
-        asm_process = subprocess.run([sys.executable, str(assembler_path), '-i', img_file_name, asm_file.name], stderr=subprocess.STDOUT,
-                                     stdout=subprocess.PIPE, cwd=Path(__file__).parent.parent)
-        if asm_process.returncode != 0 or not os.path.exists(img_file_name):
-            log(error("Error assembling test, assembler output here:"))
-            print(asm_process.stdout.decode())
-            return
-        results = []
-
-        # run assembled code
-        for runner in runners:
-            status, result = runner.run(img_file_name, 10000)
-            if status != RunnerStatus.SUCCESS:
-                log(error(f"[{runner.name}] failed: {status.value}"))
-                success = False
-                continue
-            results.append(result)
-
-        # remove files generated by assembler
-        os.remove(img_file_name)
-        # os.remove(os.path.splitext(asm_file.name)[0] + ".obj")
-
-        # compare results with each other - they should match
-        for i in range(len(results)):
-            for j in range(i + 1, len(results)):
-                if results[i] != results[j]:
-                    r1 = results[i]
-                    r2 = results[j]
-                    log(warn(f"WARNING: results of {runners[i].name} and {runners[j].name} are different"))
-                    for reg_name in r1.regs.keys():
-                        if r1.regs[reg_name] != r2.regs[reg_name]:
-                            log(warn(f"{r1.runner_name}.{reg_name} = {r1.regs[reg_name]}; {r2.runner_name}.{reg_name} = {r2.regs[reg_name]}"))
-
-
-        # verify results
-        for result in results:
-            for reg_name, reg_value in result.regs.items():
-                if reg_name in test.keys():
-                    if test[reg_name] != reg_value:
-                        success = False
-                        log(error(f"ERROR: [{result.runner_name}]: registers do not match: {reg_name} = {reg_value}, expected {test[reg_name]}"))
-            if "mem" in test.keys():
-                mem_test: dict[int, list[int]] = test["mem"]
-                for offset, data in mem_test.items():
-                    if (result_data := result.mem[offset:offset + len(data)]) != data:
-                        success = False
-                        log(error(
-                            f"ERROR: [{result.runner_name}]: memory does not match at {hex(offset)}: got {result_data}, expected {data}"))
-        if success:
-            log(ok(f"Ok"))
-        else:
-            log(error(f"Failed"))
+    with NamedTemporaryFile(suffix=".img", delete=False) as img_file:
+        img_file_name = img_file.name
+    write_image(img_file_name, assembled.image)
+    results = []
+
+    # run assembled code
+    for runner in runners:
+        status, result = runner.run(img_file_name, 10000)
+        if status != RunnerStatus.SUCCESS:
+            log(error(f"[{runner.name}] failed: {status.value}"))
+            success = False
+            continue
+        results.append(result)
+
+    # remove image written for runners
+    os.remove(img_file_name)
+
+    # compare results with each other - they should match
+    for i in range(len(results)):
+        for j in range(i + 1, len(results)):
+            if results[i] != results[j]:
+                r1 = results[i]
+                r2 = results[j]
+                log(warn(f"WARNING: results of {runners[i].name} and {runners[j].name} are different"))
+                for reg_name in r1.regs.keys():
+                    if r1.regs[reg_name] != r2.regs[reg_name]:
+                        log(warn(f"{r1.runner_name}.{reg_name} = {r1.regs[reg_name]}; {r2.runner_name}.{reg_name} = {r2.regs[reg_name]}"))
+
+
+    # verify results
+    for result in results:
+        for reg_name, reg_value in result.regs.items():
+            if reg_name in test.keys():
+                if test[reg_name] != reg_value:
+                    success = False
+                    log(error(f"ERROR: [{result.runner_name}]: registers do not match: {reg_name} = {reg_value}, expected {test[reg_name]}"))
+        if "mem" in test.keys():
+            mem_test: dict[int, list[int]] = test["mem"]
+            for offset, data in mem_test.items():
+                if (result_data := result.mem[offset:offset + len(data)]) != data:
+                    success = False
+                    log(error(
+                        f"ERROR: [{result.runner_name}]: memory does not match at {hex(offset)}: got {result_data}, expected {data}"))
+    if success:
+        log(ok(f"Ok"))
+    else:
+        log(error(f"Failed"))
 
 
 if __name__ == "__main__":
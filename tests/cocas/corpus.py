@@ -0,0 +1,139 @@
+"""
+Sources that tests compare two implementations on: examples of every target and small cdm16 programs
+with macros, nested blocks, strings, comments and labels that are keywords. Random programs are
+generated by the checks in benchmarks, that tests share
+"""
+from pathlib import Path
+
+from cocas.api import get_library_macros, load_target
+from cocas.ast_builder import build_ast
+from cocas.code_block import Section
+from cocas.location import LineMarkTable
+from cocas.macro_processor import process_macros
+
+EXAMPLES = Path(__file__).parent.parent.parent / 'examples'
+
+CDM16_PROGRAMS = {
+    'blocks.asm': """\
+# functions with nested blocks and a macro that uses a block
+macro addc2/2
+    add $1, $2
+    if
+        tst $1
+    is mi
+        neg $1
+    fi
+mend
+
+rsect blocks
+helper: ext
+
+count>
+    push r4
+    while
+        dec r4
+    stays nz
+        if
+            cmp r0, r1
+        is lt, or
+            cmp r0, r2
+        is eq
+        then
+            addc2 r0, r1
+        else
+            do
+                shl r2
+                inc r3
+                tst r2
+            until z
+        fi
+        if
+            tst r3
+        is z
+            break
+        fi
+    wend
+    pop r4
+    jsr helper
+    rts
+end
+""",
+    'data.asm': """\
+asect 0x100
+start:  ldi r0, message     # address of the message
+        ldi r1, -1000 + 3
+        ldi r2, 0x7f
+        ldi r3, 0b1010
+end:    halt
+message:
+        dc "Hello, \\"world\\"!", 0
+        db 10, 13
+        ds 6
+if:     dc 1, 2, 3
+end
+
+rsect helpers
+helper>
+    ldi r0, start
+    rts
+end
+""",
+}
+
+# cdm8e program with external and relative references to high and low bytes of labels,
+# its object modules have every kind of records
+CDM8E_MODULES = {
+    'main.asm': """\
+asect 0x10
+start: ext
+        jsr start
+        halt
+
+rsect main
+far: ext
+start>
+        ldi r0, high(far + 300)
+        ldi r1, low(far)
+        ldi r2, high(here + 300)
+        ldi r3, low(here + 300)
+here:   rts
+end
+""",
+    'far.asm': """\
+rsect far
+far>    dc 1, 2, 3
+end
+""",
+}
+
+
+def sources() -> dict[str, tuple[str, str]]:
+    """
+    Collect the sources
+
+    :return: Mapping from file names to targets and source code
+    """
+    result = dict()
+    for target_dir in sorted(EXAMPLES.iterdir()):
+        for path in sorted(target_dir.glob('*.asm')):
+            result[str(path)] = (target_dir.name, path.read_text())
+    for name, text in CDM16_PROGRAMS.items():
+        result[f'cdm16/{name}'] = ('cdm16', text)
+    return result
+
+
+def expand(text: str, target: str, filepath: str) -> tuple[str, LineMarkTable]:
+    """Expand macros of the source, as cocas does before lexing, and return the text with its line marks"""
+    if not text.endswith('\n'):
+        text += '\n'
+    line_marks = LineMarkTable()
+    expanded = ''.join(process_macros(text, get_library_macros(target), filepath, line_marks).chunks())
+    return expanded, line_marks
+
+
+def assembled_sections(text: str, target: str) -> list[Section]:
+    """Sections of the source, assembled but not relaxed yet, absolute ones first"""
+    text, line_marks = expand(text, target, 'a.asm')
+    pn = build_ast(text, 'a.asm', line_marks)
+    target_instructions, code_segments = load_target(target)
+    return [Section(sn, target_instructions, code_segments) for sn in pn.absolute_sections + pn.relocatable_sections]
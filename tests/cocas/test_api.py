@@ -0,0 +1,63 @@
+import pytest
+
+from cocas.api import AssemblyResult, Diagnostic, assemble_and_link, assemble_text, get_library_macros
+from cocas.error import CdmException
+from cocas.linker import link
+from cocas.macro_processor import MacroDefinition
+from corpus import CDM8E_MODULES
+
+
+def test_assemble_text():
+    obj = assemble_text('asect 0x10\n    halt\nrsect r\nr> ldi r0, 1\nend', 'a.asm', 'cdm16', get_library_macros('cdm16'))
+    assert [(sect.address, sect.name) for sect in obj.asects + obj.rsects] == [(0x10, '$abs'), (0, 'r')]
+    assert obj.rsects[0].entries == {'r': 0}
+    assert [(location.file, location.line) for location in obj.asects[0].code_locations.values()] == [('a.asm', 2)]
+
+
+def test_assemble_text_error():
+    with pytest.raises(CdmException) as error:
+        assemble_text('asect 0\n    ldi r0, missing\nend\n', 'a.asm', 'cdm16', get_library_macros('cdm16'))
+    assert (error.value.file, error.value.line) == ('a.asm', 2)
+
+
+def test_assemble_and_link_text():
+    result = assemble_and_link('asect 0\n    halt\nend')
+    assert result.ok
+    assert result.diagnostics == []
+    assert len(result.image) == 2 ** 16
+    assert {address: (location.file, location.line) for address, location in result.code_locations.items()} == \
+           {0: ('<source>', 2)}
+
+
+def test_assemble_and_link_sources():
+    result = assemble_and_link(CDM8E_MODULES, target='CdM-8e')
+    objects = [assemble_text(text, name, 'cdm8e', get_library_macros('cdm8e')) for name, text in CDM8E_MODULES.items()]
+    assert result == AssemblyResult(*link(objects))
+
+
+@pytest.mark.parametrize('sources, target, diagnostic', [
+    ('asect 0\n    halt\nend\n', 'cdm9', Diagnostic('MAIN', None, None, 'Unknown target cdm9')),
+    ({}, 'cdm16', Diagnostic('MAIN', None, None, 'No sources provided')),
+    ({'a.asm': 'asect 0\nmacro m/0\n', 'b.asm': 'asect 2\nend\n'}, 'cdm16',
+     Diagnostic('Macro', 'a.asm', 3, "missing MACRO_FOOTER at '<EOF>'")),
+    ({'a.asm': 'asect 0\nend\n', 'b.asm': 'rsect r\n    halt\n    jsr missing\nend\n'}, 'cdm16',
+     Diagnostic('Assembler', 'b.asm', 3, 'Label "missing" not found')),
+    ({'a.asm': 'asect 0\nf: ext\n    jsr f\nend\n'}, 'cdm16', Diagnostic('Linker', None, None, 'Unresolved ext "f"')),
+])
+def test_diagnostics(sources, target, diagnostic):
+    result = assemble_and_link(sources, target)
+    assert not result.ok
+    assert result.diagnostics == [diagnostic]
+    assert result.code_locations == {}
+
+
+def test_get_library_macros():
+    macros = get_library_macros('cdm16')
+    assert get_library_macros('cdm16') is macros
+    assert isinstance(macros['nop'][0], MacroDefinition)
+    assert (macros['nop'][0].name, macros['nop'][0].arity) == ('nop', 0)
+    assert macros['nop'][0].location.file.endswith('standard.mlb')
+    assert get_library_macros('cdm8e')['tst'][1].location.file != macros['tst'][1].location.file
+    # macros of the library are expanded in every source, their lines are located at the call
+    result = assemble_and_link('asect 0\n    nop\n    halt\nend\n')
+    assert {address: location.line for address, location in result.code_locations.items()} == {0: 2, 2: 3}
@@ -0,0 +1,59 @@
+import pytest
+from antlr4 import CommonTokenStream, InputStream
+
+from cocas.error import AntlrErrorListener, CdmException, CdmExceptionTag, log_os_error, parse_two_stage
+from cocas.generated.MacroLexer import MacroLexer
+from cocas.generated.MacroParser import MacroParser
+
+
+def parser_maker(text: str, calls: list):
+    def make_parser() -> MacroParser:
+        calls.append(len(calls))
+        lexer = MacroLexer(InputStream(text))
+        lexer.removeErrorListeners()
+        lexer.addErrorListener(AntlrErrorListener(CdmExceptionTag.MACRO, 'a.asm'))
+        parser = MacroParser(CommonTokenStream(lexer))
+        parser.removeErrorListeners()
+        parser.addErrorListener(AntlrErrorListener(CdmExceptionTag.MACRO, 'a.asm'))
+        return parser
+
+    return make_parser
+
+
+def test_parsed_once():
+    calls = []
+    assert parse_two_stage(parser_maker('nop\nhalt\n', calls), 'program').getText() == 'nop\nhalt\n<EOF>'
+    assert calls == [0]
+
+
+@pytest.mark.parametrize('text', ['macro m/1\nnop\n', 'nop\nmend\n', 'nop\n"unterminated\n'])
+def test_errors_reported_by_second_stage(text):
+    calls = []
+    with pytest.raises(CdmException) as error:
+        parse_two_stage(parser_maker(text, calls), 'program')
+    assert calls == [0, 1]
+    with pytest.raises(CdmException) as expected:
+        parser_maker(text, [])().program()
+    assert (error.value.file, error.value.line, error.value.description) == \
+           (expected.value.file, expected.value.line, expected.value.description)
+
+
+def test_other_errors_not_hidden():
+    calls = []
+    make_parser = parser_maker('nop\n', calls)
+
+    def make_broken_parser():
+        parser = make_parser()
+        parser.program = lambda: 1 / 0
+        return parser
+
+    with pytest.raises(ZeroDivisionError):
+        parse_two_stage(make_broken_parser, 'program')
+    assert calls == [0]
+
+
+def test_log_os_error(capsys):
+    log_os_error(FileNotFoundError(2, 'No such file or directory', 'missing.asm'))
+    lines = capsys.readouterr().out.splitlines()
+    assert '[MAIN]' in lines[0]
+    assert lines[1].startswith('No such file or directory: ') and 'missing.asm' in lines[1]
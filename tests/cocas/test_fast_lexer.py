@@ -0,0 +1,24 @@
+import random
+
+import pytest
+
+from benchmarks.lexer_corpus import compare, fuzz_text
+from corpus import expand, sources
+
+
+def assert_same_tokens(name: str, text: str, rng: random.Random):
+    # the first difference is printed by compare
+    assert compare(name, text, rng, {'antlr': 0.0, 'fast': 0.0})
+
+
+@pytest.mark.parametrize('filepath', sources())
+def test_expanded_sources(filepath):
+    target, text = sources()[filepath]
+    assert_same_tokens(filepath, expand(text, target, filepath)[0], random.Random(filepath))
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_random_texts(seed):
+    rng = random.Random(seed)
+    for i in range(25):
+        assert_same_tokens(f'fuzz {i}', fuzz_text(rng), rng)
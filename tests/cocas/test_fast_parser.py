@@ -0,0 +1,28 @@
+import random
+
+import pytest
+
+from benchmarks.parser_corpus import compare, fuzz_line_marks, fuzz_program
+from corpus import expand, sources
+
+
+def assert_same_tree(name: str, text: str, filepath: str, line_marks):
+    """
+    FastAsmParser must build the same tree as AsmParser with BuildAstVisitor, or leave the program to them,
+    the first difference is printed by compare
+    """
+    assert compare(name, text, filepath, line_marks, {'antlr': 0.0, 'fast': 0.0, 'fallbacks': 0})
+
+
+@pytest.mark.parametrize('filepath', sources())
+def test_expanded_sources(filepath):
+    target, text = sources()[filepath]
+    text, line_marks = expand(text, target, filepath)
+    assert_same_tree(filepath, text, filepath, line_marks)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_random_programs(seed):
+    rng = random.Random(seed)
+    for i in range(25):
+        assert_same_tree(f'fuzz {i}', fuzz_program(rng), 'a.asm', fuzz_line_marks())
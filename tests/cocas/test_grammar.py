@@ -0,0 +1,44 @@
+import re
+import textwrap
+from pathlib import Path
+
+import pytest
+
+from cocas.ast_builder import build_ast
+from cocas.chunked_stream import ChunkedInputStream
+from cocas.error import CdmException
+from corpus import expand
+
+COCAS = Path(__file__).parent.parent.parent / 'cocas'
+
+
+@pytest.mark.parametrize('mark', ['fp-xyz', 'fp-9', 'fp-0x1', 'fp-1a'])
+def test_unknown_line_mark_file(mark):
+    text, line_marks = expand('asect 0\n    halt\n    halt\nend\n', 'cdm16', 'a.asm')
+    # a line mark that no file was registered for, as if it was written in the source
+    lines = text.split('\n')
+    lines.insert(lines.index('    halt') + 1, f'-| 3 {mark}')
+    with pytest.raises(CdmException) as error:
+        build_ast(ChunkedInputStream(['\n'.join(lines)], 'a.asm'), 'a.asm', line_marks)
+    assert (error.value.file, error.value.line) == ('a.asm', 3)
+    assert error.value.description == f'Unknown file of line mark: {mark}'
+
+
+def translate(action: str) -> str:
+    """Translate attributes of rules in an action, as ANTLR does for the Python target"""
+    action = re.sub(r'\$(\w+)\.text', r'(None if localctx._\1 is None else '
+                                      r'self._input.getText(localctx._\1.start,localctx._\1.stop))', action)
+    action = re.sub(r'\$(\w+)\.start', r'(None if localctx._\1 is None else localctx._\1.start)', action)
+    return re.sub(r'\$(\w+)', r'localctx.\1', action)
+
+
+def test_generated_parser_is_up_to_date():
+    """Members and actions of the grammar must be in the generated parser, which is regenerated by hand"""
+    grammar = (COCAS / 'grammar' / 'AsmParser.g4').read_text()
+    generated = (COCAS / 'generated' / 'AsmParser.py').read_text()
+    members = re.search(r'^@members \{\n(.*?)^}', grammar, re.MULTILINE | re.DOTALL)[1]
+    assert textwrap.indent(members, '    ') in generated
+    actions = re.findall(r'^ +\{(.*)}$', grammar, re.MULTILINE)
+    assert actions
+    for action in actions:
+        assert f'\n            {translate(action)}\n' in generated
@@ -0,0 +1,105 @@
+import os
+import sys
+
+import pytest
+
+from cocas.api import assemble_text, get_library_macros
+from cocas.error import CdmException
+from cocas.include import IncludeCache, find_includes
+from cocas.main import main
+
+
+def write(path, text: str) -> str:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+    return str(path)
+
+
+def assembled(filepath: str, includes=None):
+    with open(filepath) as file:
+        return assemble_text(file.read(), filepath, 'cdm16', get_library_macros('cdm16'), includes=includes)
+
+
+def test_relative_paths(tmp_path):
+    main_file = write(tmp_path / 'src' / 'main.asm', 'asect 0\n    include "inc/a.inc"\n    halt\nend\n')
+    write(tmp_path / 'src' / 'inc' / 'a.inc', 'a: ldi r0, 1\n    include "../b.inc"\n')
+    write(tmp_path / 'src' / 'b.inc', 'macro ld2/0\n    ldi r2, 2\nmend\nb: ld2\n')
+    obj = assembled(main_file)
+    assert bytes(obj.asects[0].data) == bytes(assembled(write(tmp_path / 'whole.asm', 'asect 0\na: ldi r0, 1\n'
+                                                               'b: ldi r2, 2\n    halt\nend\n')).asects[0].data)
+    # lines of every file are located in that file
+    assert {(os.path.relpath(location.file, tmp_path), location.line)
+            for location in obj.asects[0].code_locations.values()} == \
+           {(os.path.join('src', 'inc', 'a.inc'), 1), (os.path.join('src', 'b.inc'), 4),
+            (os.path.join('src', 'main.asm'), 3)}
+    assert set(find_includes(main_file, b'include "inc/a.inc"\n')) == \
+           {str(tmp_path / 'src' / 'inc' / 'a.inc'), str(tmp_path / 'src' / 'b.inc')}
+
+
+def test_missing_file(tmp_path):
+    main_file = write(tmp_path / 'main.asm', 'asect 0\n    halt\n    include "missing.inc"\nend\n')
+    with pytest.raises(CdmException) as error:
+        assembled(main_file)
+    assert (error.value.file, error.value.line) == (main_file, 3)
+    assert error.value.description == 'Cannot include missing.inc: No such file or directory'
+
+
+@pytest.mark.parametrize('text', ['include x.asm', 'l: include "x.asm"', 'include "x.asm", 1'])
+def test_bad_directive(tmp_path, text):
+    main_file = write(tmp_path / 'main.asm', f'asect 0\n    {text}\nend\n')
+    with pytest.raises(CdmException, match='Expected include "file" on a line of its own') as error:
+        assembled(main_file)
+    assert error.value.line == 2
+
+
+def test_self_include(tmp_path):
+    main_file = write(tmp_path / 'main.asm', 'asect 0\n    include "main.asm"\nend\n')
+    with pytest.raises(CdmException) as error:
+        assembled(main_file)
+    assert (error.value.file, error.value.line) == (main_file, 2)
+    assert error.value.description == f'File {main_file} includes itself'
+
+
+def test_cyclic_includes(tmp_path):
+    main_file = write(tmp_path / 'main.asm', 'asect 0\n    include "a.inc"\nend\n')
+    a = write(tmp_path / 'a.inc', 'halt\ninclude "b.inc"\n')
+    b = write(tmp_path / 'b.inc', 'halt\n\ninclude "a.inc"\n')
+    with pytest.raises(CdmException) as error:
+        assembled(main_file)
+    assert (error.value.file, error.value.line, error.value.description) == (b, 3, f'File {a} includes itself')
+    # files that include each other are found once
+    assert set(find_includes(main_file, b'include "a.inc"\n')) == {a, b}
+
+
+@pytest.mark.parametrize('text, line', [('halt\n\n    ldi r0, missing\n', 3), ('halt\nmacro\n', 2), ('halt\n    jmp\n', 2)])
+def test_errors_in_included_file(tmp_path, text, line):
+    main_file = write(tmp_path / 'main.asm', 'asect 0\n\n    include "a.inc"\n    halt\nend\n')
+    included = write(tmp_path / 'a.inc', text)
+    with pytest.raises(CdmException) as error:
+        assembled(main_file)
+    assert (error.value.file, error.value.line) == (included, line)
+
+
+def test_changed_file_parsed_again(tmp_path):
+    main_file = write(tmp_path / 'main.asm', 'asect 0\n    include "a.inc"\nend\n')
+    included = write(tmp_path / 'a.inc', 'ldi r0, 1\n')
+    includes = IncludeCache()
+    first = assembled(main_file, includes)
+    source = includes.get(included)
+    assert includes.get(included) is source
+    write(tmp_path / 'a.inc', 'ldi r0, 2\n')
+    assert bytes(assembled(main_file, includes).asects[0].data) != bytes(first.asects[0].data)
+    assert includes.get(included) is not source
+
+
+def test_changed_file_not_taken_from_cache(tmp_path, monkeypatch):
+    write(tmp_path / 'main.asm', 'asect 0\n    include "a.inc"\nend\n')
+    write(tmp_path / 'a.inc', 'ldi r0, 1\n')
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, 'argv', ['cocas', '--cache-dir', str(tmp_path / 'cache'), 'main.asm'])
+    assert main() is None
+    first = (tmp_path / 'out.img').read_bytes()
+    write(tmp_path / 'a.inc', 'ldi r0, 2\n')
+    assert main() is None
+    assert (tmp_path / 'out.img').read_bytes() != first
+    assert len(os.listdir(tmp_path / 'cache')) == 3
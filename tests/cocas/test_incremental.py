@@ -0,0 +1,29 @@
+import random
+
+import pytest
+
+from benchmarks.incremental_parsing import check, whole
+from benchmarks.parser_corpus import tree
+from cocas.api import get_library_macros
+from cocas.incremental import IncrementalParser
+from corpus import sources
+
+
+@pytest.mark.parametrize('filepath', sources())
+def test_random_edits(filepath):
+    """After every edit the tree must be the same as of the whole edited source, with locations of its nodes"""
+    target, text = sources()[filepath]
+    assert check(filepath, text, target, 10, random.Random(filepath)) == 0
+
+
+def test_earlier_trees_are_not_changed():
+    text = ''.join(f'rsect s{k}\n' + '    ldi r0, 1\n    if\n        tst r0\n    is z\n        inc r1\n    fi\n' * 20
+                   for k in range(3)) + 'end\n'
+    parser = IncrementalParser('a.asm', get_library_macros('cdm16'))
+    first = parser.parse(text)
+    expected = tree(first)
+    # lines of the unchanged sections after the edit move down, their nodes are shared with the first tree
+    second = parser.edit(0, 0, '# comment\n')
+    assert tree(first) == expected
+    assert tree(second) != expected
+    assert tree(second) == tree(whole('# comment\n' + text, 'a.asm', get_library_macros('cdm16')))
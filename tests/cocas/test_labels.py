@@ -0,0 +1,77 @@
+import pytest
+
+from cocas.assembler import LocalLabels
+from corpus import assembled_sections
+
+PROGRAM = """\
+asect 0x10
+a:  add r0, r1
+    if
+        tst r0
+    is z
+b:      halt
+    fi
+c:
+rsect r
+a:  ldi r0, 1
+d:  halt
+end
+"""
+
+
+def test_label_indices():
+    asect, rsect = assembled_sections(PROGRAM, 'cdm16')
+    # labels refer to the segments they precede, the last one to the end of the section
+    assert {name: i for name, i in asect.label_indices.items() if not name.startswith('$')} == \
+           {'a': 0, 'b': 3, 'c': 4}
+    assert len(asect.segments) == 4
+    # blocks add generated labels, that cannot be written in a source
+    assert any(name.startswith('$') for name in asect.label_indices)
+    assert rsect.label_indices == {'a': 0, 'd': 1}
+
+
+def test_label_addresses():
+    asect, _ = assembled_sections(PROGRAM, 'cdm16')
+    assert asect.labels['a'] == 0x10
+    assert asect.labels['b'] == 0x16
+    assert 'c' in asect.labels and 'd' not in asect.labels
+    assert list(asect.labels) == list(asect.label_indices)
+    assert len(asect.labels) == len(asect.label_indices)
+    with pytest.raises(KeyError):
+        _ = asect.labels['d']
+    # addresses follow sizes of segments
+    asect.segments[2].size += 2
+    asect.resize_segment(2, 2)
+    assert (asect.labels['a'], asect.labels['b'], asect.labels['c']) == (0x10, 0x18, 0x1a)
+
+
+def test_local_labels():
+    asect, rsect = assembled_sections(PROGRAM, 'cdm16')
+    labels = LocalLabels([asect, rsect])
+    # later sections take precedence, generated labels are not visible
+    assert labels['a'] == rsect.labels['a'] == 0
+    assert (labels['b'], labels['c'], labels['d']) == (0x16, 0x18, 2)
+    assert sorted(labels) == ['a', 'b', 'c', 'd']
+    assert len(labels) == 4
+    generated = next(name for name in asect.label_indices if name.startswith('$'))
+    assert generated not in labels
+    with pytest.raises(KeyError):
+        _ = labels[generated]
+    assert LocalLabels([rsect, asect])['a'] == 0x10
+
+
+def test_known_labels():
+    asect, rsect = assembled_sections(PROGRAM, 'cdm16')
+    labels = LocalLabels([rsect], {'a': 0x10, 'x': 5})
+    # labels with known addresses take precedence over labels of sections
+    assert (labels['a'], labels['x'], labels['d']) == (0x10, 5, 2)
+    assert sorted(labels) == ['a', 'd', 'x']
+    assert len(labels) == 3
+    assert 'e' not in labels
+
+
+def test_duplicate_labels():
+    with pytest.raises(Exception, match='Duplicate label "a" declaration'):
+        assembled_sections('rsect r\na: halt\na: halt\nend\n', 'cdm16')
+    with pytest.raises(Exception, match='Duplicate label "a" declaration'):
+        assembled_sections('rsect r\na: ext\na: halt\nend\n', 'cdm16')
@@ -0,0 +1,12 @@
+from cocas.api import assemble_text, get_library_macros
+from cocas.linker import link
+from corpus import CDM8E_MODULES
+
+
+def test_link_twice():
+    """Watch mode links the same object modules after every change"""
+    objects = [assemble_text(text, name, 'cdm8e', get_library_macros('cdm8e')) for name, text in CDM8E_MODULES.items()]
+    lower_parts = [sect.lower_parts.copy() for obj in objects for sect in obj.asects + obj.rsects]
+    image, code_locations = link(objects)
+    assert [sect.lower_parts for obj in objects for sect in obj.asects + obj.rsects] == lower_parts
+    assert link(objects) == (image, code_locations)
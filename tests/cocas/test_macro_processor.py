@@ -0,0 +1,163 @@
+import random
+import re
+
+import pytest
+
+import cocas.macro_processor
+from cocas.error import CdmException
+from cocas.location import LineMarkTable
+from cocas.macro_processor import MAX_EXPANSION_DEPTH, ExpandMacrosVisitor, MacroLine, MacroNonce, MacroParameter, \
+    MacroVariable, _prescan, compile_macro_line, parse_source, process_macros
+from corpus import sources
+
+
+def expanded(text: str, **kwargs) -> str:
+    return ''.join(process_macros(text, dict(), 'a.asm', LineMarkTable(), **kwargs).chunks())
+
+
+def nested(depth: int) -> str:
+    """Program with macros m1 ... m<depth>, every one of them calls the next one"""
+    macros = ''.join(f'macro m{i}/0\n    m{i + 1}\nmend\n' for i in range(1, depth))
+    return f'{macros}macro m{depth}/0\n    halt\nmend\nrsect r\n    m1\nend\n'
+
+
+@pytest.mark.parametrize('text, name', [
+    ('macro r/0\n    r\nmend\nrsect r\n    r\nend\n', 'r/0'),
+    ('macro a/1\n    b $1\nmend\nmacro b/1\n    a $1\nmend\nrsect r\n    a 1\nend\n', 'a/1'),
+])
+def test_recursive_macros(text, name):
+    with pytest.raises(CdmException) as error:
+        expanded(text)
+    assert error.value.description == \
+           f'Macros are nested deeper than {MAX_EXPANSION_DEPTH} levels, {name} may be recursive'
+    assert (error.value.file, error.value.line) == ('a.asm', text.count('\n') - 1)
+
+
+def test_max_depth():
+    assert expanded(nested(5), max_depth=5).count('halt') == 1
+    with pytest.raises(CdmException, match='Macros are nested deeper than 4 levels, m5/0 may be recursive'):
+        expanded(nested(5), max_depth=4)
+    # the limit is not reached by deep nesting that is not recursive
+    assert expanded(nested(MAX_EXPANSION_DEPTH)).count('halt') == 1
+
+
+MEMOIZED = """\
+macro one/1
+    ldi r0, $1
+mend
+macro twice/1
+    one $1
+    one $1
+mend
+macro label/0
+l':
+mend
+rsect r
+    twice 1
+    label
+    twice 1
+    label
+    twice 2
+    label
+end
+"""
+
+
+def test_memoized_calls_take_nonces():
+    """Calls expanded from the memo must take as many nonces as their expansion, so that later labels do not change"""
+    emv = ExpandMacrosVisitor(None, dict(), 'a.asm')
+    text = ''.join(emv.expand_source(parse_source(MEMOIZED, 'a.asm')))
+    assert ('twice', ('1',)) in emv.memo
+    # profiled expansions are not memoized
+    assert text == expanded(MEMOIZED, profile=dict())
+    labels = re.findall(r'^(l\d+):$', text, re.MULTILINE)
+    # twice/1 takes three nonces, one for itself and two for calls of one/1
+    assert labels == ['l4', 'l8', 'l12']
+
+
+# pieces of lines that the fast path of parse_source accepts or must leave to MacroParser
+PRESCAN_PIECES = [
+    'ldi', 'push', 'r0', 'r1', 'label', 'a.b', 'x+1', '-2', '(3)', 'addc2', ':', '>', ',', ' ', '\t', '# c',
+    '# "quote, comma', "# 'a", '"abc"', '"a,b"', '"a\\"b"', '"a#b"', '"a\'b"', "'x'", "','", "'#'", "'\\''", "'ab'",
+    '"', "'", '$1', "'", '?v', '{', '}', '@', 'macro', 'mend', 'macros', '\r',
+]
+
+
+def parsed_by_macro_parser(text: str, monkeypatch) -> object:
+    with monkeypatch.context() as patch:
+        patch.setattr(cocas.macro_processor, '_prescan', lambda _: None)
+        return parse_source(text, 'a.asm')
+
+
+def assert_same_lines(text: str, monkeypatch) -> bool:
+    """
+    Lines made by the fast path must be the same as of MacroParser, and lines that MacroParser rejects
+    must be left to it
+
+    :return: Whether the fast path was taken
+    """
+    if _prescan(text) is None:
+        return False
+    try:
+        expected = parsed_by_macro_parser(text, monkeypatch)
+    except CdmException:
+        pytest.fail('a line that MacroParser rejects is accepted by the fast path')
+    assert parse_source(text, 'a.asm') == expected
+    return True
+
+
+@pytest.mark.parametrize('filepath', sources())
+def test_prescan_sources(filepath, monkeypatch):
+    text = sources()[filepath][1]
+    # macro definitions are left to MacroParser, lines of the rest of the file are compared
+    code = re.sub(r'^macro.*?^mend$', '', text, flags=re.MULTILINE | re.DOTALL).rstrip('\n') + '\n'
+    assert assert_same_lines(code, monkeypatch)
+
+
+def test_prescan_lines(monkeypatch):
+    rng = random.Random(0)
+    fast = 0
+    for _ in range(2000):
+        lines = [''.join(rng.choice(PRESCAN_PIECES) for _ in range(rng.randrange(8))) for _ in range(rng.randrange(4))]
+        fast += assert_same_lines(''.join(line + '\n' for line in lines), monkeypatch)
+    assert fast > 100
+
+
+def test_compile_macro_line():
+    line = MacroLine(['l', MacroParameter(1), 'x', MacroNonce(), ': '], ['ldi'],
+                     [[' ', MacroParameter(2)], [' "{', MacroParameter(0), '}"', MacroVariable(['v', MacroParameter(1)])]])
+    template = compile_macro_line(line, 2)
+    # $0 is the last parameter, braces of the text are not fields
+    assert template.text == 'l{0}x{nonce}: ldi {1}, "{{{1}}}"{v0}\n'
+    assert template.variables == [('v0', 'v{0}')]
+    assert template.static_instruction == 'ldi'
+    assert not template.stateless
+    assert template.text.format('a', '{b}', nonce=7, v0='r3') == 'lax7: ldi {b}, "{{b}}"r3\n'
+
+
+TEMPLATES = """\
+macro m/2
+    dc "{$1}", '{', '}', "}{0}"
+l$1x$2: ldi $2, $1+1
+    ldi r0, '$'
+    dc "a'b", '\\'', $0
+nl': jmp nl'
+mend
+rsect r
+    m 5, r1
+    m "{0}", r2
+end
+"""
+
+
+def test_expanded_templates():
+    """Braces and dollar signs in strings are text, parameters are substituted next to other text"""
+    lines = [line for line in expanded(TEMPLATES).split('\n') if not line.startswith('-|')]
+    assert lines == [
+        'rsect r',
+        '    dc "{$1}", \'{\', \'}\', "}{0}"', 'l5xr1: ldi r1, 5+1', "    ldi r0, '$'", '    dc "a\'b", \'\\\'\', r1',
+        'nl1: jmp nl1',
+        '    dc "{$1}", \'{\', \'}\', "}{0}"', 'l"{0}"xr2: ldi r2, "{0}"+1', "    ldi r0, '$'",
+        '    dc "a\'b", \'\\\'\', r2', 'nl2: jmp nl2',
+        'end', '',
+    ]
@@ -0,0 +1,20 @@
+import sys
+
+import pytest
+
+from cocas.main import main
+
+
+@pytest.mark.parametrize('args, error', [
+    (['-t', 'cdm-99', 'a.asm'], 'unknown target'),
+    ([], 'no source files'),
+    (['-j', '0', 'a.asm'], 'number of jobs'),
+    (['-w', '-c', 'a.asm'], 'watch mode'),
+    (['-c', 'a.obj'], 'object files cannot be compiled'),
+    (['-c', '-o', 'a.obj', 'a.asm', 'b.asm'], 'output file name'),
+    (['-c', 'a.asm', 'a/a.asm'], 'would both be written'),
+])
+def test_argument_errors(monkeypatch, capsys, args, error):
+    monkeypatch.setattr(sys, 'argv', ['cocas', *args])
+    assert main() == 1
+    assert error in capsys.readouterr().out
@@ -0,0 +1,117 @@
+import os
+import pickle
+import sys
+
+import pytest
+
+import cocas.macro_processor
+import cocas.main
+import cocas.object_cache
+from cocas.api import assemble_text, get_library_macros
+from cocas.main import main
+from cocas.object_cache import ObjectCache, code_digest, dump_macros, load_macros
+from corpus import CDM8E_MODULES
+
+KEY_ARGS = dict(source=b'nop\n', filepath='/a.asm', target='cdm16', library=b'macro', includes={'/b.asm': b'end\n'})
+
+
+def test_key_changes_with_inputs():
+    key = ObjectCache.key(**KEY_ARGS)
+    assert ObjectCache.key(**KEY_ARGS) == key
+    for name, value in [('source', b'halt\n'), ('filepath', '/b.asm'), ('target', 'cdm8e'), ('library', b'macros'),
+                        ('includes', {'/b.asm': b'end\n\n'}), ('includes', {'/c.asm': b'end\n'}), ('includes', None)]:
+        assert ObjectCache.key(**(KEY_ARGS | {name: value})) != key, name
+
+
+def test_key_changes_with_code(monkeypatch):
+    key = ObjectCache.key(**KEY_ARGS)
+    library_key = ObjectCache.library_key(b'macro', '/standard.mlb')
+    monkeypatch.setattr(cocas.object_cache, 'code_digest', lambda: b'another version')
+    assert ObjectCache.key(**KEY_ARGS) != key
+    assert ObjectCache.library_key(b'macro', '/standard.mlb') != library_key
+
+
+def test_code_digest():
+    assert len(code_digest()) == 32
+    assert code_digest() == code_digest()
+
+
+def test_evict_least_recently_used(tmp_path):
+    obj = assemble_text(CDM8E_MODULES['far.asm'], 'far.asm', 'cdm8e', get_library_macros('cdm8e'))
+    cache = ObjectCache(str(tmp_path), 0)
+    for i, key in enumerate('abcd'):
+        cache.store(key, obj)
+        os.utime(tmp_path / f'{key}.obj', (i, i))
+    size = os.path.getsize(tmp_path / 'a.obj')
+    # loading an entry makes it the most recently used one
+    assert cache.load('a') is not None
+    cache.size_limit = 2 * size
+    cache.evict()
+    assert sorted(os.listdir(tmp_path)) == ['a.obj', 'd.obj']
+    cache.size_limit = 0
+    cache.evict()
+    assert os.listdir(tmp_path) == []
+
+
+def run_cocas(monkeypatch, *args: str):
+    monkeypatch.setattr(sys, 'argv', ['cocas', *args])
+    return main()
+
+
+def test_cache_size(tmp_path, monkeypatch):
+    for name, text in CDM8E_MODULES.items():
+        (tmp_path / name).write_text(text)
+    monkeypatch.chdir(tmp_path)
+    cache_dir = tmp_path / 'cache'
+    assert run_cocas(monkeypatch, '-t', 'cdm8e', '--cache-dir', str(cache_dir), 'main.asm', 'far.asm') is None
+    assert sorted(os.path.splitext(name)[1] for name in os.listdir(cache_dir)) == ['.mlb', '.obj', '.obj']
+    image = (tmp_path / 'out.img').read_bytes()
+    # files found in cache make the same image
+    assert run_cocas(monkeypatch, '-t', 'cdm8e', '--cache-dir', str(cache_dir), 'main.asm', 'far.asm') is None
+    assert (tmp_path / 'out.img').read_bytes() == image
+    assert run_cocas(monkeypatch, '-t', 'cdm8e', '--cache-dir', str(cache_dir), '--cache-size', '0',
+                     'main.asm', 'far.asm') is None
+    assert os.listdir(cache_dir) == []
+
+
+def test_no_cache(tmp_path, monkeypatch):
+    for name, text in CDM8E_MODULES.items():
+        (tmp_path / name).write_text(text)
+    monkeypatch.chdir(tmp_path)
+    cache_dir = tmp_path / 'cache'
+    assert run_cocas(monkeypatch, '-t', 'cdm8e', '--cache-dir', str(cache_dir), '--no-cache',
+                     'main.asm', 'far.asm') is None
+    assert (tmp_path / 'out.img').exists()
+    assert not cache_dir.exists()
+
+
+@pytest.mark.parametrize('target', ['cdm8e', 'cdm16'])
+def test_macros_round_trip(target, tmp_path):
+    macros = get_library_macros(target)
+    cache = ObjectCache(str(tmp_path), 2 ** 20)
+    cache.store_macros('k', macros)
+    assert cache.load_macros('k') == macros
+    assert load_macros(dump_macros(macros)) == macros
+
+
+@pytest.mark.parametrize('data', [b'', b'{', b'\xff', b'{}', b'[1]', b'[{"name": "m"}]', b'[{"name": "m", "arity": 0, '
+                                  b'"lines": [[["a"], [true], [[]]]], "location": ["a.mlb", 1, 0]}]',
+                                  pickle.dumps({'m': {0: 'macro'}})])
+def test_corrupted_macros(data, tmp_path):
+    (tmp_path / 'k.mlb').write_bytes(data)
+    assert ObjectCache(str(tmp_path), 2 ** 20).load_macros('k') is None
+
+
+def test_changed_library(tmp_path, monkeypatch):
+    library = tmp_path / 'standard.mlb'
+    library.write_text('*m/0\n    halt\n')
+    monkeypatch.setattr(cocas.main, 'library_path', lambda _: library)
+    cache = ObjectCache(str(tmp_path / 'cache'), 2 ** 20)
+    assert cocas.main.load_library_macros('cdm16', cache)['m'][0].lines[0].instruction_pieces == ['halt']
+    # the macros are loaded from cache while the library stays the same
+    with monkeypatch.context() as patch:
+        patch.setattr(cocas.macro_processor, 'read_mlb', None)
+        assert cocas.main.load_library_macros('cdm16', cache)['m'][0].lines[0].instruction_pieces == ['halt']
+    library.write_text('*m/0\n    wait\n')
+    assert cocas.main.load_library_macros('cdm16', cache)['m'][0].lines[0].instruction_pieces == ['wait']
+    assert len(os.listdir(tmp_path / 'cache')) == 2
@@ -0,0 +1,95 @@
+import struct
+import sys
+
+import pytest
+
+from cocas.api import assemble_text, get_library_macros
+from cocas.error import CdmLinkException
+from cocas.linker import link
+from cocas.main import main
+from cocas.object_file import MAGIC, VERSION, dump_object_module, load_object_module, read_object_file, \
+    write_object_file
+from cocas.object_module import ObjectModule
+from corpus import CDM8E_MODULES, CDM16_PROGRAMS
+
+
+def sections(obj: ObjectModule) -> list[tuple]:
+    return [(s.address, s.name, bytes(s.data), s.entries, s.external, s.relative, s.lower_parts, s.code_locations,
+             s.alignment) for s in obj.asects + obj.rsects]
+
+
+def assembled(target: str, name: str, text: str) -> ObjectModule:
+    return assemble_text(text, name, target, get_library_macros(target))
+
+
+@pytest.mark.parametrize('target, name, text', [('cdm8e', name, text) for name, text in CDM8E_MODULES.items()] +
+                         [('cdm16', name, text) for name, text in CDM16_PROGRAMS.items()])
+def test_round_trip(target, name, text):
+    obj = assembled(target, name, text)
+    data = dump_object_module(obj)
+    loaded = load_object_module(data)
+    assert sections(loaded) == sections(obj)
+    assert dump_object_module(loaded) == data
+
+
+def test_files_link_as_modules(tmp_path):
+    objects = [assembled('cdm8e', name, text) for name, text in CDM8E_MODULES.items()]
+    expected = link(objects)
+    paths = []
+    for i, obj in enumerate(objects):
+        paths.append(str(tmp_path / f'{i}.obj'))
+        write_object_file(paths[-1], obj)
+    assert link([read_object_file(path) for path in paths]) == expected
+
+
+def test_bad_magic():
+    data = bytearray(dump_object_module(assembled('cdm8e', 'far.asm', CDM8E_MODULES['far.asm'])))
+    data[:4] = b'CDMX'
+    with pytest.raises(CdmLinkException, match='Not an object file: x.obj'):
+        load_object_module(data, 'x.obj')
+
+
+def test_bad_version():
+    data = bytearray(dump_object_module(assembled('cdm8e', 'far.asm', CDM8E_MODULES['far.asm'])))
+    data[4:6] = struct.pack('<H', VERSION + 1)
+    with pytest.raises(CdmLinkException, match=f'Unsupported object file version {VERSION + 1}: x.obj'):
+        load_object_module(data, 'x.obj')
+
+
+def test_truncated():
+    data = dump_object_module(assembled('cdm8e', 'main.asm', CDM8E_MODULES['main.asm']))
+    for size in range(len(MAGIC), len(data)):
+        with pytest.raises(CdmLinkException, match='Corrupted object file: x.obj'):
+            load_object_module(data[:size], 'x.obj')
+
+
+def test_empty_file(tmp_path):
+    path = tmp_path / 'empty.obj'
+    path.write_bytes(b'')
+    with pytest.raises(CdmLinkException, match='Not an object file'):
+        read_object_file(str(path))
+
+
+def run_cocas(monkeypatch, *args: str):
+    monkeypatch.setattr(sys, 'argv', ['cocas', *args])
+    return main()
+
+
+def test_compile_same_names(tmp_path, monkeypatch, capsys):
+    for directory in ('a', 'b'):
+        (tmp_path / directory).mkdir()
+        (tmp_path / directory / 'x.asm').write_text(CDM8E_MODULES['far.asm'])
+    monkeypatch.chdir(tmp_path)
+    assert run_cocas(monkeypatch, '-t', 'cdm8e', '-c', '--no-cache', 'a/x.asm', 'b/x.asm') == 1
+    assert 'a/x.asm and b/x.asm would both be written to x.obj' in capsys.readouterr().out
+    assert not (tmp_path / 'x.obj').exists()
+
+
+def test_compile_and_link(tmp_path, monkeypatch):
+    for name, text in CDM8E_MODULES.items():
+        (tmp_path / name).write_text(text)
+    monkeypatch.chdir(tmp_path)
+    assert run_cocas(monkeypatch, '-t', 'cdm8e', '-c', '--no-cache', 'main.asm', 'far.asm') is None
+    assert run_cocas(monkeypatch, '-t', 'cdm8e', '--no-cache', 'main.obj', 'far.obj', '-o', 'obj.img') is None
+    assert run_cocas(monkeypatch, '-t', 'cdm8e', '--no-cache', 'main.asm', 'far.asm', '-o', 'asm.img') is None
+    assert (tmp_path / 'obj.img').read_bytes() == (tmp_path / 'asm.img').read_bytes()
@@ -0,0 +1,45 @@
+import random
+
+import pytest
+
+import cocas.ast_builder
+import cocas.fast_parser
+from benchmarks.parser_corpus import fuzz_line_marks, tree
+from benchmarks.section_parsing import compare, fuzz_sections
+from cocas.ast_builder import build_ast
+from cocas.chunked_stream import ChunkedInputStream
+from corpus import expand, sources
+
+
+@pytest.mark.parametrize('filepath', sources())
+def test_expanded_sources(filepath):
+    target, text = sources()[filepath]
+    text, line_marks = expand(text, target, filepath)
+    assert compare(filepath, text, filepath, line_marks, 4, {'chunks': 0, 'whole': 0, 'errors': 0})
+
+
+def test_random_programs():
+    rng = random.Random(0)
+    counts = {'chunks': 0, 'whole': 0, 'errors': 0}
+    for i in range(500):
+        assert compare(f'fuzz {i}', fuzz_sections(rng), 'a.asm', fuzz_line_marks(), 4, counts)
+    assert counts['chunks'] > 0
+
+
+def test_worker_processes(monkeypatch):
+    calls = []
+
+    def parse_in_chunks(*args):
+        result = cocas.fast_parser.parse_in_chunks(*args)
+        calls.append(result is not None)
+        return result
+
+    # programs this small are parsed in worker processes only with the threshold lowered
+    monkeypatch.setattr(cocas.ast_builder, 'PARALLEL_MIN_LENGTH', 0)
+    monkeypatch.setattr(cocas.ast_builder, 'parse_in_chunks', parse_in_chunks)
+    text = ''.join(f'rsect table{k}\ntable{k}>\n    dc {k}, {k + 1}\n    rts\n' for k in range(8)) + 'end\n'
+    text, line_marks = expand(text, 'cdm16', 'tables.asm')
+    trees = [tree(build_ast(ChunkedInputStream([text], 'tables.asm'), 'tables.asm', line_marks, jobs=jobs))
+             for jobs in (1, 2)]
+    assert calls == [True]
+    assert trees[0] == trees[1]
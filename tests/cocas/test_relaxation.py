@@ -0,0 +1,65 @@
+import random
+from itertools import accumulate
+
+import pytest
+
+from cocas.api import assemble_text, get_library_macros
+from cocas.assembler import update_varying_length
+from cocas.linker import link
+from cocas.relaxation import SegmentOffsets
+from cocas.stats import FileStats
+from corpus import assembled_sections
+
+
+def offsets(sizes: list[int]) -> list[int]:
+    return list(accumulate(sizes, initial=0))
+
+
+@pytest.mark.parametrize('count', [0, 1, 2, 3, 7, 8, 9, 16, 33])
+def test_segment_offsets(count):
+    rng = random.Random(count)
+    sizes = [rng.randrange(5) for _ in range(count)]
+    tree = SegmentOffsets(list(accumulate(sizes, initial=0x100)))
+    assert [tree.offset(i) for i in range(count + 1)] == offsets(sizes)
+    for _ in range(3 * count):
+        index = rng.randrange(count)
+        diff = rng.randrange(-sizes[index], 5)
+        sizes[index] += diff
+        tree.add(index, diff)
+        assert [tree.offset(i) for i in range(count + 1)] == offsets(sizes)
+
+
+# ldi r1 fits into 2 bytes, until ldi r0 after it grows, so the second pass is needed
+GROWING = """\
+asect 0x10
+    ldi r1, a
+    ldi r0, b
+    ds 42
+a:  ds 2
+b:  halt
+end
+"""
+
+
+def test_fixed_point():
+    stats = FileStats()
+    sect, = assembled_sections(GROWING, 'cdm16')
+    update_varying_length([sect], {}, {}, stats)
+    assert (stats.relaxation_iterations, stats.resized_segments) == (3, 2)
+    assert dict(sect.labels) == {'a': 0x10 + 4 + 4 + 42, 'b': 0x10 + 4 + 4 + 42 + 2}
+    # addresses follow sizes of segments, and another pass changes nothing
+    addresses = [sect.address + offset for offset in offsets([seg.size for seg in sect.segments])]
+    assert [sect.segment_address(i) for i in range(len(sect.segments) + 1)] == addresses
+    update_varying_length([sect], {}, {}, stats)
+    assert (stats.relaxation_iterations, stats.resized_segments) == (4, 2)
+
+
+def test_asect_code_locations():
+    """Code locations of an asect after a grown segment are at their addresses in the image"""
+    library_macros = get_library_macros('cdm16')
+    obj = assemble_text(GROWING, 'a.asm', 'cdm16', library_macros)
+    assert {offset: location.line for offset, location in obj.asects[0].code_locations.items()} == \
+           {0: 2, 4: 3, 8: 4, 50: 5, 52: 6}
+    _, code_locations = link([obj])
+    assert {address: location.line for address, location in code_locations.items()} == \
+           {0x10: 2, 0x14: 3, 0x18: 4, 0x42: 5, 0x44: 6}
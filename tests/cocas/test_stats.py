@@ -0,0 +1,117 @@
+import json
+import sys
+import time
+import tracemalloc
+
+from cocas.api import assemble_text, get_library_macros
+from cocas.ast_builder import build_ast
+from cocas.ast_nodes import BreakStatementNode, UntilLoopNode
+from cocas.chunked_stream import ChunkedInputStream
+from cocas.location import NO_LOCATION
+from cocas.main import main
+from cocas.stats import BUILD_STAGES, FILE_STAGES, BuildStats, FileStats, count_ast_nodes, stage_items
+from corpus import CDM8E_MODULES, expand
+
+STAGE_KEYS = {'wall', 'cpu', 'peak_memory'}
+FILE_KEYS = {'stages', 'cached', 'tokens', 'ast_nodes', 'segments', 'resized_segments', 'relaxation_iterations',
+             'macros'}
+
+
+def run_cocas(monkeypatch, *args: str):
+    monkeypatch.setattr(sys, 'argv', ['cocas', *args])
+    return main()
+
+
+def check_stages(stages: dict, names: list[str]):
+    assert set(stages) <= set(names)
+    for stage in stages.values():
+        assert set(stage) == STAGE_KEYS
+        assert all(isinstance(value, (int, float)) and value >= 0 for value in stage.values())
+
+
+def test_stats_json(tmp_path, monkeypatch):
+    for name, text in CDM8E_MODULES.items():
+        (tmp_path / name).write_text(text)
+    (tmp_path / 'tst.asm').write_text('rsect tst\n    tst r0\n    tst r1\nend\n')
+    monkeypatch.chdir(tmp_path)
+    args = ['-t', 'cdm8e', '--cache-dir', str(tmp_path / 'cache'), '--stats-json', 'stats.json',
+            'main.asm', 'far.asm', 'tst.asm']
+    for cached in (False, True):
+        assert run_cocas(monkeypatch, *args) is None
+        stats = json.loads((tmp_path / 'stats.json').read_text())
+        assert set(stats) == {'stages', 'files'}
+        check_stages(stats['stages'], BUILD_STAGES)
+        assert {'library', 'cache', 'link', 'output'} <= set(stats['stages'])
+        assert list(stats['files']) == ['main.asm', 'far.asm', 'tst.asm']
+        for file_stats in stats['files'].values():
+            assert set(file_stats) == FILE_KEYS
+            assert file_stats['cached'] == cached
+            check_stages(file_stats['stages'], FILE_STAGES)
+            # the ast stage is only for programs that FastAsmParser leaves to AsmParser
+            assert set(file_stats['stages']) == (set() if cached else set(FILE_STAGES) - {'ast'})
+            assert (file_stats['tokens'] > 0) != cached
+            for macro_stats in file_stats['macros'].values():
+                assert set(macro_stats) == {'calls', 'lines', 'max_depth', 'time'}
+        if not cached:
+            assert stats['files']['tst.asm']['macros']['tst/1']['calls'] == 2
+
+
+def test_nested_stages():
+    """Memory peaks of stages of files are a part of the peaks of build stages they are nested in"""
+    build = BuildStats()
+    tracemalloc.start()
+    try:
+        with build.stage('assembly'):
+            file_stats = FileStats(outer=build)
+            with file_stats.stage('macros'):
+                data = bytearray(2 ** 20)
+                del data
+            with file_stats.stage('lexing'):
+                pass
+    finally:
+        tracemalloc.stop()
+    assert file_stats.stages['macros'].peak_memory >= 2 ** 20
+    assert file_stats.stages['lexing'].peak_memory < 2 ** 20
+    assert build.stages['assembly'].peak_memory >= 2 ** 20
+    assert 'outer' not in build.to_dict()
+
+
+def test_stage_items():
+    """Time of producing lazy items is counted in their stage, not in the stage that consumes them"""
+    stats = FileStats()
+
+    def items():
+        for _ in range(3):
+            time.sleep(0.02)
+            yield 'x'
+
+    with stats.stage('lexing'):
+        assert list(stage_items(stats, 'macros', items())) == ['x'] * 3
+    assert stats.stages['macros'].wall >= 0.06
+    assert stats.stages['lexing'].wall < 0.02
+    assert stage_items(None, 'macros', ['x']) == ['x']
+
+
+def test_macro_expansion_stage():
+    text = 'rsect r\n' + '    tst r0\n' * 2000 + 'end\n'
+    stats = FileStats()
+    assemble_text(text, 'a.asm', 'cdm16', get_library_macros('cdm16'), stats)
+    assert stats.macros['tst/1'].calls == 2000
+    # macros are expanded while the lexer reads the text, but it is still a part of the macros stage
+    assert stats.stages['macros'].wall >= stats.macros['tst/1'].time > 0
+
+
+def test_count_ast_nodes():
+    text, line_marks = expand('rsect r\n    if\n        tst r0\n    is z\n        inc r0\n    fi\nend\n', 'cdm16', 'a.asm')
+    program = build_ast(ChunkedInputStream([text], 'a.asm'), 'a.asm', line_marks)
+    # program, section, conditional statement, condition, and two instructions with three registers and a number
+    assert count_ast_nodes(program) == 10
+    assert count_ast_nodes([]) == 0
+    assert count_ast_nodes(get_library_macros('cdm16')) == 0
+
+
+def test_count_deep_ast_nodes():
+    node = BreakStatementNode()
+    for _ in range(sys.getrecursionlimit() * 2):
+        node = UntilLoopNode([node], 'eq', NO_LOCATION)
+    assert count_ast_nodes(node) == sys.getrecursionlimit() * 2 + 1